@@ -0,0 +1,141 @@
+"""
+Reports the size of the logs transform's output in the full and compact
+forms, raw and gzipped, on a synthetic corpus shaped like broker Postgres
+logs.
+
+    python benchmarks/bench_compact_logs.py
+"""
+
+import gzip
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import (  # noqa: E402
+    CompactLogEventTemplate,
+    LogEventTemplate,
+    get_codec,
+)
+from lambda_functions.tag_cache import EncodedTags  # noqa: E402
+
+INSTANCES = 40
+DOCUMENTS = 2000
+SEED = 1
+
+MESSAGES = [
+    "{ts} UTC:10.0.{a}.{b}(5{c:04d}):{user}@{db}:[{pid}]:LOG:  duration: {ms}.{us} ms"
+    "  statement: SELECT id, name, updated_at FROM records WHERE org_id = ${c}",
+    "{ts} UTC::@:[{pid}]:LOG:  checkpoint complete: wrote {c} buffers ({ms}.{us}%); "
+    "0 WAL file(s) added, 0 removed, 1 recycled; write={ms}.{us} s, sync=0.002 s",
+    "{ts} UTC:10.0.{a}.{b}(5{c:04d}):{user}@{db}:[{pid}]:LOG:  connection "
+    "authorized: user={user} database={db} SSL enabled (protocol=TLSv1.3)",
+    "{ts} UTC:10.0.{a}.{b}(5{c:04d}):{user}@{db}:[{pid}]:ERROR:  duplicate key value "
+    'violates unique constraint "records_pkey"',
+    '{ts} UTC::@:[{pid}]:LOG:  automatic vacuum of table "{db}.public.records": '
+    "index scans: 1 pages: 0 removed, {c} remain, 0 skipped due to pins",
+]
+
+
+def tags_for(instance, rng):
+    def guid():
+        return "%08x-%04x-4%03x-8%03x-%012x" % (
+            rng.getrandbits(32),
+            rng.getrandbits(16),
+            rng.getrandbits(12),
+            rng.getrandbits(12),
+            rng.getrandbits(48),
+        )
+
+    return EncodedTags(
+        {
+            "Organization GUID": guid(),
+            "Organization name": f"agency-{instance}",
+            "Space GUID": guid(),
+            "Space name": "prod",
+            "Instance GUID": guid(),
+            "Instance name": f"app-db-{instance}",
+            "Service offering name": "aws-rds",
+            "Service plan name": "medium-gp-psql",
+            "Plan GUID": guid(),
+            "broker": "AWS Broker",
+            "environment": "production",
+            "client": "Cloud Foundry",
+            "Created at": "2024-03-01T12:00:00Z",
+        }
+    )
+
+
+def build_corpus():
+    rng = random.Random(SEED)
+    instances = [
+        (f"cg-aws-broker-prod{rng.getrandbits(40):010x}", tags_for(i, rng))
+        for i in range(INSTANCES)
+    ]
+    corpus = []
+    for _ in range(DOCUMENTS):
+        name, tags = rng.choice(instances)
+        # Subscription deliveries batch anywhere from one event to hundreds
+        count = min(500, int(rng.expovariate(1 / 40)) + 1)
+        start = 1704067200000 + rng.randrange(3600000)
+        events = []
+        for i in range(count):
+            events.append(
+                {
+                    "id": str(rng.getrandbits(64)),
+                    "timestamp": start + i * rng.randrange(1, 50),
+                    "message": rng.choice(MESSAGES).format(
+                        ts="2024-01-01 00:%02d:%02d" % (i // 60 % 60, i % 60),
+                        a=rng.randrange(256),
+                        b=rng.randrange(256),
+                        c=rng.randrange(10000),
+                        user="u_" + name[-6:],
+                        db="db_" + name[-6:],
+                        pid=rng.randrange(1000, 65000),
+                        ms=rng.randrange(1000),
+                        us=rng.randrange(1000),
+                    ),
+                }
+            )
+        corpus.append(
+            (f"/aws/rds/instance/{name}/postgresql", f"{name}.0", tags, events)
+        )
+    return corpus
+
+
+def render(template_class, corpus, codec):
+    out = bytearray()
+    for log_group, log_stream, tags, events in corpus:
+        template = template_class(codec, log_group, log_stream, tags)
+        template.begin(out)
+        for event in events:
+            template.write(out, event)
+    return bytes(out)
+
+
+def main():
+    codec = get_codec()
+    corpus = build_corpus()
+    events = sum(len(events) for *_, events in corpus)
+    print(f"{DOCUMENTS} log documents, {events} events, {INSTANCES} instances")
+    sizes = {}
+    for name, template_class in (
+        ("full", LogEventTemplate),
+        ("compact", CompactLogEventTemplate),
+    ):
+        raw = render(template_class, corpus, codec)
+        sizes[name] = (len(raw), len(gzip.compress(raw)))
+        print(
+            f"{name:>8}: raw {sizes[name][0] / 2**20:7.2f} MiB, "
+            f"gzip {sizes[name][1] / 2**20:6.2f} MiB"
+        )
+    (full_raw, full_gz), (compact_raw, compact_gz) = sizes["full"], sizes["compact"]
+    print(
+        f"   saved: raw {1 - compact_raw / full_raw:7.1%}, "
+        f"gzip {1 - compact_gz / full_gz:6.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
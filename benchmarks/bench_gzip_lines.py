@@ -0,0 +1,94 @@
+"""
+Compares peak memory and time of the log transform's record decompression
+and line split, gzip.decompress plus strip().splitlines() against the
+streaming iter_gzip_lines, on records of a few large NDJSON documents.
+
+    python benchmarks/bench_gzip_lines.py
+"""
+
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import get_codec, iter_gzip_lines  # noqa: E402
+
+DOCUMENTS = 8
+EVENTS_PER_DOCUMENT = 2000
+REPEAT = 5
+
+
+def build_record():
+    documents = []
+    for d in range(DOCUMENTS):
+        document = {
+            "messageType": "DATA_MESSAGE",
+            "owner": "123456789012",
+            "logGroup": "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",
+            "logStream": f"cg-aws-broker-prodtenant.{d}",
+            "subscriptionFilters": ["firehose_for_opensearch"],
+            "logEvents": [
+                {
+                    "id": f"{d}{i:06d}",
+                    "timestamp": 1640995200000 + i,
+                    "message": f"2024-01-01 00:00:00 UTC:10.0.{d}.{i % 256}"
+                    f"(5432):app@db:[{i}]:LOG:  duration: 0.{i} ms  statement: "
+                    f"SELECT * FROM records WHERE id = {d * i}",
+                }
+                for i in range(EVENTS_PER_DOCUMENT)
+            ],
+        }
+        documents.append(json.dumps(document).encode("utf-8"))
+    payload = b"\n".join(documents) + b"\n"
+    return payload, gzip.compress(payload)
+
+
+def buffered(codec, data):
+    return [codec.loads(line) for line in gzip.decompress(data).strip().splitlines()]
+
+
+def streamed(codec, data):
+    return [codec.loads(line) for line in iter_gzip_lines(data)]
+
+
+def measure(decode, codec, data):
+    """
+    Returns the peak memory decode needs beyond the documents it returns,
+    and its best time.
+    """
+    tracemalloc.start()
+    documents = decode(codec, data)
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del documents
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        decode(codec, data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return peak - held, best
+
+
+def main():
+    codec = get_codec()
+    payload, data = build_record()
+    print(
+        f"record: {DOCUMENTS} documents x {EVENTS_PER_DOCUMENT} events, "
+        f"{len(payload) / 2**20:.1f} MiB decompressed, "
+        f"{len(data) / 2**20:.2f} MiB gzip, codec {codec.name}"
+    )
+    for name, decode in (("buffered", buffered), ("streamed", streamed)):
+        overhead, elapsed = measure(decode, codec, data)
+        print(
+            f"{name:>8}: {overhead / 2**20:6.2f} MiB above the parsed documents, "
+            f"{elapsed * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
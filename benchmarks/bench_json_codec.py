@@ -0,0 +1,125 @@
+"""
+Measures the CPU time the JSON codecs spend per 1,000 records on the decode
+and encode work of both transforms.
+
+    python benchmarks/bench_json_codec.py
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import OrjsonCodec, StdlibCodec, orjson  # noqa: E402
+
+RECORDS = 1000
+METRICS_PER_RECORD = 20
+LOG_EVENTS_PER_RECORD = 50
+REPEAT = 5
+
+
+def metric_lines():
+    metric = {
+        "metric_stream_name": "metric-stream",
+        "account_id": "123456789012",
+        "region": "us-gov-west-1",
+        "namespace": "AWS/RDS",
+        "metric_name": "CPUUtilization",
+        "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-prodtenant"},
+        "timestamp": 1640995200000,
+        "value": {"max": 12.5, "min": 1.5, "sum": 40.0, "count": 5.0},
+        "unit": "Percent",
+    }
+    return [json.dumps(metric).encode("utf-8")] * METRICS_PER_RECORD
+
+
+def log_document():
+    return json.dumps(
+        {
+            "messageType": "DATA_MESSAGE",
+            "owner": "123456789012",
+            "logGroup": "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",
+            "logStream": "cg-aws-broker-prodtenant.0",
+            "subscriptionFilters": ["firehose_for_opensearch"],
+            "logEvents": [
+                {
+                    "id": str(i),
+                    "timestamp": 1640995200000 + i,
+                    "message": f"2024-01-01 00:00:{i:02d} UTC::@:[1]:LOG:  "
+                    "checkpoint complete: wrote 12 buffers (0.1%)",
+                }
+                for i in range(LOG_EVENTS_PER_RECORD)
+            ],
+        }
+    ).encode("utf-8")
+
+
+def metric_work(codec, lines):
+    tags = {"Organization GUID": "org", "Testing": "enabled"}
+    for _ in range(RECORDS):
+        out = []
+        for line in lines:
+            metric = codec.loads(line)
+            metric["Tags"] = tags
+            out.append(codec.dumps(metric))
+        b"\n".join(out)
+
+
+def log_work(codec, document):
+    tags = {"Organization GUID": "org", "Testing": "enabled"}
+    for _ in range(RECORDS):
+        logs = codec.loads(document)
+        for event in logs["logEvents"]:
+            codec.dumps(
+                {
+                    "logGroup": logs["logGroup"],
+                    "logStream": logs["logStream"],
+                    "message": event["message"],
+                    "timestamp": event["timestamp"],
+                    "Tags": tags,
+                }
+            )
+
+
+def cpu_ms(work, *args):
+    best = None
+    for _ in range(REPEAT):
+        started = time.process_time()
+        work(*args)
+        elapsed = (time.process_time() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    codecs = [StdlibCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    else:
+        print("orjson is not installed; only the stdlib codec is measured")
+    lines, document = metric_lines(), log_document()
+    print(
+        f"CPU ms per {RECORDS} records "
+        f"({METRICS_PER_RECORD} metrics or {LOG_EVENTS_PER_RECORD} log events each)"
+    )
+    results = {}
+    for codec in codecs:
+        results[codec.name] = (
+            cpu_ms(metric_work, codec, lines),
+            cpu_ms(log_work, codec, document),
+        )
+        metric, log = results[codec.name]
+        print(
+            f"{codec.name:>8}: metric transform {metric:8.1f}  log transform {log:8.1f}"
+        )
+    if len(results) == 2:
+        (sm, sl), (om, ol) = results["json"], results["orjson"]
+        print(
+            f"   saved: metric transform {sm - om:8.1f}  log transform {sl - ol:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
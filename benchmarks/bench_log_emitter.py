@@ -0,0 +1,96 @@
+"""
+Compares writing the logs transform's NDJSON through a per-event dict with
+writing it through a LogEventTemplate.
+
+    python benchmarks/bench_log_emitter.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import (  # noqa: E402
+    LogEventTemplate,
+    OrjsonCodec,
+    StdlibCodec,
+    orjson,
+    write_document,
+)
+from lambda_functions.tag_cache import EncodedTags  # noqa: E402
+
+DOCUMENTS = 20
+EVENTS_PER_DOCUMENT = 1000
+TAGS = EncodedTags(
+    {
+        "Organization GUID": "0c3d2f4e-1111-4222-8333-444455556666",
+        "Space GUID": "7a1b2c3d-4444-4555-8666-777788889999",
+        "Instance GUID": "9f8e7d6c-5b4a-4392-8170-abcdefabcdef",
+        "broker": "AWS Broker",
+        "Testing": "enabled",
+    }
+)
+
+
+def build_documents():
+    return [
+        {
+            "logGroup": f"/aws/rds/instance/cg-aws-broker-prodtenant{d}/postgresql",
+            "logStream": f"cg-aws-broker-prodtenant{d}.0",
+            "logEvents": [
+                {
+                    "id": str(i),
+                    "timestamp": 1640995200000 + i,
+                    "message": f"2024-01-01 00:00:00 UTC:10.0.0.1(5432):app@db:"
+                    f"[{i}]:LOG:  duration: 0.{i} ms  statement: SELECT 1",
+                }
+                for i in range(EVENTS_PER_DOCUMENT)
+            ],
+        }
+        for d in range(DOCUMENTS)
+    ]
+
+
+def per_event_dicts(codec, documents):
+    """Builds each event's dict as process_logs did, then encodes it."""
+    out = bytearray()
+    for logs in documents:
+        for event in logs["logEvents"]:
+            entry = {
+                "logGroup": logs["logGroup"],
+                "logStream": logs["logStream"],
+                "message": event["message"],
+                "timestamp": event["timestamp"],
+                "Tags": TAGS,
+            }
+            write_document(out, codec, entry)
+            out += b"\n"
+    return out
+
+
+def templated(codec, documents):
+    out = bytearray()
+    for logs in documents:
+        template = LogEventTemplate(codec, logs["logGroup"], logs["logStream"], TAGS)
+        for event in logs["logEvents"]:
+            template.write(out, event)
+    return out
+
+
+def main():
+    documents = build_documents()
+    codecs = [StdlibCodec()] + ([OrjsonCodec()] if orjson is not None else [])
+    print(f"{DOCUMENTS} log documents of {EVENTS_PER_DOCUMENT} events")
+    for codec in codecs:
+        assert per_event_dicts(codec, documents) == templated(codec, documents)
+        dicts = min(timeit.repeat(lambda: per_event_dicts(codec, documents), number=1))
+        template = min(timeit.repeat(lambda: templated(codec, documents), number=1))
+        print(
+            f"{codec.name:>8}: per-event dicts {dicts * 1000:6.1f} ms, "
+            f"template {template * 1000:6.1f} ms ({dicts / template:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the peak memory of compressing a log batch once at the end of the
+invocation with compressing it record by record into size-bounded objects.
+
+    python benchmarks/bench_log_output.py
+"""
+
+import gzip
+import io
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.log_output import GzipObjectWriter  # noqa: E402
+
+RECORDS = 200
+EVENTS_PER_RECORD = 500
+MAX_BYTES = 256 * 1024
+
+
+class NullS3:
+    def put_object(self, **kwargs):
+        pass
+
+
+def record_output(record):
+    return b"".join(
+        b'{"logGroup":"/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",'
+        b'"logStream":"cg-aws-broker-prodtenant.0","message":"2024-01-01 00:00:00 '
+        b"UTC:10.0.0.1(5432):app@db:[%d]:LOG:  duration: 0.%d ms  statement: "
+        b'SELECT * FROM t WHERE id = %d","timestamp":%d,"Tags":{"Organization '
+        b'GUID":"0c3d2f4e-1111-4222-8333-444455556666","Testing":"enabled"}}\n'
+        % (i, i, record * i, 1640995200000 + i)
+        for i in range(EVENTS_PER_RECORD)
+    )
+
+
+def buffered():
+    """Holds the batch's NDJSON, then gzips it in one object."""
+    output = bytearray()
+    for record in range(RECORDS):
+        output += record_output(record)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz_file:
+        gz_file.write(output)
+    NullS3().put_object(Body=buffer.getvalue())
+
+
+def streamed(max_bytes):
+    writer = GzipObjectWriter(NullS3(), "bucket", str, max_bytes=max_bytes)
+    for record in range(RECORDS):
+        writer.write(record_output(record))
+    return writer.close()
+
+
+def peak_mib(work, *args):
+    tracemalloc.start()
+    result = work(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, result
+
+
+def main():
+    size = sum(len(record_output(record)) for record in range(RECORDS))
+    print(f"{RECORDS} records, {size / 2**20:.1f} MiB of NDJSON")
+    peak, _ = peak_mib(buffered)
+    print(f"   buffered batch: peak {peak:6.1f} MiB, 1 object")
+    peak, keys = peak_mib(streamed, 0)
+    print(f"  streamed, 1 obj: peak {peak:6.1f} MiB, {len(keys)} object")
+    peak, keys = peak_mib(streamed, MAX_BYTES)
+    print(
+        f"streamed, {MAX_BYTES // 2**10} KiB: peak {peak:6.1f} MiB, "
+        f"{len(keys)} objects"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measures the log transform's record decode stage on a batch mixing broker
+logs with control messages and other log groups, with and without the
+raw-bytes prefilter.
+
+    python benchmarks/bench_log_prefilter.py
+"""
+
+import base64
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.prefilter import LogPrefilter  # noqa: E402
+from lambda_functions.transform_cloudwatch_lambda import decode_records  # noqa: E402
+
+RECORDS = 500
+EVENTS_PER_RECORD = 100
+REPEAT = 5
+RDS_PREFIX = "cg-aws-broker-prod"
+
+# Rough shape of an account-wide subscription: a few control messages, and
+# more platform than tenant databases.
+CORPUS_MIX = [
+    (5, "CONTROL_MESSAGE", ""),
+    (55, "DATA_MESSAGE", "/aws/rds/instance/platform-db/postgresql"),
+    (40, "DATA_MESSAGE", "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql"),
+]
+
+
+def build_records(seed=1):
+    rng = random.Random(seed)
+    weights = [weight for weight, *_ in CORPUS_MIX]
+    records = []
+    for r in range(RECORDS):
+        _, message_type, log_group = rng.choices(CORPUS_MIX, weights)[0]
+        document = {
+            "messageType": message_type,
+            "owner": "123456789012",
+            "logGroup": log_group,
+            "logStream": "stream.0",
+            "subscriptionFilters": ["firehose_for_opensearch"],
+            "logEvents": [
+                {
+                    "id": f"{r}{i:06d}",
+                    "timestamp": 1640995200000 + i,
+                    "message": f"2024-01-01 00:00:00 UTC:10.0.0.{i % 256}"
+                    f"(5432):app@db:[{i}]:LOG:  duration: 0.{i} ms",
+                }
+                for i in range(EVENTS_PER_RECORD)
+            ],
+        }
+        data = gzip.compress(json.dumps(document).encode("utf-8"))
+        records.append({"recordId": str(r), "data": base64.b64encode(data).decode()})
+    return records
+
+
+def best_ms(records, make_prefilter):
+    best = None
+    for _ in range(REPEAT):
+        prefilter = make_prefilter()
+        started = time.perf_counter()
+        decode_records(records, 1, prefilter)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, prefilter
+
+
+def main():
+    records = build_records()
+    full, _ = best_ms(records, lambda: None)
+    filtered, prefilter = best_ms(records, lambda: LogPrefilter(RDS_PREFIX))
+    print(f"batch:                  {RECORDS} records of {EVENTS_PER_RECORD} events")
+    print(f"parse every document:   {full:.1f} ms")
+    print(f"prefilter, then parse:  {filtered:.1f} ms")
+    print(f"prefilter stats:        {prefilter.stats()}")
+    print(f"speedup:                {full / filtered:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
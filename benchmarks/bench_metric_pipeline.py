@@ -0,0 +1,109 @@
+"""
+Compares peak memory, allocated blocks and time per batch for the metric
+transform's record decode and encode, before and after the bytes pipeline.
+
+    python benchmarks/bench_metric_pipeline.py
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions import transform_lambda  # noqa: E402
+
+RECORDS = 500
+METRICS_PER_RECORD = 50
+TAGS = {"Organization GUID": "0c3d2f4e-org", "Space GUID": "space", "Testing": "x"}
+
+
+def build_batch():
+    lines = []
+    for i in range(METRICS_PER_RECORD):
+        metric = {
+            "metric_stream_name": "metric-stream",
+            "account_id": "123456789012",
+            "region": "us-gov-west-1",
+            "namespace": "AWS/RDS",
+            "metric_name": "CPUUtilization",
+            "dimensions": {"DBInstanceIdentifier": f"cg-aws-broker-prod{i}"},
+            "timestamp": 1640995200000 + i,
+            "value": {"max": 12.5, "min": 1.5, "sum": 40.0, "count": 5.0},
+            "unit": "Percent",
+        }
+        lines.append(json.dumps(metric))
+    data = base64.b64encode(("\n".join(lines) + "\n").encode("utf-8")).decode("utf-8")
+    return [{"recordId": str(i), "data": data} for i in range(RECORDS)]
+
+
+def before(record):
+    """Decode and encode as lambda_handler did before the bytes pipeline."""
+    pre_json_value = base64.b64decode(record["data"])
+    metrics = []
+    for line in pre_json_value.strip().splitlines():
+        metric = json.loads(line)
+        for key in transform_lambda.default_keys_to_remove:
+            metric.pop(key, None)
+        metric["Tags"] = TAGS
+        metrics.append(metric)
+    output_data = "\n".join([json.dumps(metric) for metric in metrics]) + "\n"
+    return base64.b64encode(output_data.encode("utf-8")).decode("utf-8")
+
+
+def after(record):
+    metrics = transform_lambda.decode_metrics(record["data"])
+    for metric in metrics:
+        metric["Tags"] = TAGS
+    return transform_lambda.encode_metrics(metrics)
+
+
+def measure(pipeline, records):
+    """
+    Returns the batch's peak traced memory, the largest transient peak of a
+    single record above what the batch already holds, and the blocks still
+    allocated when the batch is done.
+    """
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    batch_peak = record_peak = 0
+    output = []
+    for record in records:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        output.append(pipeline(record))
+        _, peak = tracemalloc.get_traced_memory()
+        record_peak = max(record_peak, peak - current)
+        batch_peak = max(batch_peak, peak - baseline)
+    blocks = sum(
+        stat.count for stat in tracemalloc.take_snapshot().statistics("lineno")
+    )
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for record in records:
+        pipeline(record)
+    elapsed = time.perf_counter() - started
+    return batch_peak, record_peak, blocks, elapsed
+
+
+def main():
+    records = build_batch()
+    input_bytes = sum(len(record["data"]) for record in records)
+    print(
+        f"batch: {RECORDS} records x {METRICS_PER_RECORD} metrics, "
+        f"{input_bytes / 2**20:.1f} MiB base64, codec {transform_lambda.codec.name}"
+    )
+    for name, pipeline in (("before", before), ("after", after)):
+        batch_peak, record_peak, blocks, elapsed = measure(pipeline, records)
+        print(
+            f"{name:>6}: batch peak {batch_peak / 2**20:6.2f} MiB, "
+            f"per-record peak {record_peak / 2**10:6.1f} KiB, "
+            f"{blocks:6d} blocks held, {elapsed * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the decode stage of the metric transform on a mixed-namespace
+corpus, with and without the raw-bytes prefilter.
+
+    python benchmarks/bench_metric_prefilter.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.prefilter import MetricPrefilter  # noqa: E402
+from lambda_functions.resolvers import default_registry  # noqa: E402
+
+ITERATIONS = 20
+LINES = 5000
+PREFIXES = {"rds": "cg-aws-broker-prod", "s3": "cg-", "domain": "cg-broker-prd-"}
+
+# Rough shape of an account-wide metric stream: most datapoints come from
+# namespaces we never enrich, and most of the rest from non-broker resources.
+CORPUS_MIX = [
+    (30, "AWS/EC2", "InstanceId", "i-0123456789abcdef0"),
+    (15, "AWS/Lambda", "FunctionName", "some-function"),
+    (10, "AWS/Firehose", "DeliveryStreamName", "some-stream"),
+    (10, "AWS/Logs", "LogGroupName", "/aws/lambda/some-function"),
+    (10, "AWS/RDS", "DBInstanceIdentifier", "platform-db"),
+    (5, "AWS/S3", "BucketName", "platform-bucket"),
+    (10, "AWS/RDS", "DBInstanceIdentifier", "cg-aws-broker-prodtenant"),
+    (5, "AWS/ES", "DomainName", "cg-broker-prd-tenant"),
+    (5, "AWS/S3", "BucketName", "cg-tenant-bucket"),
+]
+
+
+def build_corpus(lines=LINES, seed=1):
+    rng = random.Random(seed)
+    weights = [weight for weight, *_ in CORPUS_MIX]
+    corpus = []
+    for _ in range(lines):
+        _, namespace, key, value = rng.choices(CORPUS_MIX, weights)[0]
+        metric = {
+            "metric_stream_name": "metric-stream",
+            "account_id": "123456789012",
+            "region": "us-gov-west-1",
+            "namespace": namespace,
+            "metric_name": "CPUUtilization",
+            "dimensions": {key: value},
+            "timestamp": 1640995200000,
+            "value": {"max": 12.5, "min": 1.5, "sum": 40.0, "count": 5.0},
+            "unit": "Percent",
+        }
+        corpus.append(json.dumps(metric).encode("utf-8"))
+    return b"\n".join(corpus) + b"\n"
+
+
+def parse_all(data):
+    return [json.loads(line) for line in data.strip().splitlines()]
+
+
+def parse_prefiltered(data, prefilter):
+    return [
+        json.loads(line)
+        for line in data.strip().splitlines()
+        if prefilter.accepts(line)
+    ]
+
+
+def main():
+    registry = default_registry()
+    data = build_corpus()
+    full = timeit.timeit(lambda: parse_all(data), number=ITERATIONS) / ITERATIONS
+    filtered = (
+        timeit.timeit(
+            lambda: parse_prefiltered(data, MetricPrefilter(registry, PREFIXES)),
+            number=ITERATIONS,
+        )
+        / ITERATIONS
+    )
+    prefilter = MetricPrefilter(registry, PREFIXES)
+    parse_prefiltered(data, prefilter)
+    stats = prefilter.stats()
+    print(f"corpus:                 {LINES} lines, {len(data) / 1024:.0f} KiB")
+    print(f"json.loads every line:  {full * 1000:.2f} ms")
+    print(f"prefilter, then parse:  {filtered * 1000:.2f} ms")
+    print(f"parse-skip ratio:       {stats['skip_ratio']:.1%}")
+    print(f"speedup:                {full / filtered:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares the log transform's record loop with compression and uploads on
+the handler thread and with them pipelined in the background, against an
+S3 stub with fixed request latency.
+
+    python benchmarks/bench_pipelined_upload.py
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import LogEventTemplate, get_codec  # noqa: E402
+from lambda_functions.log_output import (  # noqa: E402
+    BatchOutput,
+    GzipObjectWriter,
+    PipelinedOutput,
+)
+
+RECORDS = 200
+EVENTS_PER_RECORD = 500
+OBJECT_BYTES = 256 * 1024
+LATENCY = 0.08
+TAGS = {"Organization GUID": "0c3d2f4e-1111-4222-8333-444455556666"}
+
+
+class SlowS3:
+    def put_object(self, **kwargs):
+        time.sleep(LATENCY)
+
+
+def build_records():
+    return [
+        json.dumps(
+            {
+                "logGroup": "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",
+                "logStream": "cg-aws-broker-prodtenant.0",
+                "logEvents": [
+                    {
+                        "id": f"{r}{i:06d}",
+                        "timestamp": 1640995200000 + i,
+                        "message": f"2024-01-01 00:00:00 UTC:10.0.{r % 256}.{i % 256}"
+                        f"(5432):app@db:[{i}]:LOG:  duration: 0.{i} ms  statement: "
+                        f"SELECT * FROM records WHERE id = {r * i}",
+                    }
+                    for i in range(EVENTS_PER_RECORD)
+                ],
+            }
+        ).encode()
+        for r in range(RECORDS)
+    ]
+
+
+def process(records, output, codec):
+    """The handler's per-record work: parse, enrich, hand to the output."""
+    for data in records:
+        logs = codec.loads(data)
+        out = output.buffer(TAGS)
+        template = LogEventTemplate(codec, logs["logGroup"], logs["logStream"], TAGS)
+        for event in logs["logEvents"]:
+            template.write(out, event)
+        output.commit()
+    return output.close()
+
+
+def run(records, codec, pipelined):
+    uploader = ThreadPoolExecutor(max_workers=8) if pipelined else None
+    output = BatchOutput(
+        GzipObjectWriter(
+            SlowS3(), "bucket", str, max_bytes=OBJECT_BYTES, uploader=uploader
+        )
+    )
+    if pipelined:
+        output = PipelinedOutput(output)
+    started = time.perf_counter()
+    keys = process(records, output, codec)
+    return time.perf_counter() - started, len(keys)
+
+
+def main():
+    codec = get_codec()
+    records = build_records()
+    inline, objects = run(records, codec, pipelined=False)
+    network = objects * LATENCY
+    print(
+        f"{RECORDS} records, {objects} objects of up to {OBJECT_BYTES // 1024} KiB, "
+        f"{LATENCY * 1000:.0f} ms per upload ({network * 1000:.0f} ms of network); "
+        f"{os.cpu_count()} vCPU(s) here"
+    )
+    print(
+        f"   inline: {inline * 1000:6.0f} ms (CPU ~{(inline - network) * 1000:.0f} ms)"
+    )
+    pipelined, _ = run(records, codec, pipelined=True)
+    print(f"pipelined: {pipelined * 1000:6.0f} ms ({inline / pipelined:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures the log transform's record decode stage (base64, gunzip, JSON)
+at 1, 2 and 6 worker threads. Only as many workers as the machine has
+vCPUs can run at once; on Lambda, 1,769 MB buys one full vCPU and 10,240
+MB buys six.
+
+    python benchmarks/bench_record_decode.py
+"""
+
+import base64
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.transform_cloudwatch_lambda import decode_records  # noqa: E402
+
+RECORDS = 500
+EVENTS_PER_RECORD = 200
+REPEAT = 3
+
+
+def build_records():
+    records = []
+    for r in range(RECORDS):
+        document = {
+            "messageType": "DATA_MESSAGE",
+            "owner": "123456789012",
+            "logGroup": "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",
+            "logStream": "cg-aws-broker-prodtenant.0",
+            "subscriptionFilters": ["firehose_for_opensearch"],
+            "logEvents": [
+                {
+                    "id": f"{r}{i:06d}",
+                    "timestamp": 1640995200000 + i,
+                    "message": f"2024-01-01 00:00:00 UTC:10.0.{r % 256}.{i % 256}"
+                    f"(5432):app@db:[{i}]:LOG:  duration: 0.{i} ms  statement: "
+                    f"SELECT * FROM records WHERE id = {r * i}",
+                }
+                for i in range(EVENTS_PER_RECORD)
+            ],
+        }
+        data = gzip.compress(json.dumps(document).encode("utf-8"))
+        records.append({"recordId": str(r), "data": base64.b64encode(data).decode()})
+    return records
+
+
+def main():
+    records = build_records()
+    size = sum(len(record["data"]) for record in records)
+    print(
+        f"{RECORDS} records of {EVENTS_PER_RECORD} events, "
+        f"{size / 2**20:.1f} MiB base64; {os.cpu_count()} vCPU(s) here"
+    )
+    baseline = None
+    for workers in (1, 2, 6):
+        best = None
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            decode_records(records, workers)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print(
+            f"{workers} worker(s): {best * 1000:7.1f} ms, "
+            f"{RECORDS / best:7.0f} records/s ({baseline / best:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
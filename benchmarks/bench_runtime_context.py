@@ -0,0 +1,56 @@
+"""
+Compares per-invocation setup overhead of the metric transform before and
+after the process-lifetime runtime context.
+
+    python benchmarks/bench_runtime_context.py
+"""
+
+import os
+import sys
+import timeit
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("AWS_REGION", "us-gov-west-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-gov-west-1")
+os.environ.setdefault("ACCOUNT_ID", "123456789012")
+os.environ.setdefault("ENVIRONMENT", "production")
+
+from lambda_functions import transform_lambda  # noqa: E402
+
+ITERATIONS = 50
+
+
+def per_invocation_setup():
+    """The setup lambda_handler used to repeat on every invocation."""
+    region = boto3.Session().region_name or os.environ.get("AWS_REGION")
+    transform_lambda.make_prefixes()
+    boto3.client("s3", region_name=region)
+    boto3.client("es", region_name=region)
+    boto3.client("rds", region_name=region)
+
+
+def cold_runtime():
+    transform_lambda.reset_runtime()
+    transform_lambda.get_runtime()
+
+
+def warm_runtime():
+    transform_lambda.get_runtime()
+
+
+def main():
+    before = timeit.timeit(per_invocation_setup, number=ITERATIONS) / ITERATIONS
+    cold = timeit.timeit(cold_runtime, number=ITERATIONS) / ITERATIONS
+    transform_lambda.get_runtime()
+    warm = timeit.timeit(warm_runtime, number=ITERATIONS * 1000) / (ITERATIONS * 1000)
+    print(f"per-invocation setup (before): {before * 1000:.3f} ms")
+    print(f"runtime context, cold build:   {cold * 1000:.3f} ms")
+    print(f"runtime context, warm reuse:   {warm * 1e6:.3f} us")
+    print(f"warm speedup:                  {before / warm:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
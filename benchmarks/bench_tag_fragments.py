@@ -0,0 +1,88 @@
+"""
+Compares serializing tag-heavy output documents with and without splicing
+in the cached encoding of their tag set.
+
+    python benchmarks/bench_tag_fragments.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.codec import (  # noqa: E402
+    OrjsonCodec,
+    StdlibCodec,
+    orjson,
+    write_document,
+)
+from lambda_functions.tag_cache import EncodedTags  # noqa: E402
+
+DOCUMENTS = 10000
+TAG_SETS = 30
+TAGS_PER_SET = 15
+
+
+def build_documents():
+    tag_sets = [
+        EncodedTags(
+            {
+                "Organization GUID": f"0c3d2f4e-1111-4222-8333-{i:012d}",
+                "Space GUID": f"7a1b2c3d-4444-4555-8666-{i:012d}",
+                **{
+                    f"broker-tag-{j}": f"value-{i}-{j}" for j in range(TAGS_PER_SET - 2)
+                },
+            }
+        )
+        for i in range(TAG_SETS)
+    ]
+    return [
+        {
+            "logGroup": "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql",
+            "logStream": "cg-aws-broker-prodtenant.0",
+            "message": f"2024-01-01 00:00:00 UTC::@:[1]:LOG:  statement {i}",
+            "timestamp": 1640995200000 + i,
+            "Tags": tag_sets[i % TAG_SETS],
+        }
+        for i in range(DOCUMENTS)
+    ]
+
+
+def encode_plain(codec, documents):
+    out = bytearray()
+    for document in documents:
+        out += codec.dumps(document)
+        out += b"\n"
+    return out
+
+
+def encode_spliced(codec, documents):
+    out = bytearray()
+    for document in documents:
+        write_document(out, codec, document)
+        out += b"\n"
+    return out
+
+
+def main():
+    documents = build_documents()
+    codecs = [StdlibCodec()] + ([OrjsonCodec()] if orjson is not None else [])
+    print(
+        f"{DOCUMENTS} log documents, {TAG_SETS} distinct tag sets of "
+        f"{TAGS_PER_SET} tags"
+    )
+    for codec in codecs:
+        # measure splicing even where the codec leaves it off
+        codec.splice_tags = True
+        assert encode_plain(codec, documents) == encode_spliced(codec, documents)
+        plain = min(timeit.repeat(lambda: encode_plain(codec, documents), number=1))
+        spliced = min(timeit.repeat(lambda: encode_spliced(codec, documents), number=1))
+        print(
+            f"{codec.name:>8}: re-encoded {plain * 1000:6.1f} ms, "
+            f"spliced {spliced * 1000:6.1f} ms ({plain / spliced:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+
+import boto3
+from botocore.config import Config
+
+
+def client_config():
+    """
+    Builds the botocore Config shared by every client a sandbox keeps alive.
+    Keep-alive and a larger pool let warm invocations reuse HTTPS connections,
+    and adaptive retries back off client-side when the tag APIs throttle us.
+    """
+    return Config(
+        tcp_keepalive=True,
+        max_pool_connections=int(os.environ.get("BOTO_MAX_POOL_CONNECTIONS", "32")),
+        connect_timeout=float(os.environ.get("BOTO_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.environ.get("BOTO_READ_TIMEOUT", "10")),
+        retries={
+            "mode": "adaptive",
+            "max_attempts": int(os.environ.get("BOTO_MAX_ATTEMPTS", "5")),
+        },
+    )
+
+
+def make_client(service, region):
+    """
+    Creates a boto3 client for the given service using the shared config.
+    """
+    return boto3.client(service, region_name=region, config=client_config())
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from lambda_functions.tag_cache import EncodedTags
+
+logger = logging.getLogger()
+
+
+class StdlibCodec:
+    """
+    JSON codec on the standard library. Documents are written compact and
+    as raw UTF-8, matching orjson's output byte for byte apart from how
+    floats with an exponent are spelled (1e+16 here, 1e16 in orjson). NaN
+    and infinities are not JSON: encoding them raises ValueError here,
+    where orjson writes null.
+    """
+
+    name = "json"
+    # Splicing cached tag bytes halves the cost of tag-heavy documents
+    splice_tags = True
+
+    def __init__(self):
+        # json.dumps builds a new encoder per call for non-default options
+        self._encoder = json.JSONEncoder(
+            ensure_ascii=False, separators=(",", ":"), allow_nan=False
+        )
+
+    def loads(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return self._encoder.encode(obj).encode("utf-8")
+
+
+class OrjsonCodec:
+    """
+    JSON codec on orjson. Integers orjson cannot represent (beyond 64 bits)
+    fall back to the standard library for that document when encoding, but
+    decode as floats, so their low digits are lost where the standard
+    library keeps them exact.
+    """
+
+    name = "orjson"
+    # orjson encodes a tag set faster than Python can splice one in
+    splice_tags = False
+
+    def __init__(self):
+        self._fallback = StdlibCodec()
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            return self._fallback.dumps(obj)
+
+
+# What bytes.strip() removes; JSON parsers ignore it around a document.
+_WHITESPACE = b" \t\r\n\x0b\x0c"
+
+
+def iter_lines(data):
+    """
+    Yields the non-empty lines of NDJSON bytes as memoryview slices, so the
+    lines are parsed in place instead of being copied out first. Trailing
+    whitespace and carriage returns before a newline are dropped.
+    """
+    view = memoryview(data)
+    start, end = 0, len(data)
+    while end > 0 and data[end - 1] in _WHITESPACE:
+        end -= 1
+    while start < end:
+        newline = data.find(b"\n", start, end)
+        if newline == -1:
+            newline = end
+        stop = newline
+        if stop > start and data[stop - 1] == 0x0D:
+            stop -= 1
+        if stop > start:
+            yield view[start:stop]
+        start = newline + 1
+
+
+# zlib window bits for gzip-wrapped deflate, header and CRC checked by zlib
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Decompressed bytes produced per step of iter_gzip_lines
+GZIP_CHUNK_BYTES = 64 * 1024
+
+
+def iter_gzip_lines(data, max_bytes=0, chunk_bytes=GZIP_CHUNK_BYTES):
+    """
+    Decompresses gzip data chunk by chunk and yields its non-empty NDJSON
+    lines as iter_lines does, as soon as each line is complete, so the whole
+    payload is never held decompressed. Concatenated gzip members and zero
+    padding between them are accepted, as gzip.decompress accepts them.
+    Raises ValueError once more than max_bytes (0 for no limit) have been
+    decompressed and EOFError when the data is truncated.
+    """
+    decompressor = None
+    pending = bytearray()
+    total = 0
+    while True:
+        if decompressor is None:
+            if not data:
+                break
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        chunk = decompressor.decompress(data, chunk_bytes)
+        if chunk:
+            total += len(chunk)
+            if max_bytes and total > max_bytes:
+                raise ValueError(
+                    f"Decompressed data exceeds the limit of {max_bytes} bytes"
+                )
+            # Only the new chunk can hold the newline that completes a line
+            scan = len(pending)
+            pending += chunk
+            cut = pending.rfind(b"\n", scan) + 1
+            if cut:
+                lines = bytes(pending[:cut])
+                del pending[:cut]
+                yield from iter_lines(lines)
+        if decompressor.eof:
+            # What follows the member is in unused_data; unconsumed_tail may
+            # still repeat it when the member ended on a max_length call
+            data = decompressor.unused_data.lstrip(b"\x00")
+            decompressor = None
+        else:
+            data = decompressor.unconsumed_tail
+            if not chunk and not data:
+                raise EOFError(
+                    "Compressed data ended before the end-of-stream marker "
+                    "was reached"
+                )
+    if pending:
+        yield from iter_lines(bytes(pending))
+
+
+def write_document(out, codec, document):
+    """
+    Appends document's JSON to the bytearray out. With a codec that splices
+    tags, when document["Tags"] is an EncodedTags and the document's last
+    key, as the transforms add it, the tags' cached bytes are spliced in
+    instead of being re-encoded. The output is the same as
+    codec.dumps(document).
+    """
+    tags = document.get("Tags")
+    if (
+        not codec.splice_tags
+        or type(tags) is not EncodedTags
+        or next(reversed(document)) != "Tags"
+    ):
+        out += codec.dumps(document)
+        return
+    del document["Tags"]
+    try:
+        body = codec.dumps(document)
+    finally:
+        document["Tags"] = tags
+    if len(body) > 2:
+        out += body[:-1]
+        out += b',"Tags":'
+    else:
+        out += b'{"Tags":'
+    out += tags.encoded(codec)
+    out += b"}"
+
+
+class LogEventTemplate:
+    """
+    Writes the logs transform's NDJSON lines for the events of one log
+    group and stream. The bytes every event repeats (logGroup, logStream
+    and Tags) are encoded once, so per event only message and timestamp
+    are encoded. Each line is the same as codec.dumps of the event's
+    {"logGroup", "logStream", "message", "timestamp", "Tags"} dict plus a
+    newline.
+    """
+
+    def __init__(self, codec, log_group, log_stream, tags):
+        self._dumps = codec.dumps
+        self._prefix = (
+            b'{"logGroup":'
+            + codec.dumps(log_group)
+            + b',"logStream":'
+            + codec.dumps(log_stream)
+            + b',"message":'
+        )
+        self._suffix = b',"Tags":' + encode_tags(codec, tags) + b"}\n"
+
+    def begin(self, out):
+        """
+        Appends what comes before the group's events; nothing in this form.
+        """
+
+    def write(self, out, event):
+        """
+        Appends event's line to the bytearray out.
+        """
+        message, timestamp = event["message"], event["timestamp"]
+        out += self._prefix
+        out += self._dumps(message)
+        out += b',"timestamp":'
+        # CloudWatch timestamps are epoch milliseconds
+        if type(timestamp) is int:
+            out += b"%d" % timestamp
+        else:
+            out += self._dumps(timestamp)
+        out += self._suffix
+
+
+class CompactLogEventTemplate:
+    """
+    Writes the compact form of the logs transform's output for the events
+    of one log group and stream: a header line holding logGroup, logStream
+    and Tags once, then a [timestamp, message] row per event. Rows belong
+    to the header above them; compact_logs.expand restores the full form.
+    """
+
+    def __init__(self, codec, log_group, log_stream, tags):
+        self._dumps = codec.dumps
+        self._header = (
+            b'{"logGroup":'
+            + codec.dumps(log_group)
+            + b',"logStream":'
+            + codec.dumps(log_stream)
+            + b',"Tags":'
+            + encode_tags(codec, tags)
+            + b"}\n"
+        )
+
+    def begin(self, out):
+        """
+        Appends the group's header line to the bytearray out.
+        """
+        out += self._header
+
+    def write(self, out, event):
+        """
+        Appends event's row to the bytearray out.
+        """
+        message, timestamp = event["message"], event["timestamp"]
+        if type(timestamp) is int:
+            out += b"[%d," % timestamp
+        else:
+            out += b"[" + self._dumps(timestamp) + b","
+        out += self._dumps(message)
+        out += b"]\n"
+
+
+# Templates by S3_OUTPUT_FORMAT
+LOG_TEMPLATES = {"full": LogEventTemplate, "compact": CompactLogEventTemplate}
+
+
+def encode_tags(codec, tags):
+    """
+    Encodes a tag set, reusing an EncodedTags' cached bytes.
+    """
+    if type(tags) is EncodedTags:
+        return tags.encoded(codec)
+    return codec.dumps(tags)
+
+
+def get_codec(name="auto"):
+    """
+    Returns the codec called name, or for "auto" orjson when it is installed
+    and the standard library otherwise. Both decode bytes and encode to bytes.
+    Decode errors from either are json.JSONDecodeError.
+    """
+    if name == "json":
+        return StdlibCodec()
+    if name == "orjson" and orjson is None:
+        raise ValueError("JSON_CODEC is orjson but orjson is not installed")
+    if orjson is not None and name in ("auto", "orjson"):
+        return OrjsonCodec()
+    if name != "auto":
+        raise ValueError(f"Unknown JSON_CODEC: {name}")
+    return StdlibCodec()
+
+
+def codec_from_env():
+    """
+    Builds the codec selected by JSON_CODEC (auto, orjson or json).
+    """
+    codec = get_codec(os.environ.get("JSON_CODEC", "auto"))
+    logger.info(f"Using the {codec.name} JSON codec")
+    return codec
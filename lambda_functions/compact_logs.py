@@ -0,0 +1,58 @@
+import sys
+
+from lambda_functions.codec import get_codec, iter_gzip_lines
+
+
+def expand(lines, codec=None):
+    """
+    Yields the full-form log documents ({"logGroup", "logStream", "message",
+    "timestamp", "Tags"}) of the logs transform's NDJSON output. Compact
+    output is expanded; full-form lines pass through, so ingestion can read
+    objects written in either S3_OUTPUT_FORMAT.
+    """
+    codec = codec or get_codec()
+    header = None
+    for line in lines:
+        document = codec.loads(line)
+        if type(document) is list:
+            if header is None:
+                raise ValueError("Compact log row before any header")
+            timestamp, message = document
+            yield {
+                "logGroup": header["logGroup"],
+                "logStream": header["logStream"],
+                "message": message,
+                "timestamp": timestamp,
+                "Tags": header["Tags"],
+            }
+        elif "message" in document:
+            yield document
+        else:
+            header = document
+
+
+def expand_object(body, codec=None):
+    """
+    Expands the gzip body of one of the logs transform's S3 objects,
+    decompressing it as the documents are read.
+    """
+    return expand(iter_gzip_lines(body), codec)
+
+
+def main(argv=None, out=None):
+    """
+    Writes the full form of the given gzip objects as NDJSON to stdout:
+
+        python -m lambda_functions.compact_logs batch-....json.gz ...
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    out = out or sys.stdout.buffer
+    codec = get_codec()
+    for path in argv:
+        with open(path, "rb") as f:
+            for document in expand_object(f.read(), codec):
+                out.write(codec.dumps(document) + b"\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import logging
+import os
+from functools import partial
+
+import boto3
+
+from lambda_functions.clients import make_client
+from lambda_functions.inventory import DomainInventory, RdsInventory
+from lambda_functions.prefixes import environment_prefixes
+from lambda_functions.resolvers import default_registry
+from lambda_functions.tag_cache import NO_TAGS, negative_reason
+from lambda_functions.tag_snapshot import DEFAULT_SNAPSHOT_KEY, build_snapshot
+from lambda_functions.tagging import resolve_concurrently
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Fetches domain and bucket tags the way the metric transform does.
+resolver_registry = default_registry()
+
+
+def lambda_handler(event, context):
+    """
+    Scheduled entry point that writes the tags of every broker RDS instance,
+    OpenSearch domain and S3 bucket for the environment to one S3 object, so
+    new transform sandboxes can load them with a single GET.
+    """
+    region = boto3.Session().region_name or os.environ.get("AWS_REGION")
+    bucket = os.environ.get("TAG_SNAPSHOT_BUCKET")
+    if not bucket:
+        raise ValueError("TAG_SNAPSHOT_BUCKET environment variable must be set.")
+    key = os.environ.get("TAG_SNAPSHOT_KEY", DEFAULT_SNAPSHOT_KEY)
+    rds_prefix, s3_prefix, domain_prefix = environment_prefixes()
+
+    s3_client = make_client("s3", region)
+    resources = collect_resource_tags(
+        make_client("rds", region),
+        make_client("es", region),
+        s3_client,
+        rds_prefix,
+        s3_prefix,
+        domain_prefix,
+    )
+    snapshot = build_snapshot(resources)
+    response = s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=snapshot,
+        ContentType="application/json",
+    )
+    logger.info(
+        f"Wrote tag snapshot with {len(resources)} resources to s3://{bucket}/{key}"
+    )
+    return {"resources": len(resources), "etag": response.get("ETag")}
+
+
+def collect_resource_tags(
+    rds_client, es_client, s3_client, rds_prefix, s3_prefix, domain_prefix
+) -> dict:
+    """
+    Returns {arn: tags} for every broker resource. Untagged resources are
+    included with empty tags so loaders can cache them as negative entries.
+    """
+    resources = {}
+    rds_inventory = RdsInventory()
+    rds_inventory.refresh(rds_client, rds_prefix)
+    for _, instance in rds_inventory.items():
+        resources[instance.arn] = instance.tags
+
+    domain_inventory = DomainInventory()
+    domain_inventory.refresh(es_client, domain_prefix)
+    domain_arns = [domain.arn for _, domain in domain_inventory.items()]
+
+    bucket_names = [
+        bucket["Name"]
+        for bucket in s3_client.list_buckets().get("Buckets", [])
+        if bucket["Name"].startswith(s3_prefix)
+    ]
+
+    domains = resolver_registry.get("AWS/ES")
+    buckets = resolver_registry.get("AWS/S3")
+    lookups = [
+        partial(
+            collect_tags, resources, arn, partial(domains.fetch_tags, es_client, arn)
+        )
+        for arn in domain_arns
+    ]
+    for name in bucket_names:
+        arn = buckets.arn(name, None, None)
+        lookups.append(
+            partial(
+                collect_tags,
+                resources,
+                arn,
+                partial(buckets.fetch_tags, s3_client, arn),
+            )
+        )
+    resolve_concurrently(lookups, int(os.environ.get("TAG_LOOKUP_CONCURRENCY", "8")))
+    return resources
+
+
+def collect_tags(resources, arn, fetch):
+    try:
+        resources[arn] = fetch()
+    except Exception as e:
+        if negative_reason(e) == NO_TAGS:
+            resources[arn] = {}
+        else:
+            logger.error(f"Could not fetch tags for {arn}: {e}")
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from lambda_functions.tag_cache import NO_ORG_GUID, NO_TAGS
+
+logger = logging.getLogger()
+
+RdsInstance = namedtuple("RdsInstance", ["arn", "tags", "allocated_storage"])
+Domain = namedtuple("Domain", ["arn", "instance_type", "instance_count", "volume_size"])
+
+# DescribeElasticsearchDomains accepts at most 5 domain names per call.
+MAX_DOMAINS_PER_DESCRIBE = 5
+
+
+class _Inventory:
+    """
+    An index of broker resources keyed by name, rebuilt at most once per
+    refresh_interval. Subclasses implement _load(client, prefix).
+    """
+
+    name = "resource"
+
+    def __init__(self, refresh_interval=300, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._index = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def is_stale(self):
+        return (
+            self._refreshed_at is None
+            or self._clock() - self._refreshed_at >= self.refresh_interval
+        )
+
+    def refresh(self, client, prefix):
+        """
+        Rebuilds the index from every resource whose name starts with prefix.
+        """
+        index = self._load(client, prefix)
+        with self._lock:
+            self._index = index
+            self._refreshed_at = self._clock()
+            self.refreshes += 1
+        logger.info(f"Refreshed {self.name} inventory with {len(index)} entries")
+
+    def get(self, name):
+        return self._index.get(name)
+
+    def items(self):
+        return list(self._index.items())
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self, client, prefix):
+        raise NotImplementedError
+
+
+class RdsInventory(_Inventory):
+    """
+    Index of broker RDS instances, keyed by DBInstanceIdentifier, built from
+    paginated describe_db_instances calls. A single refresh returns the tags
+    and AllocatedStorage of every instance, replacing one list_tags_for_resource
+    and one describe_db_instances call per instance.
+    """
+
+    name = "RDS"
+
+    def ensure_fresh(self, client, prefix, cache=None, sizes=True):
+        """
+        Refreshes the index when it is older than refresh_interval and seeds
+        the cache from it. Returns True when a refresh happened.
+        """
+        if not self.is_stale():
+            return False
+        self.refresh(client, prefix)
+        if cache is not None:
+            self.seed(cache, sizes=sizes)
+        return True
+
+    def seed(self, cache, sizes=True):
+        """
+        Stores every indexed instance's tags in the cache under its ARN, using
+        the same Organization GUID rule as the per-instance lookups. With
+        sizes, AllocatedStorage is cached under ("AllocatedStorage", id).
+        """
+        for identifier, instance in self.items():
+            if not instance.tags:
+                cache.put_negative(instance.arn, NO_TAGS)
+            elif "Organization GUID" not in instance.tags:
+                cache.put_negative(instance.arn, NO_ORG_GUID)
+            else:
+                cache.put(instance.arn, instance.tags)
+            if sizes:
+                cache.put(("AllocatedStorage", identifier), instance.allocated_storage)
+
+    def _load(self, client, prefix):
+        index = {}
+        paginator = client.get_paginator("describe_db_instances")
+        for page in paginator.paginate():
+            for instance in page.get("DBInstances", []):
+                identifier = instance["DBInstanceIdentifier"]
+                if not identifier.startswith(prefix):
+                    continue
+                index[identifier] = RdsInstance(
+                    arn=instance["DBInstanceArn"],
+                    tags={
+                        tag["Key"]: tag["Value"] for tag in instance.get("TagList", [])
+                    },
+                    allocated_storage=instance.get("AllocatedStorage"),
+                )
+        return index
+
+
+class DomainInventory(_Inventory):
+    """
+    Index of broker OpenSearch domains, keyed by domain name, built from one
+    list_domain_names call and describe calls of up to five domains each.
+    The describe API does not return tags, so the caller resolves tags for
+    the indexed ARNs that are not cached yet.
+    """
+
+    name = "OpenSearch domain"
+
+    def ensure_fresh(self, client, prefix):
+        """
+        Refreshes the index when it is older than refresh_interval. Returns
+        True when a refresh happened.
+        """
+        if not self.is_stale():
+            return False
+        self.refresh(client, prefix)
+        return True
+
+    def _load(self, client, prefix):
+        names = [
+            domain["DomainName"]
+            for domain in client.list_domain_names().get("DomainNames", [])
+            if domain["DomainName"].startswith(prefix)
+        ]
+        index = {}
+        for start in range(0, len(names), MAX_DOMAINS_PER_DESCRIBE):
+            response = client.describe_elasticsearch_domains(
+                DomainNames=names[start : start + MAX_DOMAINS_PER_DESCRIBE]
+            )
+            for status in response.get("DomainStatusList", []):
+                cluster = status.get("ElasticsearchClusterConfig", {})
+                ebs = status.get("EBSOptions", {})
+                index[status["DomainName"]] = Domain(
+                    arn=status["ARN"],
+                    instance_type=cluster.get("InstanceType"),
+                    instance_count=cluster.get("InstanceCount"),
+                    volume_size=(
+                        ebs.get("VolumeSize") if ebs.get("EBSEnabled") else None
+                    ),
+                )
+        return index
@@ -0,0 +1,464 @@
+import collections
+import copy
+import gzip
+import io
+import itertools
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# S3 rejects multipart parts, other than the last, below 5 MiB
+MIN_PART_BYTES = 5 * 1024 * 1024
+# Tells this sandbox's objects apart from those of concurrent sandboxes
+SANDBOX_ID = uuid.uuid4().hex[:12]
+_invocations = itertools.count()
+# Characters a tenant ID may keep in an S3 key prefix
+_UNSAFE_KEY_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class BatchKeys:
+    """
+    Names a batch's S3 objects so concurrent invocations never collide and
+    a listing returns them in time order:
+
+        YYYY/MM/DD/HH/batch-<epoch ms>-<sandbox>-<invocation>-<object>.json.gz
+
+    The hour and epoch milliseconds are the batch's UTC start time, zero
+    padded so keys sort by it. The sandbox ID is random per cold start, and
+    the sequence numbers order a sandbox's batches and a batch's objects.
+    Called with an object's sequence number, returns its key.
+
+    partition(name) returns the same batch's keys under name/, such as
+    tenants/<Organization GUID>/YYYY/MM/DD/HH/batch-....
+    """
+
+    def __init__(self, started=None, sandbox=None, invocation=None):
+        started = time.time() if started is None else started
+        self.prefix = time.strftime("%Y/%m/%d/%H", time.gmtime(started))
+        self.started_ms = int(started * 1000)
+        self.sandbox = SANDBOX_ID if sandbox is None else sandbox
+        self.invocation = next(_invocations) if invocation is None else invocation
+
+    def partition(self, name):
+        keys = copy.copy(self)
+        keys.prefix = f"{name}/{self.prefix}"
+        return keys
+
+    def __call__(self, sequence):
+        return (
+            f"{self.prefix}/batch-{self.started_ms:013d}-{self.sandbox}"
+            f"-{self.invocation:06d}-{sequence:04d}.json.gz"
+        )
+
+
+class GzipObjectWriter:
+    """
+    Compresses NDJSON into a gzip S3 object as it is written, instead of
+    holding the whole batch until the end of the invocation. Once the
+    object reaches max_bytes compressed or max_uncompressed_bytes of NDJSON
+    it is uploaded and a new one is started. Limits are checked after each
+    write, so an object overshoots by at most one write. 0 disables a limit;
+    with neither set the whole batch is one object.
+
+    With part_bytes set, an object whose compressed size passes part_bytes
+    becomes a multipart upload: each part_bytes of compressed output is sent
+    as it is produced, so memory stays bounded by one part however large
+    the object. Smaller objects are still one put_object.
+
+    With if_none_match, objects are written with If-None-Match: * so S3
+    refuses to overwrite an existing key instead of silently replacing it.
+
+    With an uploader, an executor such as a ThreadPoolExecutor, finished
+    objects are uploaded on it while the next object is being compressed.
+    At most max_in_flight uploads are outstanding; write() waits for the
+    oldest beyond that, and close() for all of them. A failed upload is
+    raised by the write() or close() that waits for it.
+
+    key_for(sequence) names each object, such as a BatchKeys; sequence
+    counts from 0 and is never reused, even for an object that failed.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        key_for,
+        max_bytes=0,
+        max_uncompressed_bytes=0,
+        part_bytes=0,
+        if_none_match=False,
+        uploader=None,
+        max_in_flight=2,
+    ):
+        if 0 < part_bytes < MIN_PART_BYTES:
+            raise ValueError(f"part_bytes must be at least {MIN_PART_BYTES}")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key_for = key_for
+        self.max_bytes = max_bytes
+        self.max_uncompressed_bytes = max_uncompressed_bytes
+        self.part_bytes = part_bytes
+        self._conditions = {"IfNoneMatch": "*"} if if_none_match else {}
+        self.uploader = uploader
+        self.max_in_flight = max_in_flight
+        self.keys = []
+        self._objects = 0
+        self._in_flight = collections.deque()
+        self._buffer = None
+        self._gzip = None
+        self._key = None
+        self._upload_id = None
+        self._parts = []
+        self._uploaded = 0
+        self._uncompressed = 0
+
+    def write(self, data):
+        if not data:
+            return
+        if self._gzip is None:
+            self._key = self.key_for(self._objects)
+            self._objects += 1
+            self._buffer = io.BytesIO()
+            self._gzip = gzip.GzipFile(fileobj=self._buffer, mode="wb")
+        self._gzip.write(data)
+        self._uncompressed += len(data)
+        if self.part_bytes and self._buffer.tell() >= self.part_bytes:
+            self._upload_part()
+        # Compressed output lags behind what zlib has buffered; close enough
+        if (
+            self.max_bytes
+            and self._uploaded + self._buffer.tell() >= self.max_bytes
+            or self.max_uncompressed_bytes
+            and self._uncompressed >= self.max_uncompressed_bytes
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Finishes and uploads the current object, if anything was written.
+        """
+        if self._gzip is None:
+            return
+        self._gzip.close()
+        body = self._buffer.getvalue()
+        key, upload_id, parts = self._key, self._upload_id, self._parts
+        size = self._uploaded + len(body)
+        self._reset()
+        if upload_id is None and self.uploader is not None:
+            self._wait(self.max_in_flight - 1)
+            future = self.uploader.submit(self._put, key, body)
+            self._in_flight.append((key, size, future))
+            return
+        if upload_id is None:
+            self._put(key, body)
+        else:
+            try:
+                parts.append(self._send_part(key, upload_id, len(parts) + 1, body))
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                    **self._conditions,
+                )
+            except Exception:
+                self._abort(key, upload_id)
+                raise
+        self._pushed(key, size)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._wait(0)
+        return self.keys
+
+    def _put(self, key, body):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/gzip",
+            ContentEncoding="gzip",
+            **self._conditions,
+        )
+
+    def _pushed(self, key, size):
+        self.keys.append(key)
+        logger.info(f"Pushed {size} compressed bytes to S3: {key}")
+
+    def _wait(self, limit):
+        """
+        Waits for the oldest uploads until at most limit are in flight, then
+        raises the first of their errors.
+        """
+        error = None
+        while len(self._in_flight) > limit:
+            key, size, future = self._in_flight.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+            else:
+                self._pushed(key, size)
+        if error is not None:
+            raise error
+
+    def _upload_part(self):
+        body = self._buffer.getvalue()
+        # GzipFile only appends to its file object, so it can be emptied
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        try:
+            if self._upload_id is None:
+                self._upload_id = self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self._key,
+                    ContentType="application/gzip",
+                    ContentEncoding="gzip",
+                )["UploadId"]
+            part_number = len(self._parts) + 1
+            self._parts.append(
+                self._send_part(self._key, self._upload_id, part_number, body)
+            )
+        except Exception:
+            if self._upload_id is not None:
+                self._abort(self._key, self._upload_id)
+            self._gzip.close()
+            self._reset()
+            raise
+        self._uploaded += len(body)
+
+    def _send_part(self, key, upload_id, part_number, body):
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _abort(self, key, upload_id):
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+        except Exception as e:
+            logger.error(f"Could not abort multipart upload of {key}: {e}")
+
+    def _reset(self):
+        self._buffer = self._gzip = self._key = self._upload_id = None
+        self._parts = []
+        self._uploaded = self._uncompressed = 0
+
+
+class BatchOutput:
+    """
+    Collects the NDJSON of one Firehose record for the batch's single
+    writer. buffer(tags) is where process_logs appends a log document's
+    events; commit() hands the record's events to the writer once the
+    record is processed, and discard() drops them if it failed.
+
+    commit() is take() followed by write(), so PipelinedOutput can run the
+    write on another thread.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._buffer = bytearray()
+
+    @property
+    def keys(self):
+        return self.writer.keys
+
+    def buffer(self, tags):
+        return self._buffer
+
+    def take(self):
+        """
+        Returns the record's events and starts an empty buffer.
+        """
+        staged, self._buffer = self._buffer, bytearray()
+        return staged
+
+    def write(self, staged):
+        self.writer.write(staged)
+
+    def commit(self):
+        self.write(self.take())
+
+    def discard(self):
+        del self._buffer[:]
+
+    def close(self):
+        return self.writer.close()
+
+
+class TenantOutput:
+    """
+    Like BatchOutput, but with a writer per Organization GUID, so each
+    tenant's events go to their own objects. Each tenant's writer
+    compresses its events as they arrive, alongside the others, and close()
+    uploads the tenants' last objects in parallel.
+
+    new_writer(tenant) builds a tenant's writer the first time its events
+    are committed.
+    """
+
+    def __init__(self, new_writer, max_workers=8):
+        self.new_writer = new_writer
+        self.max_workers = max_workers
+        self.writers = {}
+        self._buffers = {}
+
+    @property
+    def keys(self):
+        return [key for writer in self.writers.values() for key in writer.keys]
+
+    def buffer(self, tags):
+        tenant = tenant_partition(tags)
+        buffer = self._buffers.get(tenant)
+        if buffer is None:
+            buffer = self._buffers[tenant] = bytearray()
+        return buffer
+
+    def take(self):
+        """
+        Returns the record's events by tenant and starts empty buffers.
+        """
+        staged, self._buffers = self._buffers, {}
+        return staged
+
+    def write(self, staged):
+        error = None
+        for tenant, buffer in staged.items():
+            if not buffer:
+                continue
+            writer = self.writers.get(tenant)
+            if writer is None:
+                writer = self.writers[tenant] = self.new_writer(tenant)
+            try:
+                writer.write(buffer)
+            except Exception as e:
+                # One tenant's failed upload does not hold back the others
+                error = error or e
+        if error is not None:
+            raise error
+
+    def commit(self):
+        self.write(self.take())
+
+    def discard(self):
+        self._buffers.clear()
+
+    def close(self):
+        writers = list(self.writers.values())
+        workers = max(1, min(self.max_workers, len(writers)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(writer.close) for writer in writers]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return self.keys
+
+
+class PipelinedOutput:
+    """
+    Runs a BatchOutput's or TenantOutput's compression and uploads on a
+    background thread, so they overlap the processing of later records.
+    At most max_pending committed records wait for the thread; commit()
+    blocks beyond that, which keeps memory bounded when S3 is slower than
+    processing.
+
+    An upload error is raised by the next commit() and by close(), which
+    waits for every upload to finish. Once one has failed, later records
+    are dropped rather than written, as the batch will be retried; close()
+    still closes the output, so no other writer is left mid-upload.
+    """
+
+    _DONE = object()
+
+    def __init__(self, output, max_pending=4):
+        self.output = output
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    @property
+    def keys(self):
+        return self.output.keys
+
+    def buffer(self, tags):
+        return self.output.buffer(tags)
+
+    def commit(self):
+        if self.error is not None:
+            self.output.discard()
+            raise self.error
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(self.output.take())
+
+    def discard(self):
+        self.output.discard()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(self._DONE)
+            self._thread.join()
+            self._thread = None
+        try:
+            keys = self.output.close()
+        except Exception as e:
+            # The first error is the one raised
+            self.error = self.error or e
+        if self.error is not None:
+            raise self.error
+        return keys
+
+    def _run(self):
+        while True:
+            staged = self._queue.get()
+            if staged is self._DONE:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.output.write(staged)
+            except Exception as e:
+                self.error = e
+
+
+def tenant_partition(tags):
+    """
+    Returns the key prefix segment for a tag set's Organization GUID.
+    """
+    tenant = tags.get("Organization GUID") or "unknown"
+    return _UNSAFE_KEY_CHARACTERS.sub("_", tenant)
+
+
+def output_options_from_env():
+    """
+    Reads the log transform's GzipObjectWriter options: the object limits
+    S3_OBJECT_MAX_BYTES (compressed), S3_OBJECT_MAX_UNCOMPRESSED_BYTES and
+    S3_MULTIPART_PART_BYTES, which default to 0 for one put_object per
+    batch, and S3_OUTPUT_IF_NONE_MATCH (default false).
+    """
+    return {
+        "max_bytes": int(os.environ.get("S3_OBJECT_MAX_BYTES", "0")),
+        "max_uncompressed_bytes": int(
+            os.environ.get("S3_OBJECT_MAX_UNCOMPRESSED_BYTES", "0")
+        ),
+        "part_bytes": int(os.environ.get("S3_MULTIPART_PART_BYTES", "0")),
+        "if_none_match": os.environ.get("S3_OUTPUT_IF_NONE_MATCH", "false") == "true",
+    }
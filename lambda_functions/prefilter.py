@@ -0,0 +1,138 @@
+import re
+import threading
+from functools import lru_cache
+
+NAMESPACE_PATTERN = re.compile(rb'"namespace"\s*:\s*"([^"\\]*)"')
+MESSAGE_TYPE_PATTERN = re.compile(rb'"messageType"\s*:\s*"([^"\\]*)"')
+LOG_GROUP_PATTERN = re.compile(rb'"logGroup"\s*:\s*"([^"\\]*)"')
+LOG_EVENTS_PATTERN = re.compile(rb'"logEvents"\s*:')
+
+
+@lru_cache(maxsize=None)
+def dimension_pattern(key):
+    return re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*"([^"\\]*)"')
+
+
+class MetricPrefilter:
+    """
+    Decides from a metric line's raw bytes whether it can produce output, so
+    lines for unknown namespaces or non-broker resources skip json.loads.
+
+    Only lines whose namespace, or whose resource dimension, is found by the
+    patterns and rejected are skipped. Anything the patterns cannot read
+    (escaped strings, missing keys) is left to the full parse.
+
+    With reported, the set of unknown namespaces the transform has already
+    logged, the first line of any other unknown namespace is let through so
+    the full parse can report it.
+    """
+
+    def __init__(self, registry, prefixes, reported=None):
+        self.registry = registry
+        self.prefixes = prefixes
+        self.reported = reported
+        self._passed = set()
+        self.lines = 0
+        self.skipped = 0
+
+    def accepts(self, line):
+        self.lines += 1
+        try:
+            rejected = self._rejects(line)
+        except UnicodeDecodeError:
+            rejected = False
+        if rejected:
+            self.skipped += 1
+        return not rejected
+
+    def _rejects(self, line):
+        match = NAMESPACE_PATTERN.search(line)
+        if match is None:
+            return False
+        namespace = match.group(1).decode()
+        resolver = self.registry.get(namespace)
+        if resolver is None:
+            if (
+                self.reported is None
+                or namespace in self.reported
+                or namespace in self._passed
+            ):
+                return True
+            self._passed.add(namespace)
+            return False
+        key = getattr(resolver.resource_name, "key", None)
+        if key is None:
+            return False
+        match = dimension_pattern(key).search(line)
+        if match is None:
+            return False
+        return not resolver.is_broker(match.group(1).decode(), self.prefixes)
+
+    def stats(self):
+        return {
+            "lines": self.lines,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / self.lines, 3) if self.lines else 0.0,
+        }
+
+
+class LogPrefilter:
+    """
+    Decides from a CloudWatch Logs document's raw bytes whether it can
+    produce output, so control messages and documents from non-broker log
+    groups skip json.loads, tag lookups and enrichment. Drops are counted
+    per reason.
+
+    Only the fields ahead of logEvents are read, where CloudWatch Logs puts
+    messageType and logGroup; a document is dropped only when one of them is
+    found there and rejected. Anything else is left to the full parse.
+    Counts are safe to update from the decode threads.
+    """
+
+    REASONS = ("control_message", "not_data_message", "not_broker")
+
+    def __init__(self, rds_prefix):
+        self.rds_prefix = rds_prefix
+        self.documents = 0
+        self.dropped = dict.fromkeys(self.REASONS, 0)
+        self._lock = threading.Lock()
+
+    def accepts(self, line):
+        try:
+            reason = self._reject_reason(line)
+        except UnicodeDecodeError:
+            reason = None
+        with self._lock:
+            self.documents += 1
+            if reason is not None:
+                self.dropped[reason] += 1
+        return reason is None
+
+    def _reject_reason(self, line):
+        events = LOG_EVENTS_PATTERN.search(line)
+        end = events.start() if events is not None else len(line)
+        match = MESSAGE_TYPE_PATTERN.search(line, 0, end)
+        if match is not None:
+            message_type = match.group(1)
+            if message_type == b"CONTROL_MESSAGE":
+                return "control_message"
+            if message_type != b"DATA_MESSAGE":
+                return "not_data_message"
+        match = LOG_GROUP_PATTERN.search(line, 0, end)
+        if match is None:
+            return None
+        parts = match.group(1).decode().split("/")
+        if len(parts) < 5 or not parts[4].startswith(self.rds_prefix):
+            return "not_broker"
+        return None
+
+    def stats(self):
+        skipped = sum(self.dropped.values())
+        return {
+            "documents": self.documents,
+            "skipped": skipped,
+            "skip_ratio": (
+                round(skipped / self.documents, 3) if self.documents else 0.0
+            ),
+            **self.dropped,
+        }
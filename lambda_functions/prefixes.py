@@ -0,0 +1,24 @@
+import os
+
+# Name suffixes of broker resources by ENVIRONMENT
+RDS_SUFFIXES = {"production": "prod", "staging": "stage", "development": "dev"}
+DOMAIN_SUFFIXES = {"production": "prd-", "staging": "stg-", "development": "dev-"}
+
+
+def environment_prefixes():
+    """
+    Returns the broker RDS instance, S3 bucket and OpenSearch domain name
+    prefixes for ENVIRONMENT. Raises RuntimeError when ENVIRONMENT is unset
+    or not one of production, staging and development, so a misconfigured
+    function never matches every environment's resources.
+    """
+    environment = os.getenv("ENVIRONMENT")
+    if not environment:
+        raise RuntimeError("ENVIRONMENT is required")
+    if environment not in RDS_SUFFIXES:
+        raise RuntimeError(f"Invalid ENVIRONMENT: {environment}")
+
+    rds_prefix = "cg-aws-broker-" + RDS_SUFFIXES[environment]
+    s3_prefix = "cg-" if environment == "production" else f"{environment}-cg-"
+    domain_prefix = "cg-broker-" + DOMAIN_SUFFIXES[environment]
+    return rds_prefix, s3_prefix, domain_prefix
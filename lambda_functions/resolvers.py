@@ -0,0 +1,181 @@
+from collections import namedtuple
+
+ARN_PARTITION = "aws-us-gov"
+
+# How to find the broker resource behind a metric namespace:
+# resource_name(dimensions) returns its name or None, is_broker(name, prefixes)
+# checks the name against the environment prefixes ({"rds", "s3", "domain"}),
+# arn(name, region, account_id) builds its ARN and fetch_tags(client, arn)
+# returns its raw tags using a boto3 client for service.
+NamespaceResolver = namedtuple(
+    "NamespaceResolver",
+    ["namespace", "service", "resource_name", "is_broker", "arn", "fetch_tags"],
+)
+
+
+class ResolverRegistry:
+    """
+    Namespace resolvers indexed by CloudWatch namespace and by the service
+    in their ARNs, so dispatch and rejection of unknown namespaces are
+    dictionary lookups.
+    """
+
+    def __init__(self, resolvers=()):
+        self._by_namespace = {}
+        self._by_service = {}
+        for resolver in resolvers:
+            self.register(resolver)
+
+    def register(self, resolver):
+        self._by_namespace[resolver.namespace] = resolver
+        self._by_service[resolver.service] = resolver
+
+    def get(self, namespace):
+        return self._by_namespace.get(namespace)
+
+    def for_arn(self, arn):
+        parts = arn.split(":", 3)
+        if len(parts) < 3:
+            return None
+        return self._by_service.get(parts[2])
+
+    def namespaces(self):
+        return list(self._by_namespace)
+
+    def __contains__(self, namespace):
+        return namespace in self._by_namespace
+
+
+class Dimension:
+    """
+    A resource_name extractor reading one metric dimension. The key is kept
+    so the metric prefilter can find the value in raw bytes.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __call__(self, dimensions):
+        return dimensions.get(self.key)
+
+
+def dimension(name):
+    """
+    Returns a resource_name extractor reading one metric dimension.
+    """
+    return Dimension(name)
+
+
+def starts_with(prefix_name):
+    """
+    Returns an is_broker predicate matching one of the environment prefixes.
+    """
+    return lambda name, prefixes: name.startswith(prefixes[prefix_name])
+
+
+def arn_format(template):
+    """
+    Returns an ARN builder filling {partition}, {region}, {account_id} and
+    {name} in template.
+    """
+    return lambda name, region, account_id: template.format(
+        partition=ARN_PARTITION, region=region, account_id=account_id, name=name
+    )
+
+
+def tag_list(response, key="TagList"):
+    return {tag["Key"]: tag["Value"] for tag in response.get(key, [])}
+
+
+def bucket_tags(client, arn):
+    return tag_list(client.get_bucket_tagging(Bucket=arn.split(":::", 1)[1]), "TagSet")
+
+
+def domain_tags(client, arn):
+    return tag_list(client.list_tags(ARN=arn))
+
+
+def resource_tags(client, arn):
+    # RDS and ElastiCache share the ListTagsForResource shape
+    return tag_list(client.list_tags_for_resource(ResourceName=arn))
+
+
+def queue_tags(client, arn):
+    _, _, _, _, account_id, name = arn.split(":", 5)
+    queue_url = f"{client.meta.endpoint_url}/{account_id}/{name}"
+    return dict(client.list_queue_tags(QueueUrl=queue_url).get("Tags", {}))
+
+
+def table_tags(client, arn):
+    tags = {}
+    kwargs = {"ResourceArn": arn}
+    while True:
+        response = client.list_tags_of_resource(**kwargs)
+        tags.update(tag_list(response, "Tags"))
+        if not response.get("NextToken"):
+            return tags
+        kwargs["NextToken"] = response["NextToken"]
+
+
+# ElastiCache clusters, SQS queues and DynamoDB tables created by the broker
+# share the RDS instances' cg-aws-broker-<env> naming.
+BUILTIN_RESOLVERS = (
+    NamespaceResolver(
+        namespace="AWS/S3",
+        service="s3",
+        resource_name=dimension("BucketName"),
+        is_broker=starts_with("s3"),
+        arn=arn_format("arn:{partition}:s3:::{name}"),
+        fetch_tags=bucket_tags,
+    ),
+    NamespaceResolver(
+        namespace="AWS/ES",
+        service="es",
+        resource_name=dimension("DomainName"),
+        is_broker=starts_with("domain"),
+        arn=arn_format("arn:{partition}:es:{region}:{account_id}:domain/{name}"),
+        fetch_tags=domain_tags,
+    ),
+    NamespaceResolver(
+        namespace="AWS/RDS",
+        service="rds",
+        resource_name=dimension("DBInstanceIdentifier"),
+        is_broker=starts_with("rds"),
+        arn=arn_format("arn:{partition}:rds:{region}:{account_id}:db:{name}"),
+        fetch_tags=resource_tags,
+    ),
+    NamespaceResolver(
+        namespace="AWS/ElastiCache",
+        service="elasticache",
+        resource_name=dimension("CacheClusterId"),
+        is_broker=starts_with("rds"),
+        arn=arn_format(
+            "arn:{partition}:elasticache:{region}:{account_id}:cluster:{name}"
+        ),
+        fetch_tags=resource_tags,
+    ),
+    NamespaceResolver(
+        namespace="AWS/SQS",
+        service="sqs",
+        resource_name=dimension("QueueName"),
+        is_broker=starts_with("rds"),
+        arn=arn_format("arn:{partition}:sqs:{region}:{account_id}:{name}"),
+        fetch_tags=queue_tags,
+    ),
+    NamespaceResolver(
+        namespace="AWS/DynamoDB",
+        service="dynamodb",
+        resource_name=dimension("TableName"),
+        is_broker=starts_with("rds"),
+        arn=arn_format("arn:{partition}:dynamodb:{region}:{account_id}:table/{name}"),
+        fetch_tags=table_tags,
+    ),
+)
+
+
+def default_registry():
+    """
+    Returns a registry holding the built-in resolvers. Supporting another
+    broker service means registering one more NamespaceResolver.
+    """
+    return ResolverRegistry(BUILTIN_RESOLVERS)
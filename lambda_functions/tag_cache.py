@@ -0,0 +1,319 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+# Reasons a lookup produced nothing usable; each gets its own TTL and counters.
+NO_TAGS = "no_tags"
+NO_ORG_GUID = "no_org_guid"
+NOT_FOUND = "not_found"
+THROTTLED = "throttled"
+NEGATIVE_REASONS = (NO_TAGS, NO_ORG_GUID, NOT_FOUND, THROTTLED)
+
+NOT_FOUND_ERROR_CODES = {
+    "DBInstanceNotFound",
+    "DBInstanceNotFoundFault",
+    "ResourceNotFoundException",
+    "ResourceNotFoundFault",
+    "NoSuchBucket",
+}
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "SlowDown",
+}
+
+
+# Lets NegativeLookup and put_negative default to a fresh empty tag dict
+# while still accepting None as a cached value.
+_EMPTY_TAGS = object()
+
+
+class EncodedTags(dict):
+    """
+    A cached tag set that keeps its serialized JSON once it has been encoded,
+    per codec name, so output writers splice the bytes in instead of encoding
+    the same tags for every document. Cached tags are shared and must not be
+    mutated; callers that add fields work on a copy(), which is a plain dict.
+    """
+
+    __slots__ = ("_encoded",)
+
+    def encoded(self, codec):
+        try:
+            encoded = self._encoded
+        except AttributeError:
+            encoded = self._encoded = {}
+        data = encoded.get(codec.name)
+        if data is None:
+            data = encoded[codec.name] = codec.dumps(self)
+        return data
+
+
+class NegativeLookup(Exception):
+    """
+    Raised by a loader when a resource has no usable tags. The cache stores
+    ``value`` (an empty tag dict by default) under the reason's shorter TTL
+    instead of retrying it every batch.
+    """
+
+    def __init__(self, reason, value=_EMPTY_TAGS):
+        super().__init__(reason)
+        self.reason = reason
+        self.value = {} if value is _EMPTY_TAGS else value
+
+
+def negative_reason(error):
+    """
+    Maps a botocore ClientError to a negative cache reason, or None when the
+    error should not be cached.
+    """
+    response = getattr(error, "response", None) or {}
+    code = response.get("Error", {}).get("Code")
+    if code == "NoSuchTagSet":
+        return NO_TAGS
+    if code in NOT_FOUND_ERROR_CODES:
+        return NOT_FOUND
+    if code in THROTTLING_ERROR_CODES:
+        return THROTTLED
+    return None
+
+
+class TagCache:
+    """
+    Process-wide tag cache keyed by resource ARN (or bucket name), independent
+    of the boto3 client that fetched the value.
+
+    Entries live for ``ttl`` seconds and the cache holds at most ``maxsize``
+    entries, evicting the least recently used one. When ``stale_ttl`` is set,
+    an expired entry is still served for that many extra seconds while a
+    background thread refreshes it.
+
+    Concurrent misses for the same key are coalesced: one caller runs the
+    loader and the others wait for its result.
+
+    Loaders raise NegativeLookup for untagged, non-tenant, deleted or throttled
+    resources; those entries use ``negative_ttls[reason]`` and are counted per
+    reason, both when stored and when served.
+    """
+
+    def __init__(
+        self,
+        ttl=900,
+        maxsize=1024,
+        stale_ttl=0,
+        negative_ttls=None,
+        clock=time.monotonic,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.negative_ttls = {reason: 60 for reason in NEGATIVE_REASONS}
+        self.negative_ttls.update(negative_ttls or {})
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.negative_stored = {reason: 0 for reason in NEGATIVE_REASONS}
+        self.negative_hits = {reason: 0 for reason in NEGATIVE_REASONS}
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for key, calling loader() on a miss. Exceptions
+        other than NegativeLookup propagate and nothing is cached.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, reason = entry
+                if now < expires_at:
+                    self.hits += 1
+                    if reason is not None:
+                        self.negative_hits[reason] += 1
+                    self._entries.move_to_end(key)
+                    return value
+                if reason is None and now < expires_at + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    self._schedule_refresh(key, loader)
+                    return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait()
+        try:
+            flight.value = self._load(key, loader)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+        except NegativeLookup as e:
+            self.put_negative(key, e.reason, e.value)
+            return e.value
+        return self.put(key, value)
+
+    def put(self, key, value, ttl=None):
+        """
+        Caches value and returns it as stored; non-empty tag dicts are kept
+        as EncodedTags.
+        """
+        return self._store(key, value, self.ttl if ttl is None else ttl, None)
+
+    def put_negative(self, key, reason, value=_EMPTY_TAGS):
+        """
+        Caches a negative result under the TTL configured for its reason.
+        """
+        with self._lock:
+            self.negative_stored[reason] += 1
+        if value is _EMPTY_TAGS:
+            value = {}
+        self._store(key, value, self.negative_ttls[reason], reason)
+
+    def _store(self, key, value, ttl, reason):
+        if type(value) is dict and value:
+            value = EncodedTags(value)
+        expires_at = self._clock() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at, reason)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def _fresh_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and self._clock() < entry[1]:
+            return entry
+        return None
+
+    def peek(self, key):
+        """
+        Returns the fresh cached value for key, or None, without touching the
+        counters or the LRU order.
+        """
+        entry = self._fresh_entry(key)
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refreshing.clear()
+            self._reset_counters()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "coalesced": self.coalesced,
+            "negative_stored": dict(self.negative_stored),
+            "negative_hits": dict(self.negative_hits),
+        }
+
+    def __contains__(self, key):
+        return self._fresh_entry(key) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _schedule_refresh(self, key, loader):
+        # Called with the lock held; one refresh per key at a time.
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+
+    def _refresh(self, key, loader):
+        try:
+            self._load(key, loader)
+        except Exception as e:
+            logger.error(f"Could not refresh cached tags for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+def store_tags(cache, key, tags, normalize=None):
+    """
+    Stores tags fetched in bulk (tagging API, snapshot) in the cache, applying
+    normalize(key, tags) so they follow the same rules as per-resource lookups.
+    """
+    try:
+        if normalize is not None:
+            tags = normalize(key, tags)
+    except NegativeLookup as e:
+        cache.put_negative(key, e.reason)
+    else:
+        cache.put(key, tags)
+
+
+class _Flight:
+    """
+    A lookup in progress that other callers for the same key can wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def tag_cache_from_env():
+    """
+    Builds a TagCache configured from TAG_CACHE_* environment variables.
+    """
+    return TagCache(
+        ttl=float(os.environ.get("TAG_CACHE_TTL_SECONDS", "900")),
+        maxsize=int(os.environ.get("TAG_CACHE_MAX_ENTRIES", "1024")),
+        stale_ttl=float(os.environ.get("TAG_CACHE_STALE_SECONDS", "0")),
+        negative_ttls={
+            NO_TAGS: float(os.environ.get("TAG_CACHE_NO_TAGS_TTL_SECONDS", "300")),
+            NO_ORG_GUID: float(
+                os.environ.get("TAG_CACHE_NO_ORG_GUID_TTL_SECONDS", "300")
+            ),
+            NOT_FOUND: float(os.environ.get("TAG_CACHE_NOT_FOUND_TTL_SECONDS", "300")),
+            THROTTLED: float(os.environ.get("TAG_CACHE_THROTTLED_TTL_SECONDS", "15")),
+        },
+    )
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from lambda_functions.clients import make_client
+from lambda_functions.prefixes import environment_prefixes
+from lambda_functions.tag_snapshot import DEFAULT_CHANGES_KEY, build_snapshot
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TAG_CHANGE_DETAIL_TYPE = "Tag Change on Resource"
+# Retries when another invocation rewrote the change record between our
+# read and our conditional write.
+MAX_WRITE_ATTEMPTS = 5
+CONFLICT_ERROR_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+def lambda_handler(event, context):
+    """
+    Consumes EventBridge "Tag Change on Resource" events from aws.tag and
+    records the new tags of broker RDS instances, OpenSearch domains and S3
+    buckets in the tag change record, which the transforms check on every
+    invocation.
+    """
+    region = boto3.Session().region_name or os.environ.get("AWS_REGION")
+    bucket = os.environ.get("TAG_SNAPSHOT_BUCKET")
+    if not bucket:
+        raise ValueError("TAG_SNAPSHOT_BUCKET environment variable must be set.")
+    key = os.environ.get("TAG_CHANGES_KEY", DEFAULT_CHANGES_KEY)
+    retention = float(os.environ.get("TAG_CHANGES_RETENTION_SECONDS", "86400"))
+    rds_prefix, s3_prefix, domain_prefix = environment_prefixes()
+
+    changes = broker_tag_changes(event, rds_prefix, s3_prefix, domain_prefix)
+    if not changes:
+        logger.info(f"Tag change for {event.get('resources')} does not apply")
+        return {"changed": 0}
+    resources = record_tag_changes(
+        make_client("s3", region), bucket, key, changes, retention
+    )
+    logger.info(
+        f"Recorded tag changes for {list(changes)} in s3://{bucket}/{key}, "
+        f"{resources} resources tracked"
+    )
+    return {"changed": len(changes), "resources": resources}
+
+
+def broker_tag_changes(event, rds_prefix, s3_prefix, domain_prefix) -> dict:
+    """
+    Returns {arn: tags} for the broker resources in a tag change event. The
+    event carries the resource's full tag set after the change.
+    """
+    if event.get("detail-type") != TAG_CHANGE_DETAIL_TYPE:
+        return {}
+    tags = event.get("detail", {}).get("tags", {})
+    return {
+        arn: dict(tags)
+        for arn in event.get("resources", [])
+        if is_broker_resource(arn, rds_prefix, s3_prefix, domain_prefix)
+    }
+
+
+def is_broker_resource(arn, rds_prefix, s3_prefix, domain_prefix) -> bool:
+    parts = arn.split(":", 5)
+    if len(parts) < 6:
+        return False
+    service, resource = parts[2], parts[5]
+    if service == "rds":
+        return resource.startswith(f"db:{rds_prefix}")
+    if service == "es":
+        return resource.startswith(f"domain/{domain_prefix}")
+    if service == "s3":
+        return resource.startswith(s3_prefix)
+    return False
+
+
+def record_tag_changes(
+    s3_client, bucket, key, changes, retention, clock=time.time
+) -> int:
+    """
+    Merges changes into the change record with a conditional write, dropping
+    entries older than retention seconds. Retention must exceed the snapshot
+    schedule so a snapshot taken before a change never outlives its entry.
+    Returns the number of resources left in the record.
+    """
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+            document = json.loads(response["Body"].read())
+            conditions = {"IfMatch": response["ETag"]}
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+                raise
+            document = {}
+            conditions = {"IfNoneMatch": "*"}
+
+        now = clock()
+        resources = document.get("resources", {})
+        changed_at = document.get("changed_at", {})
+        for arn, at in list(changed_at.items()):
+            if now - at > retention:
+                resources.pop(arn, None)
+                del changed_at[arn]
+        for arn, tags in changes.items():
+            resources[arn] = tags
+            changed_at[arn] = now
+
+        try:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=build_snapshot(resources, changed_at=changed_at),
+                ContentType="application/json",
+                **conditions,
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in CONFLICT_ERROR_CODES:
+                logger.info("Tag change record changed while writing, retrying")
+                continue
+            raise
+        return len(resources)
+    raise RuntimeError(
+        f"Could not record tag changes after {MAX_WRITE_ATTEMPTS} attempts"
+    )
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from lambda_functions.tag_cache import store_tags
+
+logger = logging.getLogger()
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_KEY = "tag-snapshots/v1/latest.json"
+DEFAULT_CHANGES_KEY = "tag-snapshots/v1/changes.json"
+
+
+def build_snapshot(resources, changed_at=None) -> bytes:
+    """
+    Serializes {arn: tags} as a compact, versioned snapshot document. The
+    tag change record also carries {arn: epoch seconds} in changed_at.
+    """
+    document = {
+        "version": SNAPSHOT_VERSION,
+        "generated_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "resources": resources,
+    }
+    if changed_at is not None:
+        document["changed_at"] = changed_at
+    return json.dumps(document, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+class TagSnapshotLoader:
+    """
+    Loads a tag snapshot into a TagCache at cold start and reloads it when its
+    ETag changes. The ETag is checked at most once per check_interval with a
+    conditional GET, which returns no body when the snapshot is unchanged;
+    the entries already loaded are then stored again, so they do not expire
+    from the cache while the snapshot stays the same. With a check_interval
+    below the cache's TTL they never do. Resources missing from the snapshot
+    are still resolved by live lookups.
+
+    The same loader, with a check_interval of 0, reads the tag change record
+    written by tag_change_handler on every invocation.
+    """
+
+    def __init__(self, bucket, key, check_interval=300, clock=time.monotonic):
+        self.bucket = bucket
+        self.key = key
+        self.check_interval = check_interval
+        self._clock = clock
+        self._checked_at = None
+        self.etag = None
+        self.resources = {}
+        self.loads = 0
+
+    def is_due(self):
+        return (
+            self._checked_at is None
+            or self._clock() - self._checked_at >= self.check_interval
+        )
+
+    def refresh(self, s3_client, cache, normalize=None, include=None):
+        """
+        Loads the snapshot into cache when it is due, or stores the entries
+        loaded before again when it has not changed. Returns the number of
+        entries stored, 0 when the check was not due.
+        """
+        if not self.is_due():
+            return 0
+        self._checked_at = self._clock()
+        params = {"Bucket": self.bucket, "Key": self.key}
+        if self.etag is not None:
+            params["IfNoneMatch"] = self.etag
+        try:
+            response = s3_client.get_object(**params)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("304", "NotModified"):
+                return self.reapply(cache, normalize, include)
+            if code == "NoSuchKey":
+                logger.info(f"No tag snapshot at s3://{self.bucket}/{self.key} yet")
+                return 0
+            raise
+        document = json.loads(response["Body"].read())
+        if document.get("version") != SNAPSHOT_VERSION:
+            logger.error(
+                f"Ignoring tag snapshot with version {document.get('version')}"
+            )
+            return 0
+        self.resources = document.get("resources", {})
+        loaded = load_into_cache(self.resources, cache, normalize, include)
+        self.etag = response.get("ETag")
+        self.loads += 1
+        logger.info(f"Loaded {loaded} resources from tag snapshot {self.etag}")
+        return loaded
+
+    def reapply(self, cache, normalize=None, include=None):
+        """
+        Stores the last loaded entries in the cache again, so they win over an
+        older document that was loaded after them.
+        """
+        return load_into_cache(self.resources, cache, normalize, include)
+
+
+def load_into_cache(resources, cache, normalize=None, include=None) -> int:
+    """
+    Stores the {arn: tags} entries accepted by include(arn) in the cache.
+    Warns when there are more of them than the cache holds, as the oldest
+    are then evicted again before they are ever read.
+    """
+    loaded = 0
+    for arn, tags in resources.items():
+        if include is not None and not include(arn):
+            continue
+        store_tags(cache, arn, tags, normalize)
+        loaded += 1
+    if loaded > cache.maxsize:
+        logger.warning(
+            f"Tag snapshot has {loaded} resources but the tag cache holds "
+            f"{cache.maxsize}; raise TAG_CACHE_MAX_ENTRIES"
+        )
+    return loaded
+
+
+def snapshot_loader_from_env():
+    """
+    Builds a TagSnapshotLoader from TAG_SNAPSHOT_* environment variables, or
+    returns None when TAG_SNAPSHOT_BUCKET is not set. Keep
+    TAG_SNAPSHOT_CHECK_SECONDS below TAG_CACHE_TTL_SECONDS, or snapshot
+    entries expire between checks and fall back to live lookups. Likewise
+    keep TAG_CACHE_MAX_ENTRIES above the snapshot's resource count plus the
+    lambda's other entries (RDS inventory seeding adds two per instance), or
+    snapshot entries are evicted and looked up live again.
+    """
+    bucket = os.environ.get("TAG_SNAPSHOT_BUCKET")
+    if not bucket:
+        return None
+    return TagSnapshotLoader(
+        bucket,
+        os.environ.get("TAG_SNAPSHOT_KEY", DEFAULT_SNAPSHOT_KEY),
+        check_interval=float(os.environ.get("TAG_SNAPSHOT_CHECK_SECONDS", "300")),
+    )
+
+
+def change_loader_from_env():
+    """
+    Builds a TagSnapshotLoader for the tag change record, checked on every
+    invocation unless TAG_CHANGES_CHECK_SECONDS says otherwise, or returns
+    None when TAG_SNAPSHOT_BUCKET is not set.
+    """
+    bucket = os.environ.get("TAG_SNAPSHOT_BUCKET")
+    if not bucket:
+        return None
+    return TagSnapshotLoader(
+        bucket,
+        os.environ.get("TAG_CHANGES_KEY", DEFAULT_CHANGES_KEY),
+        check_interval=float(os.environ.get("TAG_CHANGES_CHECK_SECONDS", "0")),
+    )
@@ -0,0 +1,52 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from lambda_functions.tag_cache import store_tags
+
+logger = logging.getLogger()
+
+# GetResources accepts at most 100 ARNs in ResourceARNList.
+MAX_ARNS_PER_REQUEST = 100
+
+
+def prefetch_tags(arns, client, cache, normalize=None):
+    """
+    Resolves every ARN that is not already cached with batched Resource Groups
+    Tagging API calls and stores the results in the cache.
+
+    ``normalize(arn, tags)`` lets the caller apply the same filtering its
+    per-service lookups use; it may raise NegativeLookup. ARNs the tagging
+    API does not return (untagged or deleted resources) are left uncached so
+    the per-service lookups still run for them. Returns the number of ARNs
+    that were resolved.
+    """
+    missing = [arn for arn in dict.fromkeys(arns) if arn not in cache]
+    resolved = 0
+    if not missing:
+        return resolved
+    paginator = client.get_paginator("get_resources")
+    for start in range(0, len(missing), MAX_ARNS_PER_REQUEST):
+        chunk = missing[start : start + MAX_ARNS_PER_REQUEST]
+        for page in paginator.paginate(ResourceARNList=chunk):
+            for mapping in page.get("ResourceTagMappingList", []):
+                arn = mapping["ResourceARN"]
+                tags = {tag["Key"]: tag["Value"] for tag in mapping.get("Tags", [])}
+                store_tags(cache, arn, tags, normalize)
+                resolved += 1
+    logger.info(f"Prefetched tags for {resolved} of {len(missing)} uncached ARNs")
+    return resolved
+
+
+def resolve_concurrently(lookups, max_workers):
+    """
+    Runs the lookup callables on a bounded thread pool and waits for all of
+    them. The callables are expected to handle and log their own errors.
+    """
+    lookups = list(lookups)
+    if max_workers <= 1 or len(lookups) <= 1:
+        for lookup in lookups:
+            lookup()
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(lookups))) as pool:
+        for future in [pool.submit(lookup) for lookup in lookups]:
+            future.result()
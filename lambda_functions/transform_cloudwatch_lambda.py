@@ -1,17 +1,106 @@
 import boto3
-import gzip
+from botocore.exceptions import ClientError
 import json
-from datetime import datetime
-import time
-import io
 import os
 import logging
-from functools import lru_cache
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from lambda_functions.codec import LOG_TEMPLATES, codec_from_env, iter_gzip_lines
+from lambda_functions.inventory import RdsInventory
+from lambda_functions.log_output import (
+    BatchKeys,
+    BatchOutput,
+    GzipObjectWriter,
+    PipelinedOutput,
+    TenantOutput,
+    output_options_from_env,
+)
+from lambda_functions.prefilter import LogPrefilter
+from lambda_functions.tag_cache import (
+    NO_ORG_GUID,
+    NO_TAGS,
+    NegativeLookup,
+    negative_reason,
+    tag_cache_from_env,
+)
+from lambda_functions.tag_snapshot import (
+    change_loader_from_env,
+    snapshot_loader_from_env,
+)
+from lambda_functions.tagging import resolve_concurrently
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Lambda allocates CPU in proportion to memory: one full vCPU per 1,769 MB.
+MB_PER_VCPU = 1769
+
+
+def available_cpus():
+    """
+    Returns the vCPUs the sandbox can use at once. Lambda reports at least
+    two CPUs whatever its memory size, so the share bought by
+    AWS_LAMBDA_FUNCTION_MEMORY_SIZE is used where it is set.
+    """
+    cpus = os.cpu_count() or 1
+    memory = os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if memory:
+        cpus = min(cpus, int(memory) // MB_PER_VCPU)
+    return max(1, cpus)
+
+
+# orjson when installed, stdlib json otherwise; works in bytes throughout.
+codec = codec_from_env()
+# Shared by every invocation in the sandbox; keyed by ARN, not by client.
+tag_cache = tag_cache_from_env()
+# Shared tag snapshot written by generate_tag_snapshot; None when disabled.
+tag_snapshot_loader = snapshot_loader_from_env()
+# Recent tag changes recorded by tag_change_handler, checked every invocation.
+tag_change_loader = change_loader_from_env()
+# Broker RDS instances indexed by identifier; replaces per-instance tag calls
+# when RDS_INVENTORY_ENABLED is set.
+RDS_INVENTORY_ENABLED = os.environ.get("RDS_INVENTORY_ENABLED", "false") == "true"
+rds_inventory = RdsInventory(
+    refresh_interval=float(os.environ.get("RDS_INVENTORY_REFRESH_SECONDS", "300"))
+)
+# Skip parsing control messages and non-broker log groups from their raw
+# bytes.
+LOG_PREFILTER_ENABLED = os.environ.get("LOG_PREFILTER_ENABLED", "true") == "true"
+# Upper bound on parallel tag API calls; 1 resolves tags inline as before.
+TAG_LOOKUP_CONCURRENCY = int(os.environ.get("TAG_LOOKUP_CONCURRENCY", "8"))
+# Compressed and uncompressed sizes at which the batch rolls over to a new S3
+# object, the multipart part size for large objects (0 disables each), and
+# whether objects are written with If-None-Match.
+S3_OUTPUT_OPTIONS = output_options_from_env()
+# "tenant" writes each Organization GUID's logs to its own objects under
+# tenants/<guid>/; "none" writes the whole batch together.
+S3_OUTPUT_PARTITION = os.environ.get("S3_OUTPUT_PARTITION", "none")
+# "compact" writes each log group and stream's logGroup, logStream and Tags
+# once, followed by [timestamp, message] rows; "full" repeats them per event.
+S3_OUTPUT_FORMAT = os.environ.get("S3_OUTPUT_FORMAT", "full")
+# Threads decoding and decompressing records; 0 follows the vCPUs and 1
+# decodes inline.
+RECORD_DECODE_WORKERS = (
+    int(os.environ.get("RECORD_DECODE_WORKERS", "0")) or available_cpus()
+)
+# Decompressed bytes a single record may hold before it fails; guards the
+# sandbox's memory against pathological records. 0 disables the limit.
+MAX_DECOMPRESSED_RECORD_BYTES = int(
+    os.environ.get("MAX_DECOMPRESSED_RECORD_BYTES", str(64 * 2**20))
+)
+# Upper bound on parallel S3 uploads of partitioned output.
+S3_UPLOAD_CONCURRENCY = int(os.environ.get("S3_UPLOAD_CONCURRENCY", "8"))
+# Records whose output may wait for the background compression thread; 0
+# compresses and uploads on the handler thread.
+S3_UPLOAD_PIPELINE_DEPTH = int(os.environ.get("S3_UPLOAD_PIPELINE_DEPTH", "4"))
+# Uploads finished objects while the next ones are compressed; its threads
+# are started on first use and kept for the sandbox's later invocations.
+s3_uploads = ThreadPoolExecutor(
+    max_workers=S3_UPLOAD_CONCURRENCY, thread_name_prefix="s3-upload"
+)
+
 
 def lambda_handler(event, context):
     """
@@ -19,7 +108,10 @@ def lambda_handler(event, context):
     and stores them in S3.
     """
     output_records = []
-    s3_output = []
+    s3_events = 0
+    # Records marked Ok, which fail again if their upload does
+    uploaded_records = []
+    upload_failed = False
 
     try:
         region = boto3.Session().region_name or os.environ.get("AWS_REGION")
@@ -38,6 +130,8 @@ def lambda_handler(event, context):
         # Initialize clients
         s3_client = boto3.client("s3", region_name=region)
         rds_client = boto3.client("rds", region_name=region)
+        # Enriched events as NDJSON, compressed after each record
+        s3_output = make_output(s3_client, bucket)
             
     except ValueError as e:
         logger.error(f"Configuration error: {str(e)}")
@@ -45,27 +139,42 @@ def lambda_handler(event, context):
     except Exception as e:
         logger.error(f"Initialization error: {str(e)}")
         return {"records": []}
+
+    if tag_snapshot_loader is not None:
+        load_tag_snapshot(s3_client)
+    if RDS_INVENTORY_ENABLED:
+        refresh_rds_inventory(rds_client, rds_prefix)
     
-    for record in event["records"]:
+    prefilter = LogPrefilter(rds_prefix) if LOG_PREFILTER_ENABLED else None
+    # Decode every record first so the batch's tag lookups can run together
+    decoded_records = decode_records(event["records"], RECORD_DECODE_WORKERS, prefilter)
+
+    if TAG_LOOKUP_CONCURRENCY > 1:
+        resolve_log_group_tags(
+            [
+                logs
+                for _, documents, _ in decoded_records
+                if documents
+                for logs in documents
+            ],
+            rds_client,
+            region,
+            account_id,
+            rds_prefix,
+        )
+
+    for record, log_documents, decode_error in decoded_records:
         try:
-            # Decode and decompress the CloudWatch Logs data
-            compressed_data = base64.b64decode(record["data"])
-            pre_json_value = gzip.decompress(compressed_data)
-
-            processed_logs = []
-            for line in pre_json_value.strip().splitlines():
-                try:
-                    logs = json.loads(line)
-                    log_results = process_logs(
-                        logs, rds_client, region, account_id, rds_prefix
-                    )
-                    if log_results:
-                        processed_logs.extend(log_results)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error decoding JSON: {e}. Line: {line}")
-                    continue  # Skip to the next line if JSON decoding fails
-            if processed_logs:
-                s3_output.extend(processed_logs)  # Flatten the logs directly
+            if decode_error is not None:
+                raise decode_error
+
+            processed_events = 0
+            for logs in log_documents:
+                processed_events += process_logs(
+                    logs, rds_client, region, account_id, rds_prefix, s3_output
+                )
+            if processed_events:
+                s3_events += processed_events
 
                 # Mark the record as successfully processed (but data is now in S3)
                 output_record = {
@@ -74,6 +183,9 @@ def lambda_handler(event, context):
                     'data': base64.b64encode(b'').decode('utf-8')  # Empty data
                 }
                 output_records.append(output_record)
+                uploaded_records.append((output_record, record))
+                if not push_output(s3_output):
+                    upload_failed = True
             else:
                 # Mark the record as dropped if no logs were processed
                 output_record = {
@@ -84,6 +196,7 @@ def lambda_handler(event, context):
                 output_records.append(output_record)
 
         except Exception as e:
+            s3_output.discard()
             logger.error(f"Error processing record {record['recordId']}: {str(e)}")
             # Consider marking the record as failed, or attempt to re-queue it.
             output_record = {
@@ -93,31 +206,108 @@ def lambda_handler(event, context):
             }
             output_records.append(output_record)
 
-    # After processing all records, push the combined logs to S3
-    if s3_output:
-        try:
-            # Convert logs to newline-delimited JSON
-            buffer = io.BytesIO()
-            with gzip.GzipFile(fileobj=buffer, mode='wb') as gz_file:
-                for log in s3_output:
-                    gz_file.write((json.dumps(log) + '\n').encode('utf-8'))
-            compressed_data = buffer.getvalue()
-            s3_key = f"{datetime.now().strftime('%Y/%m/%d/%H')}/batch-{int(time.time())}.json.gz"
-            s3_client.put_object(
-                Bucket=bucket,
-                Key=s3_key,
-                Body=compressed_data,
-                ContentType='application/gzip',
-                ContentEncoding='gzip'
-            )
-            
-            logger.info(f"Successfully pushed {len(s3_output)} logs to S3: {s3_key}")
-
-        except Exception as e:
-            logger.error(f"Failed to push final batch to S3: {str(e)}")
+    # After processing all records, wait for the rest of the logs to reach S3
+    if not push_output(s3_output, close=True):
+        upload_failed = True
+    if upload_failed:
+        # Firehose retries them; events already in S3 may arrive twice
+        for output_record, record in uploaded_records:
+            output_record["result"] = "ProcessingFailed"
+            output_record["data"] = record["data"]
+    elif s3_events:
+        logger.info(f"Pushed {s3_events} logs to S3 in {len(s3_output.keys)} object(s)")
+    if prefilter is not None:
+        logger.info(f"Log prefilter stats: {prefilter.stats()}")
+    logger.info(f"Tag cache stats: {tag_cache.stats()}")
     return {"records": output_records}
 
 
+def decode_record(record, prefilter=None):
+    """
+    Decodes and decompresses a Firehose record into its CloudWatch Logs
+    documents. Each line is parsed as soon as it is decompressed, so the
+    record's payload is never held decompressed in full. Returns (record,
+    documents, None), or (record, None, error) when the record cannot be
+    decoded or decompresses past MAX_DECOMPRESSED_RECORD_BYTES. Documents
+    the prefilter rejects are left out unparsed. Safe to run on worker
+    threads.
+    """
+    try:
+        compressed_data = base64.b64decode(record["data"])
+
+        log_documents = []
+        for line in iter_gzip_lines(compressed_data, MAX_DECOMPRESSED_RECORD_BYTES):
+            if prefilter is not None and not prefilter.accepts(line):
+                continue
+            try:
+                log_documents.append(codec.loads(line))
+            except json.JSONDecodeError as e:
+                logger.error(f"Error decoding JSON: {e}. Line: {bytes(line)}")
+                continue  # Skip to the next line if JSON decoding fails
+        return record, log_documents, None
+    except Exception as e:
+        return record, None, e
+
+
+def decode_records(records, workers, prefilter=None):
+    """
+    Decodes the batch's records on up to workers threads. zlib releases the
+    GIL while inflating, so decompression runs on every vCPU the sandbox
+    has. Results come back in the records' order.
+    """
+    decode = partial(decode_record, prefilter=prefilter)
+    if workers <= 1 or len(records) <= 1:
+        return [decode(record) for record in records]
+    with ThreadPoolExecutor(max_workers=min(workers, len(records))) as pool:
+        return list(pool.map(decode, records))
+
+
+def make_output(s3_client, bucket):
+    """
+    Builds the batch's output for S3_OUTPUT_PARTITION.
+    """
+    if S3_OUTPUT_FORMAT not in LOG_TEMPLATES:
+        raise ValueError(f"Invalid S3_OUTPUT_FORMAT: {S3_OUTPUT_FORMAT}")
+    keys = BatchKeys()
+    options = dict(S3_OUTPUT_OPTIONS)
+    if S3_UPLOAD_PIPELINE_DEPTH > 0:
+        options["uploader"] = s3_uploads
+    if S3_OUTPUT_PARTITION == "tenant":
+        output = TenantOutput(
+            lambda tenant: GzipObjectWriter(
+                s3_client,
+                bucket,
+                keys.partition(f"tenants/{tenant}"),
+                **options,
+            ),
+            max_workers=S3_UPLOAD_CONCURRENCY,
+        )
+    elif S3_OUTPUT_PARTITION == "none":
+        output = BatchOutput(GzipObjectWriter(s3_client, bucket, keys, **options))
+    else:
+        raise ValueError(f"Invalid S3_OUTPUT_PARTITION: {S3_OUTPUT_PARTITION}")
+    if S3_UPLOAD_PIPELINE_DEPTH > 0:
+        output = PipelinedOutput(output, max_pending=S3_UPLOAD_PIPELINE_DEPTH)
+    return output
+
+
+def push_output(output, close=False):
+    """
+    Compresses the record's events into the batch's current S3 objects, or
+    with close uploads the last objects and waits for every upload. Returns
+    False, after logging the error, when an upload failed.
+    """
+    try:
+        if close:
+            output.close()
+        else:
+            output.commit()
+    except Exception as e:
+        logger.error(f"Failed to push batch to S3: {str(e)}")
+        return False
+    return True
+
+
 def make_prefixes():
     """
     Determines the prefix based on the ENVIRONMENT variable.
@@ -140,34 +330,100 @@ def make_prefixes():
     return rds_prefix
 
 
-def process_logs(logs, client, region, account_id, rds_prefix):
+def process_logs(logs, client, region, account_id, rds_prefix, output):
     """
-    Enriches CloudWatch Logs with tags.
+    Enriches CloudWatch Logs with tags, appending the log events' NDJSON
+    lines, in S3_OUTPUT_FORMAT, to output.buffer(tags). Returns the number
+    of events written; a document that fails part way leaves the buffer as
+    it was.
     """
+    out = None
     try:
-        return_logs = []
         resource_name = logs["logGroup"].split("/")[4]
         tags = get_resource_tags_from_log(
             resource_name, client, region, account_id, rds_prefix
         )
 
         if len(tags.keys()) > 0:
+            out = output.buffer(tags)
+            start = len(out)
+            template = LOG_TEMPLATES[S3_OUTPUT_FORMAT](
+                codec, logs["logGroup"], logs["logStream"], tags
+            )
+            template.begin(out)
             for event in logs["logEvents"]:
-                entry = {
-                    "logGroup": logs["logGroup"],
-                    "logStream": logs["logStream"],
-                    "message": event["message"],
-                    "timestamp": event["timestamp"],
-                    "Tags": tags,
-                }
-                return_logs.append(entry)
+                template.write(out, event)
         else:
-            return None
+            return 0
 
     except Exception as e:
         logger.error(f"Could not process logs: {e}")
-        return None
-    return return_logs
+        if out is not None:
+            del out[start:]
+        return 0
+    return len(logs["logEvents"])
+
+
+def load_tag_snapshot(s3_client):
+    """
+    Loads the RDS entries of the shared tag snapshot at cold start and
+    whenever its ETag changes, then applies the tag change record on top.
+    """
+    loaded = 0
+    try:
+        loaded = tag_snapshot_loader.refresh(
+            s3_client, tag_cache, normalize=filter_tags, include=is_rds_arn
+        )
+    except Exception as e:
+        logger.error(f"Could not load tag snapshot: {e}")
+    if tag_change_loader is None:
+        return
+    try:
+        changed = tag_change_loader.refresh(
+            s3_client, tag_cache, normalize=filter_tags, include=is_rds_arn
+        )
+        if loaded and not changed:
+            # The snapshot may predate the recorded changes
+            tag_change_loader.reapply(
+                tag_cache, normalize=filter_tags, include=is_rds_arn
+            )
+    except Exception as e:
+        logger.error(f"Could not load tag changes: {e}")
+
+
+def is_rds_arn(arn):
+    return ":db:" in arn
+
+
+def refresh_rds_inventory(client, rds_prefix):
+    """
+    Refreshes the RDS inventory when it is due and seeds the tag cache with
+    every broker instance's tags.
+    """
+    try:
+        rds_inventory.ensure_fresh(client, rds_prefix, tag_cache, sizes=False)
+    except Exception as e:
+        logger.error(f"Could not refresh RDS inventory: {e}")
+
+
+def resolve_log_group_tags(log_documents, client, region, account_id, rds_prefix):
+    """
+    Fetches tags for the batch's distinct uncached log group resources on a
+    bounded thread pool. The tag cache coalesces lookups of the same ARN.
+    """
+    lookups = {}
+    for logs in log_documents:
+        try:
+            resource_name = logs["logGroup"].split("/")[4]
+        except (KeyError, IndexError, AttributeError):
+            continue
+        if not resource_name.startswith(rds_prefix):
+            continue
+        arn = f"arn:aws-us-gov:rds:{region}:{account_id}:db:{resource_name}"
+        if arn not in lookups and arn not in tag_cache:
+            lookups[arn] = partial(get_tags_from_arn, arn, client)
+    resolve_concurrently(lookups.values(), TAG_LOOKUP_CONCURRENCY)
+
 
 def get_resource_tags_from_log(
     resource_name, client, region, account_id, rds_prefix
@@ -186,19 +442,46 @@ def get_resource_tags_from_log(
 
 
 
-@lru_cache(maxsize=256)
 def get_tags_from_arn(arn, client) -> dict:
     """
-    Retrieves tags from an instance using its ARN.  Uses lru_cache to minimize API calls.
+    Retrieves tags from an instance using its ARN. Results are kept in the
+    sandbox-wide tag cache so warm invocations skip the API call.
+    """
+    tags = {}
+    try:
+        tags = tag_cache.get(arn, lambda: fetch_tags_from_arn(arn, client))
+    except Exception as e:
+        logger.error(f"Could not fetch tags for ARN {arn}: {e}")
+    return tags
+
+
+def fetch_tags_from_arn(arn, client) -> dict:
+    """
+    Calls the RDS tagging API for an ARN. Untagged, non-tenant, deleted and
+    throttled resources raise NegativeLookup so the cache can hold them briefly.
     """
     tags = {}
     if ":db:" in arn:
         try:
             response = client.list_tags_for_resource(ResourceName=arn)
-            tags = {tag["Key"]: tag["Value"] for tag in response.get("TagList", [])}
-            if "Organization GUID" not in tags:
-                logger.warning(f"Organization GUID tag missing for ARN: {arn}")
-                return {}
-        except Exception as e:
-            logger.error(f"Could not fetch tags for ARN {arn}: {e}")
+        except ClientError as e:
+            reason = negative_reason(e)
+            if reason is None:
+                raise
+            raise NegativeLookup(reason) from e
+        tags = {tag["Key"]: tag["Value"] for tag in response.get("TagList", [])}
+        tags = filter_tags(arn, tags)
+    return tags
+
+
+def filter_tags(arn, tags) -> dict:
+    """
+    Applies the RDS tag rules however the tags were fetched. Raises
+    NegativeLookup when the instance is untagged or not a tenant database.
+    """
+    if not tags:
+        raise NegativeLookup(NO_TAGS)
+    if "Organization GUID" not in tags:
+        logger.warning(f"Organization GUID tag missing for ARN: {arn}")
+        raise NegativeLookup(NO_ORG_GUID)
     return tags
@@ -1,32 +1,180 @@
-import json
-import base64
+import binascii
 import boto3
+from botocore.exceptions import ClientError
 import logging
 import os
-from functools import lru_cache
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+from lambda_functions.clients import make_client
+from lambda_functions.codec import codec_from_env, iter_lines, write_document
+from lambda_functions.inventory import DomainInventory, RdsInventory
+from lambda_functions.prefilter import MetricPrefilter
+from lambda_functions.resolvers import default_registry
+from lambda_functions.tag_cache import (
+    NO_ORG_GUID,
+    NO_TAGS,
+    NegativeLookup,
+    negative_reason,
+    tag_cache_from_env,
+)
+from lambda_functions.tag_snapshot import (
+    change_loader_from_env,
+    snapshot_loader_from_env,
+)
+from lambda_functions.tagging import prefetch_tags, resolve_concurrently
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 default_keys_to_remove = ["metric_stream_name", "account_id", "region"]
-EXPECTED_NAMESPACES = ["AWS/S3", "AWS/ES", "AWS/RDS"]
+# Namespaces the transform enriches, see lambda_functions.resolvers.
+resolver_registry = default_registry()
+# Unknown namespaces already reported by this sandbox.
+_unknown_namespaces = set()
+# Resolve the batch's uncached ARNs with tag:GetResources before falling back
+# to per-resource calls. Off by default: the role needs tag:GetResources.
+TAG_PREFETCH_ENABLED = os.environ.get("TAG_PREFETCH_ENABLED", "false") == "true"
+# Skip decoding lines the raw-bytes prefilter can already drop.
+METRIC_PREFILTER_ENABLED = os.environ.get("METRIC_PREFILTER_ENABLED", "true") == "true"
+S3_ARN_PREFIX = "arn:aws-us-gov:s3:::"
+# Upper bound on parallel tag API calls; 1 resolves tags inline as before.
+TAG_LOOKUP_CONCURRENCY = int(os.environ.get("TAG_LOOKUP_CONCURRENCY", "8"))
+
+# orjson when installed, stdlib json otherwise; works in bytes throughout.
+codec = codec_from_env()
+
+# Shared by every invocation in the sandbox; keyed by ARN, not by client.
+tag_cache = tag_cache_from_env()
+
+# Shared tag snapshot written by generate_tag_snapshot; None when disabled.
+tag_snapshot_loader = snapshot_loader_from_env()
+# Recent tag changes recorded by tag_change_handler, checked every invocation.
+tag_change_loader = change_loader_from_env()
+
+# Broker RDS instances indexed by identifier; replaces per-instance tag and
+# describe calls when RDS_INVENTORY_ENABLED is set.
+RDS_INVENTORY_ENABLED = os.environ.get("RDS_INVENTORY_ENABLED", "false") == "true"
+rds_inventory = RdsInventory(
+    refresh_interval=float(os.environ.get("RDS_INVENTORY_REFRESH_SECONDS", "300"))
+)
+# Broker OpenSearch domains with their sizing, enabled by DOMAIN_INVENTORY_ENABLED.
+DOMAIN_INVENTORY_ENABLED = os.environ.get("DOMAIN_INVENTORY_ENABLED", "false") == "true"
+domain_inventory = DomainInventory(
+    refresh_interval=float(os.environ.get("DOMAIN_INVENTORY_REFRESH_SECONDS", "300"))
+)
+
+# Built on the first invocation in a sandbox and reused by every warm one.
+_runtime = None
+
+# Optional init-phase warm-up of the tag cache, see prewarm_tag_cache.
+TAG_CACHE_PREWARM = os.environ.get("TAG_CACHE_PREWARM", "false") == "true"
+TAG_CACHE_PREWARM_BUDGET_MS = int(os.environ.get("TAG_CACHE_PREWARM_BUDGET_MS", "3000"))
+prewarm_stats = None
+
+
+class RuntimeContext:
+    """
+    Process-lifetime state for the metric transform: validated configuration,
+    environment prefixes and pooled boto3 clients.
+    """
+
+    def __init__(self):
+        self.region = boto3.Session().region_name or os.environ.get("AWS_REGION")
+        if not self.region:
+            raise ValueError(
+                "AWS_REGION environment variable or session region is required"
+            )
+        self.account_id = os.environ.get("ACCOUNT_ID")
+        if not self.account_id:
+            raise ValueError("ACCOUNT_ID environment variable is required")
+        self.rds_prefix, self.s3_prefix, self.domain_prefix = make_prefixes()
+        self.s3_client = make_client("s3", self.region)
+        self.es_client = make_client("es", self.region)
+        self.rds_client = make_client("rds", self.region)
+        self.tagging_client = make_client("resourcegroupstaggingapi", self.region)
+        self._clients = {
+            "s3": self.s3_client,
+            "es": self.es_client,
+            "rds": self.rds_client,
+        }
+        self._clients_lock = threading.Lock()
+
+    def client(self, service):
+        """
+        Returns the client for a resolver's service, creating clients for the
+        less common namespaces on first use.
+        """
+        with self._clients_lock:
+            if service not in self._clients:
+                self._clients[service] = make_client(service, self.region)
+            return self._clients[service]
+
+
+def get_runtime():
+    """
+    Returns the sandbox's runtime context, building it on first use.
+    """
+    global _runtime
+    if _runtime is None:
+        _runtime = RuntimeContext()
+    return _runtime
+
+
+def reset_runtime():
+    """
+    Drops the cached runtime context so the next invocation rebuilds it.
+    """
+    global _runtime
+    _runtime = None
 
 
 def lambda_handler(event, context):
     output_records = []
-    region = boto3.Session().region_name or os.environ.get("AWS_REGION")
-    rds_prefix, s3_prefix, domain_prefix = make_prefixes()
-    account_id = os.environ.get("ACCOUNT_ID")
-    s3_client = boto3.client("s3", region_name=region)
-    es_client = boto3.client("es", region_name=region)
-    rds_client = boto3.client("rds", region_name=region)
     try:
+        runtime = get_runtime()
+    except Exception as e:
+        logger.error(f"Configuration error: {str(e)}")
+        return {"records": []}
+    region = runtime.region
+    rds_prefix, s3_prefix, domain_prefix = (
+        runtime.rds_prefix,
+        runtime.s3_prefix,
+        runtime.domain_prefix,
+    )
+    account_id = runtime.account_id
+    s3_client = runtime.s3_client
+    es_client = runtime.es_client
+    rds_client = runtime.rds_client
+    if tag_snapshot_loader is not None:
+        load_tag_snapshot(runtime)
+    if RDS_INVENTORY_ENABLED:
+        refresh_rds_inventory(runtime)
+    if DOMAIN_INVENTORY_ENABLED:
+        refresh_domain_inventory(runtime)
+    prefilter = None
+    if METRIC_PREFILTER_ENABLED:
+        prefilter = MetricPrefilter(
+            resolver_registry,
+            broker_prefixes(rds_prefix, s3_prefix, domain_prefix),
+            reported=_unknown_namespaces,
+        )
+    try:
+        # Decode the whole batch first so tags can be prefetched in bulk
+        decoded_records = []
         for record in event["records"]:
-            pre_json_value = base64.b64decode(record["data"])
+            decoded_records.append((record, decode_metrics(record["data"], prefilter)))
+
+        batch_metrics = [metric for _, metrics in decoded_records for metric in metrics]
+        if TAG_PREFETCH_ENABLED:
+            prefetch_batch_tags(batch_metrics, runtime)
+        if TAG_LOOKUP_CONCURRENCY > 1:
+            resolve_batch_tags(batch_metrics, runtime)
+
+        for record, metrics in decoded_records:
             processed_metrics = []
-            for line in pre_json_value.strip().splitlines():
-                metric = json.loads(line)
-                for key in default_keys_to_remove:
-                    metric.pop(key, None)
+            for metric in metrics:
                 metric_results = process_metric(
                     metric,
                     region,
@@ -37,27 +185,17 @@ def lambda_handler(event, context):
                     rds_client,
                     rds_prefix,
                     account_id,
+                    runtime,
                 )
                 if metric_results is not None:
                     metric_results["dimensions"].pop("ClientId", None)
                     processed_metrics.append(metric_results)
 
             if processed_metrics:
-                # Create newline-delimited JSON (no compression)
-                output_data = (
-                    "\n".join([json.dumps(metric) for metric in processed_metrics])
-                    + "\n"
-                )
-
-                # Just base64 encode for Firehose transport (no gzip)
-                encoded_output = base64.b64encode(output_data.encode("utf-8")).decode(
-                    "utf-8"
-                )
-
                 output_record = {
                     "recordId": record["recordId"],
                     "result": "Ok",
-                    "data": encoded_output,
+                    "data": encode_metrics(processed_metrics),
                 }
                 output_records.append(output_record)
             else:
@@ -70,9 +208,40 @@ def lambda_handler(event, context):
             logger.info(f"Processed record with {len(processed_metrics)} metrics")
     except Exception as e:
         logger.error(f"Error processing metrics: {str(e)}")
+    if prefilter is not None:
+        logger.info(f"Metric prefilter stats: {prefilter.stats()}")
+    logger.info(f"Tag cache stats: {tag_cache.stats()}")
     return {"records": output_records}
 
 
+def decode_metrics(data, prefilter=None):
+    """
+    Decodes a Firehose record's base64 NDJSON into metrics. Lines are read in
+    place through memoryview slices of the decoded buffer.
+    """
+    metrics = []
+    for line in iter_lines(binascii.a2b_base64(data)):
+        if prefilter is not None and not prefilter.accepts(line):
+            continue
+        metric = codec.loads(line)
+        for key in default_keys_to_remove:
+            metric.pop(key, None)
+        metrics.append(metric)
+    return metrics
+
+
+def encode_metrics(metrics):
+    """
+    Writes metrics as newline-delimited JSON (no compression) into one buffer
+    and base64-encodes it once for Firehose transport.
+    """
+    buffer = bytearray()
+    for metric in metrics:
+        write_document(buffer, codec, metric)
+        buffer += b"\n"
+    return binascii.b2a_base64(buffer, newline=False).decode("ascii")
+
+
 def make_prefixes():
     environment = os.getenv("ENVIRONMENT")
     if not environment:
@@ -100,6 +269,203 @@ def make_prefixes():
     return rds_prefix, s3_prefix, domain_prefix
 
 
+def prewarm_tag_cache(runtime, budget_ms):
+    """
+    Fills the tag cache with every broker RDS instance, OpenSearch domain and
+    S3 bucket for the environment, in parallel, during Lambda init. Returns
+    how much of the time budget was used; enumeration still running when the
+    budget runs out is left to finish in the background.
+    """
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=3)
+    futures = [
+        pool.submit(
+            rds_inventory.ensure_fresh,
+            runtime.rds_client,
+            runtime.rds_prefix,
+            tag_cache,
+        ),
+        pool.submit(refresh_domain_inventory, runtime),
+        pool.submit(prewarm_bucket_tags, runtime),
+    ]
+    done, not_done = wait(futures, timeout=budget_ms / 1000)
+    pool.shutdown(wait=False)
+    for future in done:
+        if future.exception() is not None:
+            logger.error(f"Tag cache warm-up step failed: {future.exception()}")
+    elapsed_ms = (time.monotonic() - started) * 1000
+    return {
+        "budget_ms": budget_ms,
+        "elapsed_ms": round(elapsed_ms, 1),
+        "budget_used": round(elapsed_ms / budget_ms, 3) if budget_ms else None,
+        "timed_out": bool(not_done),
+        "cached_entries": len(tag_cache),
+    }
+
+
+def prewarm_bucket_tags(runtime):
+    """
+    Resolves tags for every bucket that matches the environment's S3 prefix.
+    """
+    response = runtime.s3_client.list_buckets()
+    lookups = [
+        partial(get_tags_from_name, bucket["Name"], "S3", runtime.s3_client)
+        for bucket in response.get("Buckets", [])
+        if bucket["Name"].startswith(runtime.s3_prefix)
+        and s3_arn(bucket["Name"]) not in tag_cache
+    ]
+    resolve_concurrently(lookups, TAG_LOOKUP_CONCURRENCY)
+
+
+def load_tag_snapshot(runtime):
+    """
+    Loads the shared tag snapshot at cold start and whenever its ETag changes,
+    then applies the tag change record on top of it.
+    """
+    loaded = 0
+    try:
+        loaded = tag_snapshot_loader.refresh(
+            runtime.s3_client, tag_cache, normalize=filter_tags
+        )
+    except Exception as e:
+        logger.error(f"Could not load tag snapshot: {e}")
+    if tag_change_loader is None:
+        return
+    try:
+        changed = tag_change_loader.refresh(
+            runtime.s3_client, tag_cache, normalize=filter_tags
+        )
+        if loaded and not changed:
+            # The snapshot may predate the recorded changes
+            tag_change_loader.reapply(tag_cache, normalize=filter_tags)
+    except Exception as e:
+        logger.error(f"Could not load tag changes: {e}")
+
+
+def refresh_rds_inventory(runtime):
+    """
+    Refreshes the RDS inventory when it is due and seeds the tag cache with
+    every broker instance's tags and AllocatedStorage.
+    """
+    try:
+        rds_inventory.ensure_fresh(runtime.rds_client, runtime.rds_prefix, tag_cache)
+    except Exception as e:
+        logger.error(f"Could not refresh RDS inventory: {e}")
+
+
+def refresh_domain_inventory(runtime):
+    """
+    Refreshes the OpenSearch domain inventory when it is due and resolves tags
+    for the indexed domains that are not cached yet, through the tagging API
+    first and per-domain list_tags calls for whatever remains.
+    """
+    try:
+        if not domain_inventory.ensure_fresh(runtime.es_client, runtime.domain_prefix):
+            return
+        arns = [domain.arn for _, domain in domain_inventory.items()]
+        if TAG_PREFETCH_ENABLED:
+            try:
+                prefetch_tags(
+                    arns, runtime.tagging_client, tag_cache, normalize=filter_tags
+                )
+            except Exception as e:
+                logger.error(f"Could not prefetch domain tags: {e}")
+        resolve_concurrently(
+            [
+                partial(get_tags_from_arn, arn, runtime.es_client)
+                for arn in arns
+                if arn not in tag_cache
+            ],
+            TAG_LOOKUP_CONCURRENCY,
+        )
+    except Exception as e:
+        logger.error(f"Could not refresh OpenSearch domain inventory: {e}")
+
+
+def prefetch_batch_tags(metrics, runtime):
+    """
+    Resolves tags for every broker resource in the batch that is not cached
+    yet, using the Resource Groups Tagging API instead of one call per resource.
+    """
+    arns = collect_batch_arns(
+        metrics,
+        runtime.region,
+        runtime.account_id,
+        runtime.s3_prefix,
+        runtime.domain_prefix,
+        runtime.rds_prefix,
+    )
+    try:
+        prefetch_tags(arns, runtime.tagging_client, tag_cache, normalize=filter_tags)
+    except Exception as e:
+        logger.error(
+            f"Could not prefetch tags, falling back to per-resource calls: {e}"
+        )
+
+
+def resolve_batch_tags(metrics, runtime):
+    """
+    Fetches the tags still missing for the batch in parallel, so a cold
+    sandbox does not pay for each lookup in turn. The tag cache coalesces
+    concurrent lookups of the same key.
+    """
+    arns = collect_batch_arns(
+        metrics,
+        runtime.region,
+        runtime.account_id,
+        runtime.s3_prefix,
+        runtime.domain_prefix,
+        runtime.rds_prefix,
+    )
+    lookups = {}
+    for arn in arns:
+        if arn in lookups or arn in tag_cache:
+            continue
+        client = runtime.client(resolver_registry.for_arn(arn).service)
+        lookups[arn] = partial(get_tags_from_arn, arn, client)
+    resolve_concurrently(lookups.values(), TAG_LOOKUP_CONCURRENCY)
+
+    # Storage sizes are only needed for tenant databases reporting free space
+    sizes = {}
+    for metric in metrics:
+        if (
+            metric.get("namespace") != "AWS/RDS"
+            or metric.get("metric_name") != "FreeStorageSpace"
+        ):
+            continue
+        db_name = (metric.get("dimensions") or {}).get("DBInstanceIdentifier")
+        if not db_name or not db_name.startswith(runtime.rds_prefix):
+            continue
+        arn = f"arn:aws-us-gov:rds:{runtime.region}:{runtime.account_id}:db:{db_name}"
+        key = ("AllocatedStorage", db_name)
+        if key in sizes or key in tag_cache or not tag_cache.peek(arn):
+            continue
+        sizes[key] = partial(get_rds_description, runtime.rds_client, db_name)
+    resolve_concurrently(sizes.values(), TAG_LOOKUP_CONCURRENCY)
+
+
+def collect_batch_arns(
+    metrics, region, account_id, s3_prefix, domain_prefix, rds_prefix
+):
+    """
+    Returns the ARNs of the broker resources referenced by the metrics.
+    """
+    prefixes = broker_prefixes(rds_prefix, s3_prefix, domain_prefix)
+    arns = []
+    for metric in metrics:
+        resolver = resolver_registry.get(metric.get("namespace"))
+        if resolver is None:
+            continue
+        name = resolver.resource_name(metric.get("dimensions") or {})
+        if name and resolver.is_broker(name, prefixes):
+            arns.append(resolver.arn(name, region, account_id))
+    return arns
+
+
+def broker_prefixes(rds_prefix, s3_prefix, domain_prefix):
+    return {"rds": rds_prefix, "s3": s3_prefix, "domain": domain_prefix}
+
+
 def process_metric(
     metric,
     region,
@@ -110,13 +476,16 @@ def process_metric(
     rds_client,
     rds_prefix,
     account_id,
+    runtime=None,
 ):
     try:
         namespace = metric.get("namespace")
-        if namespace not in EXPECTED_NAMESPACES:
-            logger.error(
-                f"Hello developer, you need to add the following metric to the lambda function: {str(namespace)}"
-            )
+        if namespace not in resolver_registry:
+            if namespace not in _unknown_namespaces:
+                _unknown_namespaces.add(namespace)
+                logger.error(
+                    f"Hello developer, you need to add the following metric to the lambda function: {str(namespace)}"
+                )
             return None
 
         tags = get_resource_tags_from_metric(
@@ -129,6 +498,7 @@ def process_metric(
             rds_client,
             rds_prefix,
             account_id,
+            runtime,
         )
         if len(tags.keys()) > 0:
             metric["Tags"] = tags
@@ -150,74 +520,125 @@ def get_resource_tags_from_metric(
     rds_client,
     rds_prefix,
     account_id,
+    runtime=None,
 ) -> dict:
     tags = {}
     try:
-        namespace = metric.get("namespace")
-        dimensions = metric.get("dimensions", {})
-        if namespace == "AWS/S3":
-            bucket_name = dimensions.get("BucketName")
-            if bucket_name.startswith(s3_prefix):
-                tags = get_tags_from_name(bucket_name, "S3", s3_client)
-        elif namespace == "AWS/ES":
-            domain_name = dimensions.get("DomainName")
-            if domain_name.startswith(domain_prefix):
-                arn = f"arn:aws-us-gov:es:{region}:{account_id}:domain/{domain_name}"
-                tags = get_tags_from_arn(arn, es_client)
-        elif namespace == "AWS/RDS":
-            db_name = dimensions.get("DBInstanceIdentifier")
-            if db_name is not None and db_name.startswith(rds_prefix):
-                arn = f"arn:aws-us-gov:rds:{region}:{account_id}:db:{db_name}"
-                # copy avoids mutating the cached value returned by get_tags_from_arn
-                result_tags = get_tags_from_arn(arn, rds_client).copy()
-                if result_tags and metric.get("metric_name") == "FreeStorageSpace":
-                    size = get_rds_description(rds_client, db_name)
-                    # assign the reference between assigning db_size
-                    tags = result_tags
-                    tags.update({"db_size": size})
-                else:
-                    tags = result_tags
+        resolver = resolver_registry.get(metric.get("namespace"))
+        if resolver is None:
+            return tags
+        name = resolver.resource_name(metric.get("dimensions", {}))
+        prefixes = broker_prefixes(rds_prefix, s3_prefix, domain_prefix)
+        if not name or not resolver.is_broker(name, prefixes):
+            return tags
+        clients = {"s3": s3_client, "es": es_client, "rds": rds_client}
+        client = clients.get(resolver.service) or (runtime or get_runtime()).client(
+            resolver.service
+        )
+        tags = get_tags_from_arn(resolver.arn(name, region, account_id), client)
+        enrich = FREE_STORAGE_ENRICHERS.get(resolver.namespace)
+        if tags and enrich and metric.get("metric_name") == "FreeStorageSpace":
+            # copy avoids mutating the cached value
+            tags = enrich(tags.copy(), name, client)
     except Exception as e:
         logger.error(f"Error with getting tags for resource: {e}")
     return tags
 
 
-@lru_cache(maxsize=256)
+def add_domain_sizing(tags, domain_name, es_client):
+    # Only an enabled inventory is kept fresh; a warm-up may fill it anyway
+    if not DOMAIN_INVENTORY_ENABLED:
+        return tags
+    domain = domain_inventory.get(domain_name)
+    if domain is not None:
+        tags.update(
+            {
+                "domain_instance_count": domain.instance_count,
+                "domain_volume_size": domain.volume_size,
+            }
+        )
+    return tags
+
+
+def add_db_size(tags, db_name, rds_client):
+    tags.update({"db_size": get_rds_description(rds_client, db_name)})
+    return tags
+
+
+# Extra fields added to FreeStorageSpace metrics, by namespace.
+FREE_STORAGE_ENRICHERS = {"AWS/ES": add_domain_sizing, "AWS/RDS": add_db_size}
+
+
 def get_rds_description(rds_client, db_name):
     try:
-        size = rds_client.describe_db_instances(DBInstanceIdentifier=db_name)
-        return size["DBInstances"][0]["AllocatedStorage"]
+        return tag_cache.get(
+            ("AllocatedStorage", db_name),
+            lambda: fetch_rds_allocated_storage(rds_client, db_name),
+        )
     except Exception as e:
         logger.error(f"Error with getting rds_description: {e}")
 
 
-@lru_cache(maxsize=256)
+def fetch_rds_allocated_storage(rds_client, db_name):
+    try:
+        size = rds_client.describe_db_instances(DBInstanceIdentifier=db_name)
+    except ClientError as e:
+        reason = negative_reason(e)
+        if reason is None:
+            raise
+        raise NegativeLookup(reason, value=None) from e
+    return size["DBInstances"][0]["AllocatedStorage"]
+
+
 def get_tags_from_name(name, type, client) -> dict:
     tags = {}
     if type == "S3":
-        try:
-            response = client.get_bucket_tagging(Bucket=name)
-            tags = {tag["Key"]: tag["Value"] for tag in response.get("TagSet", [])}
-        except client.exceptions.NoSuchTagSet as e:
-            logger.error(f"Could not fetch tags: {e}")
+        tags = get_tags_from_arn(s3_arn(name), client)
     return tags
 
 
-@lru_cache(maxsize=256)
 def get_tags_from_arn(arn, client) -> dict:
     tags = {}
-    if ":domain/" in arn:
-        try:
-            response = client.list_tags(ARN=arn)
-            tags = {tag["Key"]: tag["Value"] for tag in response.get("TagList", [])}
-        except Exception as e:
-            logger.error(f"Could not fetch tags: {e}")
-    if ":db:" in arn:
-        try:
-            response = client.list_tags_for_resource(ResourceName=arn)
-            tags = {tag["Key"]: tag["Value"] for tag in response.get("TagList", [])}
-            if "Organization GUID" not in tags:
-                return {}
-        except Exception as e:
-            logger.error(f"Could not fetch tags: {e}")
+    try:
+        tags = tag_cache.get(arn, lambda: fetch_tags_from_arn(arn, client))
+    except Exception as e:
+        logger.error(f"Could not fetch tags: {e}")
     return tags
+
+
+def fetch_tags_from_arn(arn, client) -> dict:
+    tags = {}
+    try:
+        resolver = resolver_registry.for_arn(arn)
+        if resolver is not None:
+            tags = resolver.fetch_tags(client, arn)
+    except ClientError as e:
+        reason = negative_reason(e)
+        if reason is None:
+            raise
+        raise NegativeLookup(reason) from e
+    return filter_tags(arn, tags)
+
+
+def filter_tags(arn, tags) -> dict:
+    """
+    Applies the per-service rules to tags however they were fetched. Raises
+    NegativeLookup when the resource is untagged or not a tenant database.
+    """
+    if not tags:
+        raise NegativeLookup(NO_TAGS)
+    if ":db:" in arn and "Organization GUID" not in tags:
+        raise NegativeLookup(NO_ORG_GUID)
+    return tags
+
+
+def s3_arn(bucket_name):
+    return f"{S3_ARN_PREFIX}{bucket_name}"
+
+
+if TAG_CACHE_PREWARM:
+    try:
+        prewarm_stats = prewarm_tag_cache(get_runtime(), TAG_CACHE_PREWARM_BUDGET_MS)
+        logger.info(f"Tag cache warm-up: {prewarm_stats}")
+    except Exception as e:
+        logger.error(f"Tag cache warm-up failed: {e}")
@@ -0,0 +1,37 @@
+import pytest
+
+from lambda_functions import transform_cloudwatch_lambda, transform_lambda
+from lambda_functions.inventory import DomainInventory, RdsInventory
+
+
+@pytest.fixture(autouse=True)
+def reset_module_state(monkeypatch):
+    """Each test builds its own runtime context and starts with empty caches."""
+    transform_lambda.reset_runtime()
+    transform_lambda.tag_cache.clear()
+    transform_cloudwatch_lambda.tag_cache.clear()
+    monkeypatch.setattr(transform_lambda, "rds_inventory", RdsInventory())
+    monkeypatch.setattr(transform_lambda, "domain_inventory", DomainInventory())
+    monkeypatch.setattr(transform_cloudwatch_lambda, "rds_inventory", RdsInventory())
+    monkeypatch.setattr(transform_lambda, "tag_snapshot_loader", None)
+    monkeypatch.setattr(transform_cloudwatch_lambda, "tag_snapshot_loader", None)
+    monkeypatch.setattr(transform_lambda, "tag_change_loader", None)
+    monkeypatch.setattr(transform_cloudwatch_lambda, "tag_change_loader", None)
+    yield
+    transform_lambda.reset_runtime()
+    transform_lambda.tag_cache.clear()
+    transform_cloudwatch_lambda.tag_cache.clear()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """A clock for TTLs and refresh intervals; tests advance it via clock.now."""
+    return FakeClock()
@@ -0,0 +1,410 @@
+import json
+import base64
+import gzip
+import tracemalloc
+import zlib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from lambda_functions import codec as codec_module
+from lambda_functions import transform_lambda
+from lambda_functions.codec import (
+    CompactLogEventTemplate,
+    LogEventTemplate,
+    OrjsonCodec,
+    StdlibCodec,
+    get_codec,
+    iter_gzip_lines,
+    iter_lines,
+    write_document,
+)
+from lambda_functions.tag_cache import EncodedTags
+
+requires_orjson = pytest.mark.skipif(
+    codec_module.orjson is None, reason="orjson is not installed"
+)
+
+DOCUMENTS = [
+    {
+        "metric_stream_name": "metric-stream",
+        "namespace": "AWS/RDS",
+        "metric_name": "FreeStorageSpace",
+        "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-proddb"},
+        "timestamp": 1640995200000,
+        "value": {"max": 12.5, "min": 0.0, "sum": -3.25, "count": 5.0},
+        "unit": "Bytes",
+        "Tags": {"Organization GUID": "org", "db_size": None},
+    },
+    {
+        "logGroup": "/aws/rds/instance/cg-aws-broker-proddb/postgresql",
+        "logStream": "stream",
+        "message": "LOG:  statement: SELECT \"é\", '\\n' -- ünïcödé ✓ 🚀\ttab",
+        "timestamp": 1640995200123,
+        "Tags": {"Organization GUID": "org", "Testing": "enabled"},
+    },
+    {"empty": {}, "list": [], "nested": [[1, 2], {"a": [True, False, None]}]},
+    {"control": "\x00\x1f\u2028\u2029", "slash": "</script>", "quote": '"'},
+    {"float": 0.1, "negative_zero": -0.0, "large": 123456789.123, "int": -(2**62)},
+]
+
+
+def codecs():
+    params = [pytest.param(StdlibCodec(), id="json")]
+    params.append(pytest.param(OrjsonCodec(), id="orjson", marks=requires_orjson))
+    return params
+
+
+class TestCodecParity:
+
+    @pytest.mark.parametrize("codec", codecs())
+    @pytest.mark.parametrize("document", DOCUMENTS)
+    def test_round_trip(self, codec, document):
+        encoded = codec.dumps(document)
+
+        assert isinstance(encoded, bytes)
+        assert codec.loads(encoded) == document
+        assert json.loads(encoded) == document
+
+    @requires_orjson
+    @pytest.mark.parametrize("document", DOCUMENTS)
+    def test_backends_write_identical_bytes(self, document):
+        assert StdlibCodec().dumps(document) == OrjsonCodec().dumps(document)
+
+    @requires_orjson
+    @pytest.mark.parametrize("document", DOCUMENTS)
+    def test_backends_read_identical_documents(self, document):
+        raw = json.dumps(document).encode("utf-8")
+
+        assert StdlibCodec().loads(raw) == OrjsonCodec().loads(raw) == document
+
+    @requires_orjson
+    def test_exponent_floats_decode_identically(self):
+        """Exponent spelling differs, the values do not"""
+        document = {"values": [1e16, 1.5e-7, 1e300, 5e-324]}
+
+        stdlib, fast = StdlibCodec().dumps(document), OrjsonCodec().dumps(document)
+
+        assert json.loads(stdlib) == json.loads(fast) == document
+
+    @requires_orjson
+    def test_orjson_falls_back_for_large_integers(self):
+        document = {"value": 2**70}
+
+        assert OrjsonCodec().dumps(document) == StdlibCodec().dumps(document)
+
+    @requires_orjson
+    def test_large_integers_decode_as_floats_in_orjson(self):
+        raw = b'{"value":123456789012345678901234567890}'
+
+        assert StdlibCodec().loads(raw) == {"value": 123456789012345678901234567890}
+        assert OrjsonCodec().loads(raw) == {"value": 1.2345678901234568e29}
+
+    @pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+    def test_stdlib_refuses_non_finite_floats(self, value):
+        with pytest.raises(ValueError):
+            StdlibCodec().dumps({"a": value})
+
+    @requires_orjson
+    def test_orjson_writes_non_finite_floats_as_null(self):
+        document = {"a": float("nan"), "b": float("inf")}
+
+        assert OrjsonCodec().dumps(document) == b'{"a":null,"b":null}'
+
+    @pytest.mark.parametrize("codec", codecs())
+    def test_decode_errors_are_json_decode_errors(self, codec):
+        with pytest.raises(json.JSONDecodeError):
+            codec.loads(b'{"namespace": ')
+
+
+class TestGetCodec:
+
+    @requires_orjson
+    def test_auto_prefers_orjson(self):
+        assert get_codec().name == "orjson"
+
+    def test_auto_falls_back_to_stdlib(self, monkeypatch):
+        monkeypatch.setattr(codec_module, "orjson", None)
+
+        assert get_codec().name == "json"
+
+    def test_explicit_choices(self, monkeypatch):
+        assert get_codec("json").name == "json"
+        with pytest.raises(ValueError):
+            get_codec("simdjson")
+        monkeypatch.setattr(codec_module, "orjson", None)
+        with pytest.raises(ValueError):
+            get_codec("orjson")
+
+
+class TestTransformCodecParity:
+
+    @requires_orjson
+    def test_metric_transform_output_is_codec_independent(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        metric = dict(DOCUMENTS[0])
+        del metric["Tags"]
+        data = base64.b64encode(json.dumps(metric).encode("utf-8") + b"\n")
+        event = {"records": [{"recordId": "codec", "data": data.decode("ascii")}]}
+
+        outputs = []
+        for codec in (StdlibCodec(), OrjsonCodec()):
+            monkeypatch.setattr(transform_lambda, "codec", codec)
+            with patch("lambda_functions.transform_lambda.logger"), patch(
+                "lambda_functions.transform_lambda.get_resource_tags_from_metric",
+                return_value={"Organization GUID": "org ✓"},
+            ):
+                outputs.append(transform_lambda.lambda_handler(event, MagicMock()))
+
+        assert outputs[0] == outputs[1]
+
+
+class TestIterLines:
+
+    @pytest.mark.parametrize(
+        "data,lines",
+        [
+            (b'{"a":1}\n{"b":2}\n', [b'{"a":1}', b'{"b":2}']),
+            (b'{"a":1}\r\n\r\n{"b":2}', [b'{"a":1}', b'{"b":2}']),
+            (b'{"a":1}\n  \t\n', [b'{"a":1}']),
+            (b"\n\n", []),
+            (b"", []),
+        ],
+    )
+    def test_lines_match_strip_splitlines(self, data, lines):
+        views = list(iter_lines(data))
+
+        assert all(isinstance(view, memoryview) for view in views)
+        assert [view.tobytes() for view in views] == lines
+
+    @pytest.mark.parametrize("codec", codecs())
+    def test_codecs_decode_memoryview_lines(self, codec):
+        lines = iter_lines(b'{"namespace":"AWS/S3"}\n[1,2]\n')
+
+        assert [codec.loads(line) for line in lines] == [
+            {"namespace": "AWS/S3"},
+            [1, 2],
+        ]
+
+
+class TestIterGzipLines:
+
+    NDJSON = b"".join(b'{"id":%d,"message":"%s"}\n' % (i, b"x" * i) for i in range(200))
+
+    def lines(self, data, **kwargs):
+        return [bytes(line) for line in iter_gzip_lines(data, **kwargs)]
+
+    @pytest.mark.parametrize("chunk_bytes", [1, 7, 64 * 1024])
+    def test_lines_match_gzip_decompress(self, chunk_bytes):
+        data = gzip.compress(self.NDJSON + b"\r\n  \n")
+
+        assert self.lines(data, chunk_bytes=chunk_bytes) == [
+            bytes(line) for line in iter_lines(gzip.decompress(data))
+        ]
+
+    def test_payload_is_not_held_decompressed(self):
+        payload = self.NDJSON * 100
+        data = gzip.compress(payload)
+
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in iter_gzip_lines(data))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert count == 20000
+        assert peak < len(payload) // 4
+
+    def test_concatenated_members_and_padding(self):
+        data = (
+            gzip.compress(b'{"a":1}\n{"b"')
+            + b"\x00" * 8
+            + gzip.compress(b":2}\n")
+            + gzip.compress(b'{"c":3}')
+        )
+
+        assert self.lines(data) == [b'{"a":1}', b'{"b":2}', b'{"c":3}']
+
+    @pytest.mark.parametrize("chunk_bytes", [7, 64 * 1024])
+    def test_members_larger_than_a_chunk_are_decoded_once(self, chunk_bytes):
+        first = self.NDJSON * 50
+        data = gzip.compress(first) + gzip.compress(b'{"second":1}\n')
+
+        lines = self.lines(data, chunk_bytes=chunk_bytes)
+
+        assert len(first) > chunk_bytes
+        assert len(lines) == 10001
+        assert lines[-2:] == [
+            b'{"id":199,"message":"%s"}' % (b"x" * 199),
+            b'{"second":1}',
+        ]
+
+    def test_empty_data(self):
+        assert self.lines(b"") == []
+        assert self.lines(gzip.compress(b"")) == []
+
+    def test_size_limit(self):
+        data = gzip.compress(self.NDJSON)
+
+        assert len(self.lines(data, max_bytes=len(self.NDJSON))) == 200
+        with pytest.raises(ValueError, match="exceeds the limit"):
+            self.lines(data, max_bytes=len(self.NDJSON) - 1)
+
+    def test_size_limit_stops_a_bomb_early(self):
+        bomb = gzip.compress(b"\n" * (64 * 2**20))
+        lines = iter_gzip_lines(bomb, max_bytes=2**20, chunk_bytes=4096)
+
+        with pytest.raises(ValueError):
+            list(lines)
+
+    @pytest.mark.parametrize("cut", [1, 10, -1])
+    def test_truncated_data(self, cut):
+        data = gzip.compress(self.NDJSON)
+
+        with pytest.raises((EOFError, zlib.error)):
+            self.lines(data[:cut])
+
+    def test_corrupt_data(self):
+        with pytest.raises(zlib.error):
+            self.lines(b"not gzip")
+
+
+class TestWriteDocument:
+
+    @pytest.mark.parametrize("splice_tags", [True, False])
+    @pytest.mark.parametrize("codec", codecs())
+    @pytest.mark.parametrize("document", DOCUMENTS)
+    def test_spliced_tags_match_plain_encoding(
+        self, monkeypatch, codec, document, splice_tags
+    ):
+        monkeypatch.setattr(codec, "splice_tags", splice_tags)
+        document = dict(document)
+        tags = EncodedTags({"Organization GUID": "org ✓", "Space": "s"})
+        document.pop("Tags", None)
+        document["Tags"] = tags
+        out = bytearray()
+
+        write_document(out, codec, document)
+
+        assert bytes(out) == codec.dumps(document)
+        assert document["Tags"] is tags
+
+    def test_tags_are_encoded_once(self):
+        codec = StdlibCodec()
+        tags = EncodedTags({"Organization GUID": "org"})
+        out = bytearray()
+
+        with patch.object(codec, "dumps", wraps=codec.dumps) as dumps:
+            for i in range(3):
+                write_document(out, codec, {"value": i, "Tags": tags})
+
+        # one dumps per document body plus one for the tags
+        assert dumps.call_count == 3 + 1
+        assert out == b"".join(
+            json.dumps({"value": i, "Tags": tags}, separators=(",", ":")).encode()
+            for i in range(3)
+        )
+
+    def test_tags_are_encoded_per_codec(self):
+        class SpacedCodec(StdlibCodec):
+            name = "spaced"
+
+            def dumps(self, obj):
+                return json.dumps(obj).encode("utf-8")
+
+        tags = EncodedTags({"Organization GUID": "org", "Testing": "x"})
+
+        assert tags.encoded(StdlibCodec()) == StdlibCodec().dumps(tags)
+        assert tags.encoded(SpacedCodec()) == SpacedCodec().dumps(tags)
+        assert tags.encoded(StdlibCodec()) == StdlibCodec().dumps(tags)
+
+    @pytest.mark.parametrize("codec", codecs())
+    def test_fallbacks(self, monkeypatch, codec):
+        monkeypatch.setattr(codec, "splice_tags", True)
+        tags = EncodedTags({"a": "b"})
+        cases = [
+            {"Tags": tags},
+            {"Tags": tags, "after": 1},
+            {"Tags": {"plain": "dict"}},
+            {"value": 1},
+        ]
+        for document in cases:
+            out = bytearray()
+            write_document(out, codec, document)
+            assert bytes(out) == codec.dumps(document)
+
+
+class TestLogEventTemplate:
+
+    EVENTS = [
+        {"id": "1", "timestamp": 1640995200123, "message": DOCUMENTS[1]["message"]},
+        {"timestamp": 1640995200124, "message": 'quote " backslash \\ \x00 \u2028'},
+        {"timestamp": 1640995200.5, "message": ""},
+        {"timestamp": 2**70, "message": "large"},
+    ]
+
+    @pytest.mark.parametrize("codec", codecs())
+    @pytest.mark.parametrize(
+        "tags",
+        [EncodedTags({"Organization GUID": "org ✓"}), {"Organization GUID": "org"}],
+    )
+    def test_lines_match_encoded_events(self, codec, tags):
+        log_group = "/aws/rds/instance/cg-aws-broker-proddb/postgresql"
+        template = LogEventTemplate(codec, log_group, 'stream "0"', tags)
+        out = bytearray()
+
+        for event in self.EVENTS:
+            template.write(out, event)
+
+        assert bytes(out) == b"".join(
+            codec.dumps(
+                {
+                    "logGroup": log_group,
+                    "logStream": 'stream "0"',
+                    "message": event["message"],
+                    "timestamp": event["timestamp"],
+                    "Tags": tags,
+                }
+            )
+            + b"\n"
+            for event in self.EVENTS
+        )
+
+    def test_group_fields_are_encoded_once(self):
+        codec = StdlibCodec()
+        tags = EncodedTags({"Organization GUID": "org"})
+
+        with patch.object(codec, "dumps", wraps=codec.dumps) as dumps:
+            template = LogEventTemplate(codec, "group", "stream", tags)
+            for i in range(5):
+                template.write(bytearray(), {"timestamp": i, "message": "m"})
+
+        # group, stream and tags, then only the message per event
+        assert dumps.call_count == 3 + 5
+
+
+class TestCompactLogEventTemplate:
+
+    @pytest.mark.parametrize("codec", codecs())
+    def test_header_then_rows(self, codec):
+        tags = EncodedTags({"Organization GUID": "org ✓"})
+        template = CompactLogEventTemplate(codec, "group", "stream", tags)
+        out = bytearray()
+
+        template.begin(out)
+        for event in TestLogEventTemplate.EVENTS:
+            template.write(out, event)
+
+        header, *rows = bytes(out).splitlines()
+        assert json.loads(header) == {
+            "logGroup": "group",
+            "logStream": "stream",
+            "Tags": tags,
+        }
+        assert [json.loads(row) for row in rows] == [
+            [event["timestamp"], event["message"]]
+            for event in TestLogEventTemplate.EVENTS
+        ]
@@ -0,0 +1,73 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from lambda_functions.codec import (
+    CompactLogEventTemplate,
+    LogEventTemplate,
+    get_codec,
+    iter_lines,
+)
+from lambda_functions.compact_logs import expand, expand_object, main
+
+GROUPS = [
+    (
+        "/aws/rds/instance/cg-aws-broker-prodone/postgresql",
+        "cg-aws-broker-prodone.0",
+        {"Organization GUID": "org-a", "Space GUID": "space-a"},
+        [
+            {"id": "1", "timestamp": 1640995200000, "message": "LOG:  checkpoint"},
+            {"id": "2", "timestamp": 1640995200001, "message": 'ERROR:  "é"\n'},
+        ],
+    ),
+    (
+        "/aws/rds/instance/cg-aws-broker-prodtwo/postgresql",
+        "cg-aws-broker-prodtwo.0",
+        {"Organization GUID": "org-b"},
+        [{"id": "3", "timestamp": 1640995200002, "message": "LOG:  vacuum"}],
+    ),
+]
+
+
+def write(template_class):
+    codec = get_codec()
+    out = bytearray()
+    for log_group, log_stream, tags, events in GROUPS:
+        template = template_class(codec, log_group, log_stream, tags)
+        template.begin(out)
+        for event in events:
+            template.write(out, event)
+    return bytes(out)
+
+
+class TestExpand:
+
+    def test_compact_expands_to_the_full_form(self):
+        full = [json.loads(line) for line in write(LogEventTemplate).splitlines()]
+
+        assert list(expand(iter_lines(write(CompactLogEventTemplate)))) == full
+
+    def test_full_form_passes_through(self):
+        full = write(LogEventTemplate)
+
+        assert list(expand(iter_lines(full))) == [
+            json.loads(line) for line in full.splitlines()
+        ]
+
+    def test_row_without_header_is_rejected(self):
+        with pytest.raises(ValueError):
+            list(expand([b'[1640995200000,"orphan"]']))
+
+    def test_expand_object_and_main(self, tmp_path):
+        body = gzip.compress(write(CompactLogEventTemplate))
+        path = tmp_path / "batch.json.gz"
+        path.write_bytes(body)
+        out = io.BytesIO()
+
+        main([str(path)], out=out)
+
+        expected = list(expand_object(body))
+        assert len(expected) == 3
+        assert [json.loads(line) for line in out.getvalue().splitlines()] == expected
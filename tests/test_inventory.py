@@ -0,0 +1,124 @@
+from unittest.mock import MagicMock
+
+import boto3
+from moto import mock_aws
+
+from lambda_functions.inventory import DomainInventory, RdsInventory
+from lambda_functions.tag_cache import TagCache
+
+dummy_region = "us-gov-west-1"
+
+
+def create_db(rds, name, tags, allocated_storage=20):
+    rds.create_db_instance(
+        DBInstanceIdentifier=name,
+        DBInstanceClass="db.t3.micro",
+        Engine="postgres",
+        AllocatedStorage=allocated_storage,
+        MasterUsername="admin",
+        MasterUserPassword="password123",
+        Tags=tags,
+    )
+
+
+class TestRdsInventory:
+
+    @mock_aws
+    def test_refresh_indexes_broker_instances(self):
+        """Only instances matching the prefix are indexed, with tags and size"""
+        rds = boto3.client("rds", region_name=dummy_region)
+        create_db(
+            rds,
+            "cg-aws-broker-prodtenant",
+            [{"Key": "Organization GUID", "Value": "org-1"}],
+            allocated_storage=50,
+        )
+        create_db(rds, "cg-aws-broker-prodplatform", [{"Key": "Owner", "Value": "cg"}])
+        create_db(rds, "someone-else", [{"Key": "Organization GUID", "Value": "x"}])
+
+        inventory = RdsInventory()
+        inventory.refresh(rds, "cg-aws-broker-prod")
+
+        assert len(inventory) == 2
+        tenant = inventory.get("cg-aws-broker-prodtenant")
+        assert tenant.tags == {"Organization GUID": "org-1"}
+        assert tenant.allocated_storage == 50
+        assert inventory.get("someone-else") is None
+
+    @mock_aws
+    def test_seed_applies_organization_rule(self):
+        """Seeded entries match what per-instance lookups would cache"""
+        rds = boto3.client("rds", region_name=dummy_region)
+        create_db(
+            rds,
+            "cg-aws-broker-prodtenant",
+            [{"Key": "Organization GUID", "Value": "org-1"}],
+        )
+        create_db(rds, "cg-aws-broker-prodplatform", [{"Key": "Owner", "Value": "cg"}])
+        cache = TagCache(ttl=60)
+
+        inventory = RdsInventory()
+        inventory.ensure_fresh(rds, "cg-aws-broker-prod", cache)
+
+        tenant_arn = inventory.get("cg-aws-broker-prodtenant").arn
+        platform_arn = inventory.get("cg-aws-broker-prodplatform").arn
+        assert cache.peek(tenant_arn) == {"Organization GUID": "org-1"}
+        assert cache.peek(platform_arn) == {}
+        assert cache.stats()["negative_stored"]["no_org_guid"] == 1
+        assert cache.peek(("AllocatedStorage", "cg-aws-broker-prodtenant")) == 20
+
+    def test_refresh_once_per_interval(self, clock):
+        """The inventory is only rebuilt once the refresh interval has passed"""
+        client = MagicMock()
+        client.get_paginator.return_value.paginate.return_value = [{"DBInstances": []}]
+        inventory = RdsInventory(refresh_interval=300, clock=clock)
+
+        assert inventory.ensure_fresh(client, "cg-aws-broker-prod") is True
+        assert inventory.ensure_fresh(client, "cg-aws-broker-prod") is False
+        clock.now += 300
+        assert inventory.ensure_fresh(client, "cg-aws-broker-prod") is True
+        assert inventory.refreshes == 2
+
+
+class TestDomainInventory:
+
+    @mock_aws
+    def test_refresh_indexes_broker_domains(self):
+        """Broker domains are indexed with their sizing fields"""
+        es = boto3.client("es", region_name=dummy_region)
+        es.create_elasticsearch_domain(
+            DomainName="cg-broker-prd-sized",
+            ElasticsearchClusterConfig={
+                "InstanceType": "m5.large.elasticsearch",
+                "InstanceCount": 3,
+            },
+            EBSOptions={"EBSEnabled": True, "VolumeSize": 50, "VolumeType": "gp2"},
+        )
+        es.create_elasticsearch_domain(DomainName="not-a-broker-domain")
+
+        inventory = DomainInventory()
+        assert inventory.ensure_fresh(es, "cg-broker-prd-") is True
+
+        assert len(inventory) == 1
+        domain = inventory.get("cg-broker-prd-sized")
+        assert domain.instance_count == 3
+        assert domain.volume_size == 50
+        assert domain.arn.endswith(":domain/cg-broker-prd-sized")
+
+    def test_describe_in_batches_of_five(self):
+        """Domains are described five at a time after one list call"""
+        client = MagicMock()
+        client.list_domain_names.return_value = {
+            "DomainNames": [{"DomainName": f"cg-broker-prd-{i}"} for i in range(12)]
+            + [{"DomainName": "other"}]
+        }
+        client.describe_elasticsearch_domains.return_value = {"DomainStatusList": []}
+
+        DomainInventory().refresh(client, "cg-broker-prd-")
+
+        assert client.list_domain_names.call_count == 1
+        batches = [
+            call.kwargs["DomainNames"]
+            for call in client.describe_elasticsearch_domains.call_args_list
+        ]
+        assert [len(batch) for batch in batches] == [5, 5, 2]
@@ -0,0 +1,433 @@
+import gzip
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from lambda_functions.log_output import (
+    MIN_PART_BYTES,
+    BatchKeys,
+    BatchOutput,
+    GzipObjectWriter,
+    PipelinedOutput,
+    TenantOutput,
+    output_options_from_env,
+)
+
+REGION = "us-gov-west-1"
+BUCKET = "log-bucket"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name=REGION)
+        client.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION}
+        )
+        yield client
+
+
+def key_for(sequence):
+    return f"batch-{sequence}.json.gz"
+
+
+def read_object(s3, key):
+    response = s3.get_object(Bucket=BUCKET, Key=key)
+    assert response["ContentEncoding"] == "gzip"
+    return gzip.decompress(response["Body"].read())
+
+
+def lines(count, width=200):
+    # Random-looking payloads so the compressed size grows with the input
+    return [os.urandom(width // 2).hex().encode() + b"\n" for _ in range(count)]
+
+
+class TestGzipObjectWriter:
+
+    def test_without_limit_writes_one_object(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for)
+        data = lines(500)
+        for line in data:
+            writer.write(line)
+
+        assert writer.close() == ["batch-0.json.gz"]
+        assert read_object(s3, "batch-0.json.gz") == b"".join(data)
+
+    def test_rolls_over_at_compressed_size(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for, max_bytes=16 * 1024)
+        data = lines(1000)
+        for line in data:
+            writer.write(line)
+
+        keys = writer.close()
+
+        assert len(keys) > 1
+        assert keys == [key_for(i) for i in range(len(keys))]
+        assert b"".join(read_object(s3, key) for key in keys) == b"".join(data)
+
+    def test_rolls_over_at_uncompressed_size(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for, max_uncompressed_bytes=1000)
+        data = [b"x" * 99 + b"\n"] * 25
+
+        for line in data:
+            writer.write(line)
+        keys = writer.close()
+
+        assert keys == [key_for(i) for i in range(3)]
+        assert [len(read_object(s3, key)) for key in keys] == [1000, 1000, 500]
+
+    def test_large_objects_use_multipart_upload(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for, part_bytes=MIN_PART_BYTES)
+        # Incompressible, so the object spans three parts
+        data = [os.urandom(1024 * 1024) for _ in range(12)]
+
+        for chunk in data:
+            writer.write(chunk)
+        assert writer._upload_id is not None
+        keys = writer.close()
+
+        assert keys == ["batch-0.json.gz"]
+        assert read_object(s3, "batch-0.json.gz") == b"".join(data)
+        # Multipart ETags end with the part count
+        etag = s3.head_object(Bucket=BUCKET, Key="batch-0.json.gz")["ETag"]
+        assert etag.strip('"').endswith("-3")
+        assert "Uploads" not in s3.list_multipart_uploads(Bucket=BUCKET)
+
+    def test_small_objects_skip_multipart_upload(self):
+        client = MagicMock()
+        writer = GzipObjectWriter(client, BUCKET, key_for, part_bytes=MIN_PART_BYTES)
+        writer.write(b"small\n")
+        writer.close()
+
+        client.put_object.assert_called_once()
+        client.create_multipart_upload.assert_not_called()
+
+    def test_failed_part_aborts_the_upload(self):
+        client = MagicMock()
+        client.create_multipart_upload.return_value = {"UploadId": "upload"}
+        client.upload_part.side_effect = ClientError(
+            {"Error": {"Code": "InternalError"}}, "UploadPart"
+        )
+        writer = GzipObjectWriter(client, BUCKET, key_for, part_bytes=MIN_PART_BYTES)
+
+        with pytest.raises(ClientError):
+            writer.write(os.urandom(MIN_PART_BYTES + 1024 * 1024))
+
+        client.abort_multipart_upload.assert_called_once_with(
+            Bucket=BUCKET, Key="batch-0.json.gz", UploadId="upload"
+        )
+        assert writer.close() == []
+
+    def test_rejects_parts_below_the_s3_minimum(self, s3):
+        with pytest.raises(ValueError):
+            GzipObjectWriter(s3, BUCKET, key_for, part_bytes=1024)
+
+    def test_if_none_match_refuses_to_overwrite(self, s3):
+        for _ in range(2):
+            writer = GzipObjectWriter(s3, BUCKET, key_for, if_none_match=True)
+            writer.write(b"first\n")
+            try:
+                writer.close()
+            except ClientError as e:
+                assert e.response["Error"]["Code"] == "PreconditionFailed"
+                break
+        else:
+            pytest.fail("the second write overwrote the object")
+
+        assert read_object(s3, "batch-0.json.gz") == b"first\n"
+
+    def test_uploads_overlap_compression_of_the_next_object(self, s3):
+        uploader = ThreadPoolExecutor(max_workers=2)
+        writer = GzipObjectWriter(
+            s3, BUCKET, key_for, max_uncompressed_bytes=100, uploader=uploader
+        )
+        data = [b"x" * 99 + b"\n"] * 10
+
+        for line in data:
+            writer.write(line)
+        keys = writer.close()
+
+        assert keys == [key_for(i) for i in range(10)]
+        assert b"".join(read_object(s3, key) for key in keys) == b"".join(data)
+
+    def test_in_flight_uploads_are_bounded(self):
+        release = threading.Event()
+        client = MagicMock()
+        client.put_object.side_effect = lambda **kwargs: release.wait(5)
+        uploader = ThreadPoolExecutor(max_workers=4)
+        writer = GzipObjectWriter(
+            client,
+            BUCKET,
+            key_for,
+            max_uncompressed_bytes=1,
+            uploader=uploader,
+            max_in_flight=2,
+        )
+        writer.write(b"a\n")
+        writer.write(b"b\n")
+        producer = threading.Thread(target=writer.write, args=(b"c\n",))
+        producer.start()
+        producer.join(0.2)
+        assert producer.is_alive()
+
+        release.set()
+        producer.join(5)
+        assert writer.close() == [key_for(i) for i in range(3)]
+
+    def test_failed_background_upload_is_raised_by_close(self):
+        client = MagicMock()
+        client.put_object.side_effect = RuntimeError("upload failed")
+        writer = GzipObjectWriter(
+            client, BUCKET, key_for, uploader=ThreadPoolExecutor(max_workers=1)
+        )
+        writer.write(b"lost\n")
+
+        with pytest.raises(RuntimeError):
+            writer.close()
+        assert writer.keys == []
+
+    def test_nothing_written_uploads_nothing(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for)
+        writer.write(b"")
+
+        assert writer.close() == []
+        assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
+
+    def test_failed_upload_starts_a_new_object(self, s3):
+        writer = GzipObjectWriter(s3, BUCKET, key_for)
+        writer.write(b"lost\n")
+        writer.bucket = "missing-bucket"
+        with pytest.raises(Exception):
+            writer.flush()
+        writer.bucket = BUCKET
+        writer.write(b"kept\n")
+
+        assert writer.close() == ["batch-1.json.gz"]
+        assert read_object(s3, "batch-1.json.gz") == b"kept\n"
+
+
+class TestBatchKeys:
+
+    def test_layout(self):
+        keys = BatchKeys(started=1700000000.123, sandbox="0a1b2c3d4e5f", invocation=7)
+
+        assert keys(0) == (
+            "2023/11/14/22/batch-1700000000123-0a1b2c3d4e5f-000007-0000.json.gz"
+        )
+        assert keys(12) == (
+            "2023/11/14/22/batch-1700000000123-0a1b2c3d4e5f-000007-0012.json.gz"
+        )
+
+    def test_same_millisecond_batches_do_not_collide(self):
+        started = 1700000000.5
+        batches = [
+            BatchKeys(started=started),
+            BatchKeys(started=started),
+            BatchKeys(started=started, sandbox="other-sandbox"),
+        ]
+
+        assert len({keys(0) for keys in batches}) == 3
+
+    def test_keys_sort_in_time_order(self):
+        keys = [
+            BatchKeys(started=started, sandbox="sandbox", invocation=0)(sequence)
+            for started in (999.999, 1000.0, 1700000000.0, 1700000000.001)
+            for sequence in (0, 1, 10)
+        ]
+
+        assert sorted(keys) == keys
+
+
+class TestTenantOutput:
+
+    def test_events_are_written_per_tenant(self):
+        writers = {}
+
+        def new_writer(tenant):
+            writers[tenant] = MagicMock(keys=[f"{tenant}/0"])
+            return writers[tenant]
+
+        output = TenantOutput(new_writer)
+        output.buffer({"Organization GUID": "org-a"}).extend(b"a1\n")
+        output.buffer({"Organization GUID": "org/b"}).extend(b"b1\n")
+        output.commit()
+        output.buffer({"Organization GUID": "org-a"}).extend(b"a2\n")
+        output.commit()
+        output.buffer({"Organization GUID": "org-a"}).extend(b"dropped\n")
+        output.discard()
+        output.commit()
+
+        assert sorted(output.close()) == ["org-a/0", "org_b/0"]
+        assert [c.args for c in writers["org-a"].write.call_args_list] == [
+            (b"a1\n",),
+            (b"a2\n",),
+        ]
+        writers["org_b"].write.assert_called_once_with(b"b1\n")
+        for writer in writers.values():
+            writer.close.assert_called_once()
+
+    def test_failed_tenant_does_not_block_others(self):
+        failing, working = MagicMock(), MagicMock()
+        failing.write.side_effect = RuntimeError("upload failed")
+        writers = {"org-a": failing, "org-b": working}
+        output = TenantOutput(writers.get)
+        output.buffer({"Organization GUID": "org-a"}).extend(b"a\n")
+        output.buffer({"Organization GUID": "org-b"}).extend(b"b\n")
+
+        with pytest.raises(RuntimeError):
+            output.commit()
+
+        working.write.assert_called_once_with(b"b\n")
+
+    def test_partitioned_keys_share_the_batch(self, s3):
+        keys = BatchKeys(started=1700000000.0, sandbox="sandbox", invocation=1)
+        output = TenantOutput(
+            lambda tenant: GzipObjectWriter(
+                s3, BUCKET, keys.partition(f"tenants/{tenant}")
+            )
+        )
+        output.buffer({"Organization GUID": "org-a"}).extend(b"a\n")
+        output.buffer({}).extend(b"untagged\n")
+        output.commit()
+
+        assert sorted(output.close()) == [
+            "tenants/org-a/2023/11/14/22/batch-1700000000000-sandbox-000001-0000.json.gz",
+            "tenants/unknown/2023/11/14/22/batch-1700000000000-sandbox-000001-0000.json.gz",
+        ]
+
+
+class TestPipelinedOutput:
+
+    def test_records_are_written_in_order_off_the_calling_thread(self, s3):
+        threads = []
+
+        class RecordingWriter(GzipObjectWriter):
+            def write(self, data):
+                threads.append(threading.current_thread())
+                super().write(data)
+
+        writer = RecordingWriter(s3, BUCKET, key_for)
+        output = PipelinedOutput(BatchOutput(writer), max_pending=2)
+
+        for i in range(10):
+            output.buffer({}).extend(b"%d\n" % i)
+            output.commit()
+
+        assert output.close() == ["batch-0.json.gz"]
+        assert read_object(s3, "batch-0.json.gz") == b"".join(
+            b"%d\n" % i for i in range(10)
+        )
+        assert threading.current_thread() not in threads
+
+    def test_commit_blocks_when_the_queue_is_full(self):
+        release = threading.Event()
+        writer = MagicMock()
+        writer.write.side_effect = lambda data: release.wait(5)
+        output = PipelinedOutput(BatchOutput(writer), max_pending=2)
+
+        def produce():
+            # one being written, two queued, one waiting for room
+            for i in range(4):
+                output.buffer({}).extend(b"x\n")
+                output.commit()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        producer.join(0.2)
+        assert producer.is_alive()
+
+        release.set()
+        producer.join(5)
+        output.close()
+        assert writer.write.call_count == 4
+
+    def test_upload_errors_surface_on_commit_and_close(self):
+        writer = MagicMock()
+        writer.write.side_effect = RuntimeError("upload failed")
+        output = PipelinedOutput(BatchOutput(writer))
+        output.buffer({}).extend(b"first\n")
+        output.commit()
+
+        with pytest.raises(RuntimeError):
+            output.close()
+        with pytest.raises(RuntimeError):
+            output.commit()
+        writer.close.assert_called_once()
+
+    def test_close_finishes_other_tenants_after_an_error(self, s3):
+        failing = MagicMock()
+        failing.write.side_effect = RuntimeError("upload failed")
+        working = GzipObjectWriter(s3, BUCKET, key_for, part_bytes=MIN_PART_BYTES)
+        writers = {"org-a": failing, "org-b": working}
+        output = PipelinedOutput(TenantOutput(writers.get))
+        # org-b's first write starts a multipart upload before org-a fails
+        output.buffer({"Organization GUID": "org-b"}).extend(
+            os.urandom(2 * MIN_PART_BYTES)
+        )
+        output.commit()
+        output.buffer({"Organization GUID": "org-a"}).extend(b"a\n")
+        output.commit()
+
+        with pytest.raises(RuntimeError, match="upload failed"):
+            output.close()
+
+        failing.close.assert_called_once()
+        assert working.keys == ["batch-0.json.gz"]
+        head = s3.head_object(Bucket=BUCKET, Key="batch-0.json.gz")
+        assert head["ETag"].strip('"').endswith("-2")
+        assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+    def test_nothing_committed_starts_no_thread(self):
+        writer = MagicMock(keys=[])
+        output = PipelinedOutput(BatchOutput(writer))
+
+        output.close()
+
+        assert output._thread is None
+        writer.close.assert_called_once()
+
+
+def test_batch_output_writes_each_record(s3):
+    output = BatchOutput(GzipObjectWriter(s3, BUCKET, key_for))
+    output.buffer({"Organization GUID": "org-a"}).extend(b"a\n")
+    output.commit()
+    output.buffer({"Organization GUID": "org-b"}).extend(b"failed\n")
+    output.discard()
+    output.buffer({"Organization GUID": "org-b"}).extend(b"b\n")
+    output.commit()
+
+    assert output.close() == ["batch-0.json.gz"]
+    assert read_object(s3, "batch-0.json.gz") == b"a\nb\n"
+
+
+def test_output_options_from_env(monkeypatch):
+    for name in (
+        "S3_OBJECT_MAX_BYTES",
+        "S3_OBJECT_MAX_UNCOMPRESSED_BYTES",
+        "S3_MULTIPART_PART_BYTES",
+        "S3_OUTPUT_IF_NONE_MATCH",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    assert output_options_from_env() == {
+        "max_bytes": 0,
+        "max_uncompressed_bytes": 0,
+        "part_bytes": 0,
+        "if_none_match": False,
+    }
+    monkeypatch.setenv("S3_OBJECT_MAX_BYTES", "8388608")
+    monkeypatch.setenv("S3_OBJECT_MAX_UNCOMPRESSED_BYTES", "67108864")
+    monkeypatch.setenv("S3_MULTIPART_PART_BYTES", "5242880")
+    monkeypatch.setenv("S3_OUTPUT_IF_NONE_MATCH", "true")
+    assert output_options_from_env() == {
+        "max_bytes": 8388608,
+        "max_uncompressed_bytes": 67108864,
+        "part_bytes": 5242880,
+        "if_none_match": True,
+    }
@@ -0,0 +1,252 @@
+import json
+import base64
+import gzip
+from unittest.mock import patch, MagicMock
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from lambda_functions.prefilter import LogPrefilter, MetricPrefilter
+from lambda_functions.resolvers import default_registry
+from lambda_functions import transform_cloudwatch_lambda, transform_lambda
+from lambda_functions.transform_lambda import lambda_handler
+
+prefixes = {"rds": "cg-aws-broker-prod", "s3": "cg-", "domain": "cg-broker-prd-"}
+
+
+def line(namespace, dimensions):
+    metric = {
+        "metric_stream_name": "stream",
+        "account_id": "123456789012",
+        "region": "us-gov-west-1",
+        "namespace": namespace,
+        "metric_name": "Metric",
+        "dimensions": dimensions,
+        "timestamp": 1640995200000,
+        "value": {"max": 1.0, "min": 0.0, "sum": 1.0, "count": 1.0},
+        "unit": "None",
+    }
+    return json.dumps(metric).encode("utf-8")
+
+
+class TestMetricPrefilter:
+
+    @pytest.mark.parametrize(
+        "raw,accepted",
+        [
+            (line("AWS/EC2", {"InstanceId": "i-1"}), False),
+            (line("AWS/RDS", {"DBInstanceIdentifier": "tenant-db"}), False),
+            (line("AWS/S3", {"BucketName": "other-bucket"}), False),
+            (line("AWS/RDS", {"DBInstanceIdentifier": "cg-aws-broker-proddb"}), True),
+            (line("AWS/S3", {"BucketName": "cg-bucket"}), True),
+            (line("AWS/ES", {"DomainName": "cg-broker-prd-a"}), True),
+            # the prefilter cannot decide these, so the full parse does
+            (line("AWS/S3", {"StorageType": "StandardStorage"}), True),
+            (line("AWS/S3", {"BucketName": 'cg-"quoted"'}), True),
+            (b'{"metric_name": "NoNamespace"}', True),
+            (line("AWS/S3", {"BucketName": "cg-é"}), True),
+        ],
+    )
+    def test_accepts(self, raw, accepted):
+        prefilter = MetricPrefilter(default_registry(), prefixes)
+
+        assert prefilter.accepts(raw) is accepted
+
+    def test_stats_report_skip_ratio(self):
+        prefilter = MetricPrefilter(default_registry(), prefixes)
+        for namespace in ["AWS/EC2", "AWS/Lambda", "AWS/Firehose"]:
+            prefilter.accepts(line(namespace, {}))
+        prefilter.accepts(line("AWS/S3", {"BucketName": "cg-bucket"}))
+
+        assert prefilter.stats() == {"lines": 4, "skipped": 3, "skip_ratio": 0.75}
+
+
+class TestLambdaHandlerPrefilter:
+
+    def event(self):
+        lines = [
+            line("AWS/EC2", {"InstanceId": "i-1"}),
+            line("AWS/S3", {"BucketName": "cg-bucket"}),
+            line("AWS/RDS", {"DBInstanceIdentifier": "tenant-db"}),
+        ]
+        data = base64.b64encode(b"\n".join(lines) + b"\n").decode("utf-8")
+        return {"records": [{"recordId": "mixed", "data": data}]}
+
+    @pytest.mark.parametrize("enabled", [True, False])
+    def test_skipped_lines_are_not_parsed(self, monkeypatch, enabled):
+        """Output is the same with the prefilter, with fewer lines parsed"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.METRIC_PREFILTER_ENABLED", enabled
+        )
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.TAG_PREFETCH_ENABLED", False
+        )
+        # already reported, so the prefilter may skip it
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda._unknown_namespaces", {"AWS/EC2"}
+        )
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.fetch_tags_from_arn",
+            return_value={"Organization GUID": "org"},
+        ), patch.object(
+            transform_lambda.codec, "loads", wraps=transform_lambda.codec.loads
+        ) as loads:
+            result = lambda_handler(self.event(), MagicMock())
+
+        output = json.loads(base64.b64decode(result["records"][0]["data"]))
+        assert output["dimensions"] == {"BucketName": "cg-bucket"}
+        assert output["Tags"] == {"Organization GUID": "org"}
+        assert loads.call_count == (1 if enabled else 3)
+
+    def test_unknown_namespace_is_still_reported(self, monkeypatch):
+        """The first line of an unreported namespace reaches the full parse"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.METRIC_PREFILTER_ENABLED", True
+        )
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda._unknown_namespaces", set()
+        )
+        lines = [line("AWS/Lambda", {"FunctionName": "f"})] * 3
+        data = base64.b64encode(b"\n".join(lines) + b"\n").decode("utf-8")
+        event = {"records": [{"recordId": "lambda", "data": data}]}
+
+        with patch("lambda_functions.transform_lambda.logger") as logger, patch.object(
+            transform_lambda.codec, "loads", wraps=transform_lambda.codec.loads
+        ) as loads:
+            for _ in range(2):
+                lambda_handler(event, MagicMock())
+
+        reports = [
+            call.args[0]
+            for call in logger.error.call_args_list
+            if "Hello developer" in call.args[0]
+        ]
+        assert reports == [
+            "Hello developer, you need to add the following metric to the "
+            "lambda function: AWS/Lambda"
+        ]
+        assert loads.call_count == 1
+
+
+def log_document(log_group, message_type="DATA_MESSAGE", message="LOG:  ok"):
+    document = {
+        "messageType": message_type,
+        "owner": "123456789012",
+        "logGroup": log_group,
+        "logStream": "stream",
+        "subscriptionFilters": ["testing"],
+        "logEvents": [{"id": "1", "timestamp": 1640995200000, "message": message}],
+    }
+    return json.dumps(document).encode("utf-8")
+
+
+BROKER_LOG_GROUP = "/aws/rds/instance/cg-aws-broker-prodtenant/postgresql"
+
+
+class TestLogPrefilter:
+
+    @pytest.mark.parametrize(
+        "raw,accepted",
+        [
+            (log_document(BROKER_LOG_GROUP), True),
+            (log_document("", "CONTROL_MESSAGE"), False),
+            (log_document(BROKER_LOG_GROUP, "OTHER_MESSAGE"), False),
+            (log_document("/aws/rds/instance/platform-db/postgresql"), False),
+            (log_document("/aws/lambda/some-function"), False),
+            # the prefilter cannot decide these, so the full parse does
+            (log_document("\\/aws\\/rds"), True),
+            (b'{"owner": "123456789012"}', True),
+            (b'{"logEvents": [], "messageType": "CONTROL_MESSAGE"}', True),
+            (
+                log_document(
+                    BROKER_LOG_GROUP,
+                    message='{"messageType": "CONTROL_MESSAGE", "logGroup": "x"}',
+                ),
+                True,
+            ),
+        ],
+    )
+    def test_accepts(self, raw, accepted):
+        prefilter = LogPrefilter("cg-aws-broker-prod")
+
+        assert prefilter.accepts(memoryview(raw)) is accepted
+
+    def test_stats_count_drops_per_reason(self):
+        prefilter = LogPrefilter("cg-aws-broker-prod")
+        prefilter.accepts(log_document("", "CONTROL_MESSAGE"))
+        prefilter.accepts(log_document("/aws/rds/instance/platform-db/postgresql"))
+        prefilter.accepts(log_document("/aws/lambda/some-function"))
+        prefilter.accepts(log_document(BROKER_LOG_GROUP))
+
+        assert prefilter.stats() == {
+            "documents": 4,
+            "skipped": 3,
+            "skip_ratio": 0.75,
+            "control_message": 1,
+            "not_data_message": 0,
+            "not_broker": 2,
+        }
+
+
+class TestCloudwatchHandlerPrefilter:
+
+    def event(self):
+        documents = [
+            log_document("", "CONTROL_MESSAGE"),
+            log_document("/aws/rds/instance/platform-db/postgresql"),
+            log_document(BROKER_LOG_GROUP),
+        ]
+        return {
+            "records": [
+                {
+                    "recordId": str(i),
+                    "data": base64.b64encode(gzip.compress(document)).decode("utf-8"),
+                }
+                for i, document in enumerate(documents)
+            ]
+        }
+
+    @mock_aws
+    @pytest.mark.parametrize("enabled", [True, False])
+    def test_dropped_documents_are_not_parsed(self, monkeypatch, enabled):
+        """Output is the same with the prefilter, with fewer documents parsed"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
+        monkeypatch.setattr(
+            "lambda_functions.transform_cloudwatch_lambda.LOG_PREFILTER_ENABLED",
+            enabled,
+        )
+        boto3.client("s3", region_name="us-gov-west-1").create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": "us-gov-west-1"},
+        )
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.fetch_tags_from_arn",
+            return_value={"Organization GUID": "org"},
+        ) as fetch, patch.object(
+            transform_cloudwatch_lambda.codec,
+            "loads",
+            wraps=transform_cloudwatch_lambda.codec.loads,
+        ) as loads:
+            result = transform_cloudwatch_lambda.lambda_handler(
+                self.event(), MagicMock()
+            )
+
+        assert [record["result"] for record in result["records"]] == [
+            "Dropped",
+            "Dropped",
+            "Ok",
+        ]
+        assert loads.call_count == (1 if enabled else 3)
+        assert fetch.call_count == 1
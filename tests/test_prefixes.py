@@ -0,0 +1,28 @@
+import pytest
+
+from lambda_functions.prefixes import environment_prefixes
+
+
+@pytest.mark.parametrize(
+    "environment,prefixes",
+    [
+        ("production", ("cg-aws-broker-prod", "cg-", "cg-broker-prd-")),
+        ("staging", ("cg-aws-broker-stage", "staging-cg-", "cg-broker-stg-")),
+        ("development", ("cg-aws-broker-dev", "development-cg-", "cg-broker-dev-")),
+    ],
+)
+def test_environment_prefixes(monkeypatch, environment, prefixes):
+    monkeypatch.setenv("ENVIRONMENT", environment)
+
+    assert environment_prefixes() == prefixes
+
+
+@pytest.mark.parametrize("environment", [None, "", "sandbox"])
+def test_environment_prefixes_require_a_known_environment(monkeypatch, environment):
+    if environment is None:
+        monkeypatch.delenv("ENVIRONMENT", raising=False)
+    else:
+        monkeypatch.setenv("ENVIRONMENT", environment)
+
+    with pytest.raises(RuntimeError):
+        environment_prefixes()
@@ -0,0 +1,133 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+from moto import mock_aws
+
+from lambda_functions.resolvers import (
+    NamespaceResolver,
+    ResolverRegistry,
+    default_registry,
+    dimension,
+    starts_with,
+)
+
+dummy_region = "us-gov-west-1"
+account_id = "123456789012"
+prefixes = {"rds": "cg-aws-broker-prod", "s3": "cg-", "domain": "cg-broker-prd-"}
+org_tags = {"Organization GUID": "org-1"}
+
+
+class TestResolverRegistry:
+
+    @pytest.mark.parametrize(
+        "namespace,dimensions,arn",
+        [
+            (
+                "AWS/S3",
+                {"BucketName": "cg-bucket"},
+                "arn:aws-us-gov:s3:::cg-bucket",
+            ),
+            (
+                "AWS/ES",
+                {"DomainName": "cg-broker-prd-a"},
+                f"arn:aws-us-gov:es:{dummy_region}:{account_id}:domain/cg-broker-prd-a",
+            ),
+            (
+                "AWS/RDS",
+                {"DBInstanceIdentifier": "cg-aws-broker-proddb"},
+                f"arn:aws-us-gov:rds:{dummy_region}:{account_id}:db:cg-aws-broker-proddb",
+            ),
+            (
+                "AWS/ElastiCache",
+                {"CacheClusterId": "cg-aws-broker-prodredis-001"},
+                f"arn:aws-us-gov:elasticache:{dummy_region}:{account_id}"
+                ":cluster:cg-aws-broker-prodredis-001",
+            ),
+            (
+                "AWS/SQS",
+                {"QueueName": "cg-aws-broker-prodqueue"},
+                f"arn:aws-us-gov:sqs:{dummy_region}:{account_id}:cg-aws-broker-prodqueue",
+            ),
+            (
+                "AWS/DynamoDB",
+                {"TableName": "cg-aws-broker-prodtable"},
+                f"arn:aws-us-gov:dynamodb:{dummy_region}:{account_id}"
+                ":table/cg-aws-broker-prodtable",
+            ),
+        ],
+    )
+    def test_builtin_resolvers(self, namespace, dimensions, arn):
+        """Each built-in namespace maps its dimension to a broker ARN and back"""
+        resolver = default_registry().get(namespace)
+
+        name = resolver.resource_name(dimensions)
+
+        assert resolver.is_broker(name, prefixes)
+        assert resolver.arn(name, dummy_region, account_id) == arn
+        assert default_registry().for_arn(arn) is resolver
+
+    def test_non_broker_and_unknown_namespaces(self):
+        registry = default_registry()
+
+        assert not registry.get("AWS/SQS").is_broker("tenant-queue", prefixes)
+        assert "AWS/EC2" not in registry
+        assert registry.get("AWS/EC2") is None
+        assert registry.for_arn("not-an-arn") is None
+
+    def test_register_adds_a_namespace(self):
+        """Supporting another service only takes one resolver"""
+        registry = ResolverRegistry()
+        resolver = NamespaceResolver(
+            namespace="AWS/Kinesis",
+            service="kinesis",
+            resource_name=dimension("StreamName"),
+            is_broker=starts_with("rds"),
+            arn=lambda name, region, account: f"arn:aws-us-gov:kinesis:::{name}",
+            fetch_tags=lambda client, arn: {},
+        )
+
+        registry.register(resolver)
+
+        assert registry.namespaces() == ["AWS/Kinesis"]
+        assert registry.for_arn("arn:aws-us-gov:kinesis:::stream") is resolver
+
+
+class TestResolverTagSources:
+
+    @mock_aws
+    def test_sqs_tags(self):
+        sqs = boto3.client("sqs", region_name=dummy_region)
+        sqs.create_queue(QueueName="cg-aws-broker-prodqueue", tags=org_tags)
+        resolver = default_registry().get("AWS/SQS")
+        arn = resolver.arn("cg-aws-broker-prodqueue", dummy_region, account_id)
+
+        assert resolver.fetch_tags(sqs, arn) == org_tags
+
+    @mock_aws
+    def test_dynamodb_tags(self):
+        dynamodb = boto3.client("dynamodb", region_name=dummy_region)
+        arn = dynamodb.create_table(
+            TableName="cg-aws-broker-prodtable",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+            Tags=[{"Key": "Organization GUID", "Value": "org-1"}],
+        )["TableDescription"]["TableArn"]
+
+        assert default_registry().get("AWS/DynamoDB").fetch_tags(dynamodb, arn) == (
+            org_tags
+        )
+
+    def test_elasticache_tags(self):
+        elasticache = boto3.client("elasticache", region_name=dummy_region)
+        resolver = default_registry().get("AWS/ElastiCache")
+        arn = resolver.arn("cg-aws-broker-prodredis-001", dummy_region, account_id)
+        stubber = Stubber(elasticache)
+        stubber.add_response(
+            "list_tags_for_resource",
+            {"TagList": [{"Key": "Organization GUID", "Value": "org-1"}]},
+            {"ResourceName": arn},
+        )
+        stubber.activate()
+
+        assert resolver.fetch_tags(elasticache, arn) == org_tags
@@ -0,0 +1,207 @@
+import threading
+import time
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from lambda_functions.tag_cache import (
+    NO_ORG_GUID,
+    NOT_FOUND,
+    THROTTLED,
+    EncodedTags,
+    NegativeLookup,
+    TagCache,
+    negative_reason,
+    tag_cache_from_env,
+)
+
+
+class TestTagCache:
+
+    def test_hit_after_miss(self):
+        """The loader only runs once for a key"""
+        cache = TagCache(ttl=60)
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {"Organization GUID": "abc"}
+
+        assert cache.get("arn:1", loader) == {"Organization GUID": "abc"}
+        assert cache.get("arn:1", loader) == {"Organization GUID": "abc"}
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_entry_expires_after_ttl(self, clock):
+        """Expired entries are loaded again"""
+        cache = TagCache(ttl=60, clock=clock)
+        cache.get("arn:1", lambda: {"v": "1"})
+        clock.now += 61
+
+        assert cache.get("arn:1", lambda: {"v": "2"}) == {"v": "2"}
+        assert cache.stats()["misses"] == 2
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted when full"""
+        cache = TagCache(ttl=60, maxsize=2)
+        cache.put("a", {})
+        cache.put("b", {})
+        cache.get("a", lambda: pytest.fail("a should be cached"))
+        cache.put("c", {})
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.stats()["evictions"] == 1
+
+    def test_loader_errors_are_not_cached(self):
+        """A failing lookup is retried on the next call"""
+        cache = TagCache(ttl=60)
+
+        def failing():
+            raise RuntimeError("throttled")
+
+        with pytest.raises(RuntimeError):
+            cache.get("arn:1", failing)
+        assert cache.get("arn:1", lambda: {"v": "1"}) == {"v": "1"}
+
+    def test_stale_while_revalidate(self, clock):
+        """Stale entries are served while a background refresh runs"""
+        cache = TagCache(ttl=60, stale_ttl=30, clock=clock)
+        cache.put("arn:1", {"v": "old"})
+        clock.now += 70
+
+        assert cache.get("arn:1", lambda: {"v": "new"}) == {"v": "old"}
+        assert cache.stats()["stale_hits"] == 1
+        deadline = time.time() + 5
+        while cache.peek("arn:1") != {"v": "new"} and time.time() < deadline:
+            time.sleep(0.01)
+        assert cache.peek("arn:1") == {"v": "new"}
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Only one caller runs the loader for a key that is being fetched"""
+        cache = TagCache(ttl=60)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"Organization GUID": "abc"}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get("k", slow_loader)))
+            for _ in range(5)
+        ]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while cache.stats()["coalesced"] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert results == [{"Organization GUID": "abc"}] * 5
+
+    def test_coalesced_callers_see_loader_error(self):
+        """Waiting callers get the leader's error and nothing is cached"""
+        cache = TagCache(ttl=60)
+        started = threading.Event()
+        release = threading.Event()
+
+        def failing_loader():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("throttled")
+
+        errors = []
+
+        def lookup():
+            try:
+                cache.get("k", failing_loader)
+            except RuntimeError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=lookup)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lookup)
+        follower.start()
+        while cache.stats()["coalesced"] < 1:
+            time.sleep(0.001)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        assert len(errors) == 2
+        assert "k" not in cache
+
+    def test_negative_entries_use_reason_ttl(self, clock):
+        """Negative results are cached briefly and counted by reason"""
+        cache = TagCache(ttl=600, negative_ttls={NO_ORG_GUID: 30}, clock=clock)
+
+        def platform_owned():
+            raise NegativeLookup(NO_ORG_GUID)
+
+        assert cache.get("arn:platform", platform_owned) == {}
+        assert cache.get("arn:platform", platform_owned) == {}
+        stats = cache.stats()
+        assert stats["negative_stored"][NO_ORG_GUID] == 1
+        assert stats["negative_hits"][NO_ORG_GUID] == 1
+
+        clock.now += 31
+        assert cache.get("arn:platform", lambda: {"v": "1"}) == {"v": "1"}
+
+    def test_negative_value_can_be_none(self):
+        cache = TagCache(ttl=600)
+
+        def deleted():
+            raise NegativeLookup(NOT_FOUND, value=None)
+
+        assert cache.get("size", deleted) is None
+        assert "size" in cache
+
+    @pytest.mark.parametrize(
+        "code, reason",
+        [
+            pytest.param("DBInstanceNotFound", NOT_FOUND),
+            pytest.param("ResourceNotFoundException", NOT_FOUND),
+            pytest.param("ThrottlingException", THROTTLED),
+            pytest.param("AccessDenied", None),
+        ],
+    )
+    def test_negative_reason(self, code, reason):
+        error = ClientError({"Error": {"Code": code}}, "ListTagsForResource")
+        assert negative_reason(error) == reason
+
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("TAG_CACHE_TTL_SECONDS", "120")
+        monkeypatch.setenv("TAG_CACHE_MAX_ENTRIES", "10")
+        monkeypatch.setenv("TAG_CACHE_STALE_SECONDS", "5")
+        monkeypatch.setenv("TAG_CACHE_THROTTLED_TTL_SECONDS", "7")
+
+        cache = tag_cache_from_env()
+        assert cache.ttl == 120
+        assert cache.maxsize == 10
+        assert cache.stale_ttl == 5
+        assert cache.negative_ttls[THROTTLED] == 7
+
+    def test_tag_sets_are_stored_as_encoded_tags(self):
+        """Cached tag dicts carry their encoding; other values are untouched"""
+        cache = TagCache()
+
+        tags = cache.get("arn:tags", lambda: {"Organization GUID": "org"})
+        cache.put(("AllocatedStorage", "db"), 20)
+
+        assert isinstance(tags, EncodedTags)
+        assert cache.peek("arn:tags") is tags
+        assert type(tags.copy()) is dict
+        assert cache.peek(("AllocatedStorage", "db")) == 20
+        assert type(cache.get("arn:empty", lambda: {})) is dict
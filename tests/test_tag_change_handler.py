@@ -0,0 +1,292 @@
+import json
+import base64
+from unittest.mock import patch, MagicMock
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from lambda_functions import tag_change_handler
+from lambda_functions.tag_change_handler import (
+    broker_tag_changes,
+    lambda_handler,
+    record_tag_changes,
+)
+from lambda_functions.tag_snapshot import TagSnapshotLoader, build_snapshot
+from lambda_functions.transform_lambda import tag_cache
+from lambda_functions import transform_lambda
+
+dummy_region = "us-gov-west-1"
+snapshot_bucket = "tag-snapshot-bucket"
+snapshot_key = "tag-snapshots/v1/latest.json"
+changes_key = "tag-snapshots/v1/changes.json"
+bucket_arn = "arn:aws-us-gov:s3:::cg-changed-bucket"
+rds_arn = "arn:aws-us-gov:rds:us-gov-west-1:123456789012:db:cg-aws-broker-prodabc"
+
+
+def tag_change_event(arn, service, tags):
+    return {
+        "version": "0",
+        "detail-type": "Tag Change on Resource",
+        "source": "aws.tag",
+        "account": "123456789012",
+        "region": dummy_region,
+        "resources": [arn],
+        "detail": {
+            "changed-tag-keys": list(tags),
+            "service": service,
+            "resource-type": "bucket" if service == "s3" else "db",
+            "version": 2,
+            "tags": tags,
+        },
+    }
+
+
+def set_env(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", dummy_region)
+    monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+    monkeypatch.setenv("ENVIRONMENT", "production")
+    monkeypatch.setenv("TAG_SNAPSHOT_BUCKET", snapshot_bucket)
+
+
+def create_snapshot_bucket():
+    s3 = boto3.client("s3", region_name=dummy_region)
+    s3.create_bucket(
+        Bucket=snapshot_bucket,
+        CreateBucketConfiguration={"LocationConstraint": dummy_region},
+    )
+    return s3
+
+
+def read_changes(s3):
+    body = s3.get_object(Bucket=snapshot_bucket, Key=changes_key)["Body"].read()
+    return json.loads(body)
+
+
+class TestBrokerTagChanges:
+
+    @pytest.mark.parametrize(
+        "arn,service,applies",
+        [
+            (rds_arn, "rds", True),
+            (
+                "arn:aws-us-gov:rds:us-gov-west-1:123456789012:db:cg-aws-broker-devabc",
+                "rds",
+                False,
+            ),
+            (
+                "arn:aws-us-gov:es:us-gov-west-1:123456789012:domain/cg-broker-prd-a",
+                "es",
+                True,
+            ),
+            (bucket_arn, "s3", True),
+            ("arn:aws-us-gov:s3:::other-bucket", "s3", False),
+            (
+                "arn:aws-us-gov:ec2:us-gov-west-1:123456789012:instance/i-1",
+                "ec2",
+                False,
+            ),
+        ],
+    )
+    def test_only_broker_resources_apply(self, arn, service, applies):
+        """Tag changes are recorded for broker resources only"""
+        event = tag_change_event(arn, service, {"Organization GUID": "org"})
+
+        changes = broker_tag_changes(
+            event, "cg-aws-broker-prod", "cg-", "cg-broker-prd-"
+        )
+
+        assert changes == ({arn: {"Organization GUID": "org"}} if applies else {})
+
+    def test_other_events_are_ignored(self):
+        event = tag_change_event(bucket_arn, "s3", {"Organization GUID": "org"})
+        event["detail-type"] = "AWS API Call via CloudTrail"
+
+        assert broker_tag_changes(event, "cg-aws-broker-prod", "cg-", "x") == {}
+
+
+class TestRecordTagChanges:
+
+    @mock_aws
+    def test_handler_records_changes(self, monkeypatch):
+        """Each event merges the resource's new tags into the change record"""
+        set_env(monkeypatch)
+        s3 = create_snapshot_bucket()
+
+        with patch("lambda_functions.tag_change_handler.logger"):
+            lambda_handler(
+                tag_change_event(bucket_arn, "s3", {"Organization GUID": "org-1"}),
+                MagicMock(),
+            )
+            result = lambda_handler(
+                tag_change_event(rds_arn, "rds", {"Organization GUID": "org-2"}),
+                MagicMock(),
+            )
+
+        assert result == {"changed": 1, "resources": 2}
+        assert read_changes(s3)["resources"] == {
+            bucket_arn: {"Organization GUID": "org-1"},
+            rds_arn: {"Organization GUID": "org-2"},
+        }
+
+    @mock_aws
+    def test_non_broker_change_writes_nothing(self, monkeypatch):
+        set_env(monkeypatch)
+        s3 = create_snapshot_bucket()
+
+        with patch("lambda_functions.tag_change_handler.logger"):
+            result = lambda_handler(
+                tag_change_event("arn:aws-us-gov:s3:::other", "s3", {}), MagicMock()
+            )
+
+        assert result == {"changed": 0}
+        assert s3.list_objects_v2(Bucket=snapshot_bucket)["KeyCount"] == 0
+
+    @mock_aws
+    def test_old_changes_are_pruned(self):
+        s3 = create_snapshot_bucket()
+        record_tag_changes(
+            s3, snapshot_bucket, changes_key, {rds_arn: {"a": "1"}}, 100, lambda: 0
+        )
+
+        record_tag_changes(
+            s3, snapshot_bucket, changes_key, {bucket_arn: {"b": "2"}}, 100, lambda: 150
+        )
+
+        document = read_changes(s3)
+        assert document["resources"] == {bucket_arn: {"b": "2"}}
+        assert document["changed_at"] == {bucket_arn: 150}
+
+    @mock_aws
+    def test_concurrent_write_is_retried(self):
+        """A write that lost the race re-reads the record instead of clobbering it"""
+        s3 = create_snapshot_bucket()
+        record_tag_changes(s3, snapshot_bucket, changes_key, {rds_arn: {"a": "1"}}, 100)
+        get_object = s3.get_object
+        other_writer = boto3.client("s3", region_name=dummy_region)
+        calls = []
+
+        def racing_get_object(**kwargs):
+            response = get_object(**kwargs)
+            if not calls:
+                record_tag_changes(
+                    other_writer,
+                    snapshot_bucket,
+                    changes_key,
+                    {"other": {"c": "3"}},
+                    100,
+                )
+            calls.append(kwargs)
+            return response
+
+        with patch.object(s3, "get_object", side_effect=racing_get_object), patch(
+            "lambda_functions.tag_change_handler.logger"
+        ):
+            resources = record_tag_changes(
+                s3, snapshot_bucket, changes_key, {bucket_arn: {"b": "2"}}, 100
+            )
+
+        assert len(calls) == 2
+        assert resources == 3
+        assert set(read_changes(s3)["resources"]) == {rds_arn, bucket_arn, "other"}
+
+    def test_gives_up_after_repeated_conflicts(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = lambda **kwargs: {
+            "Body": MagicMock(read=lambda: b"{}"),
+            "ETag": '"etag"',
+        }
+        s3.put_object.side_effect = ClientError(
+            {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+        )
+
+        with pytest.raises(RuntimeError), patch(
+            "lambda_functions.tag_change_handler.logger"
+        ):
+            record_tag_changes(s3, "bucket", "key", {rds_arn: {}}, 100)
+
+        assert s3.put_object.call_count == tag_change_handler.MAX_WRITE_ATTEMPTS
+
+
+class TestTransformTagChanges:
+
+    def metric_event(self):
+        metric = {
+            "namespace": "AWS/S3",
+            "metric_name": "BucketSizeBytes",
+            "dimensions": {"BucketName": "cg-changed-bucket"},
+            "value": 1,
+        }
+        encoded_data = base64.b64encode(
+            (json.dumps(metric) + "\n").encode("utf-8")
+        ).decode("utf-8")
+        return {"records": [{"recordId": "changes", "data": encoded_data}]}
+
+    def transform(self):
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.prefetch_tags"
+        ), patch("lambda_functions.transform_lambda.fetch_tags_from_arn") as fetch:
+            result = transform_lambda.lambda_handler(self.metric_event(), MagicMock())
+        fetch.assert_not_called()
+        return json.loads(base64.b64decode(result["records"][0]["data"]))["Tags"]
+
+    @mock_aws
+    def test_tag_change_reaches_warm_sandbox(self, monkeypatch):
+        """A recorded change replaces cached snapshot tags on the next batch"""
+        set_env(monkeypatch)
+        s3 = create_snapshot_bucket()
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({bucket_arn: {"Organization GUID": "old"}}),
+        )
+        monkeypatch.setattr(
+            transform_lambda,
+            "tag_snapshot_loader",
+            TagSnapshotLoader(snapshot_bucket, snapshot_key),
+        )
+        monkeypatch.setattr(
+            transform_lambda,
+            "tag_change_loader",
+            TagSnapshotLoader(snapshot_bucket, changes_key, check_interval=0),
+        )
+
+        assert self.transform() == {"Organization GUID": "old"}
+        with patch("lambda_functions.tag_change_handler.logger"):
+            lambda_handler(
+                tag_change_event(bucket_arn, "s3", {"Organization GUID": "new"}),
+                MagicMock(),
+            )
+        assert self.transform() == {"Organization GUID": "new"}
+
+    @mock_aws
+    def test_changes_win_over_reloaded_snapshot(self, monkeypatch):
+        """A snapshot older than a recorded change does not revert it"""
+        set_env(monkeypatch)
+        s3 = create_snapshot_bucket()
+        with patch("lambda_functions.tag_change_handler.logger"):
+            lambda_handler(
+                tag_change_event(bucket_arn, "s3", {"Organization GUID": "new"}),
+                MagicMock(),
+            )
+        monkeypatch.setattr(
+            transform_lambda,
+            "tag_snapshot_loader",
+            TagSnapshotLoader(snapshot_bucket, snapshot_key, check_interval=0),
+        )
+        monkeypatch.setattr(
+            transform_lambda,
+            "tag_change_loader",
+            TagSnapshotLoader(snapshot_bucket, changes_key, check_interval=0),
+        )
+        assert self.transform() == {"Organization GUID": "new"}
+
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({bucket_arn: {"Organization GUID": "old"}}),
+        )
+
+        assert self.transform() == {"Organization GUID": "new"}
+        assert tag_cache.stats()["misses"] == 0
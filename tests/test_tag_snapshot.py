@@ -0,0 +1,238 @@
+import json
+import base64
+from unittest.mock import patch, MagicMock
+
+import boto3
+from moto import mock_aws
+
+from lambda_functions import generate_tag_snapshot
+from lambda_functions.tag_cache import TagCache
+from lambda_functions.tag_snapshot import (
+    SNAPSHOT_VERSION,
+    TagSnapshotLoader,
+    build_snapshot,
+)
+from lambda_functions.transform_lambda import filter_tags, lambda_handler, tag_cache
+
+dummy_region = "us-gov-west-1"
+snapshot_bucket = "tag-snapshot-bucket"
+snapshot_key = "tag-snapshots/v1/latest.json"
+
+
+def create_broker_resources():
+    rds = boto3.client("rds", region_name=dummy_region)
+    rds.create_db_instance(
+        DBInstanceIdentifier="cg-aws-broker-prodsnap",
+        DBInstanceClass="db.t3.micro",
+        Engine="postgres",
+        AllocatedStorage=20,
+        MasterUsername="admin",
+        MasterUserPassword="password123",
+        Tags=[{"Key": "Organization GUID", "Value": "org-rds"}],
+    )
+    es = boto3.client("es", region_name=dummy_region)
+    domain_arn = es.create_elasticsearch_domain(DomainName="cg-broker-prd-snap")[
+        "DomainStatus"
+    ]["ARN"]
+    es.add_tags(
+        ARN=domain_arn, TagList=[{"Key": "Organization GUID", "Value": "org-es"}]
+    )
+    s3 = boto3.client("s3", region_name=dummy_region)
+    for bucket in [snapshot_bucket, "cg-snap-bucket", "cg-untagged-bucket"]:
+        s3.create_bucket(
+            Bucket=bucket,
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+    s3.put_bucket_tagging(
+        Bucket="cg-snap-bucket",
+        Tagging={"TagSet": [{"Key": "Organization GUID", "Value": "org-s3"}]},
+    )
+    return domain_arn
+
+
+def set_env(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", dummy_region)
+    monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+    monkeypatch.setenv("ENVIRONMENT", "production")
+    monkeypatch.setenv("TAG_SNAPSHOT_BUCKET", snapshot_bucket)
+    monkeypatch.setenv("TAG_SNAPSHOT_KEY", snapshot_key)
+
+
+class TestGenerateTagSnapshot:
+
+    @mock_aws
+    def test_snapshot_contains_broker_resources(self, monkeypatch):
+        """The generator writes every broker resource's tags to S3"""
+        set_env(monkeypatch)
+        domain_arn = create_broker_resources()
+
+        with patch("lambda_functions.generate_tag_snapshot.logger"):
+            result = generate_tag_snapshot.lambda_handler({}, MagicMock())
+
+        s3 = boto3.client("s3", region_name=dummy_region)
+        body = s3.get_object(Bucket=snapshot_bucket, Key=snapshot_key)["Body"].read()
+        document = json.loads(body)
+        assert document["version"] == SNAPSHOT_VERSION
+        assert result["resources"] == 4
+        resources = document["resources"]
+        rds_arn = (
+            "arn:aws-us-gov:rds:us-gov-west-1:123456789012:db:cg-aws-broker-prodsnap"
+        )
+        assert resources[rds_arn] == {"Organization GUID": "org-rds"}
+        assert resources[domain_arn] == {"Organization GUID": "org-es"}
+        assert resources["arn:aws-us-gov:s3:::cg-snap-bucket"] == {
+            "Organization GUID": "org-s3"
+        }
+        assert resources["arn:aws-us-gov:s3:::cg-untagged-bucket"] == {}
+
+
+class TestTagSnapshotLoader:
+
+    @mock_aws
+    def test_loader_reloads_only_when_etag_changes(self, clock):
+        """The snapshot is read once and re-read only after it changes"""
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket=snapshot_bucket,
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({"arn:aws-us-gov:s3:::cg-a": {"k": "v1"}}),
+        )
+        cache = TagCache(ttl=600)
+        loader = TagSnapshotLoader(
+            snapshot_bucket, snapshot_key, check_interval=60, clock=clock
+        )
+
+        assert loader.refresh(s3, cache) == 1
+        assert cache.peek("arn:aws-us-gov:s3:::cg-a") == {"k": "v1"}
+        # not due yet
+        assert loader.refresh(s3, cache) == 0
+        # due but unchanged: stored again rather than downloaded
+        clock.now += 60
+        assert loader.refresh(s3, cache) == 1
+        assert loader.loads == 1
+
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({"arn:aws-us-gov:s3:::cg-a": {"k": "v2"}}),
+        )
+        clock.now += 60
+        assert loader.refresh(s3, cache) == 1
+        assert cache.peek("arn:aws-us-gov:s3:::cg-a") == {"k": "v2"}
+
+    @mock_aws
+    def test_unchanged_snapshot_outlives_the_cache_ttl(self, clock):
+        """Entries are stored again on each unchanged check, so they never expire"""
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket=snapshot_bucket,
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({"arn:aws-us-gov:s3:::cg-a": {"k": "v1"}}),
+        )
+        cache = TagCache(ttl=100, clock=clock)
+        loader = TagSnapshotLoader(
+            snapshot_bucket, snapshot_key, check_interval=60, clock=clock
+        )
+        loader.refresh(s3, cache)
+
+        for _ in range(5):
+            clock.now += 60
+            loader.refresh(s3, cache)
+            assert cache.peek("arn:aws-us-gov:s3:::cg-a") == {"k": "v1"}
+
+        assert loader.loads == 1
+
+    @mock_aws
+    def test_loader_applies_tag_rules(self):
+        """Snapshot entries follow the same rules as live lookups"""
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket=snapshot_bucket,
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        platform_arn = "arn:aws-us-gov:rds:us-gov-west-1:1:db:cg-aws-broker-prodx"
+        s3.put_object(
+            Bucket=snapshot_bucket,
+            Key=snapshot_key,
+            Body=build_snapshot({platform_arn: {"Owner": "cg"}}),
+        )
+        cache = TagCache(ttl=600)
+
+        TagSnapshotLoader(snapshot_bucket, snapshot_key).refresh(
+            s3, cache, normalize=filter_tags
+        )
+
+        assert cache.peek(platform_arn) == {}
+        assert cache.stats()["negative_stored"]["no_org_guid"] == 1
+
+    @mock_aws
+    def test_snapshot_larger_than_the_cache_warns(self):
+        """A snapshot that cannot fit is reported on load and on every reapply"""
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket=snapshot_bucket,
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        resources = {f"arn:aws-us-gov:s3:::cg-{i}": {"k": "v"} for i in range(3)}
+        s3.put_object(
+            Bucket=snapshot_bucket, Key=snapshot_key, Body=build_snapshot(resources)
+        )
+        loader = TagSnapshotLoader(snapshot_bucket, snapshot_key, check_interval=0)
+
+        with patch("lambda_functions.tag_snapshot.logger") as logger:
+            loader.refresh(s3, TagCache(ttl=600, maxsize=3))
+            assert logger.warning.call_count == 0
+            loader.refresh(s3, TagCache(ttl=600, maxsize=2))
+            loader.reapply(TagCache(ttl=600, maxsize=2))
+
+        assert logger.warning.call_count == 2
+        assert "TAG_CACHE_MAX_ENTRIES" in logger.warning.call_args[0][0]
+
+
+class TestTransformWithSnapshot:
+
+    @mock_aws
+    def test_metric_transform_uses_snapshot(self, monkeypatch):
+        """A fresh sandbox enriches metrics from the snapshot alone"""
+        set_env(monkeypatch)
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.TAG_PREFETCH_ENABLED", True
+        )
+        create_broker_resources()
+        with patch("lambda_functions.generate_tag_snapshot.logger"):
+            generate_tag_snapshot.lambda_handler({}, MagicMock())
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.tag_snapshot_loader",
+            TagSnapshotLoader(snapshot_bucket, snapshot_key),
+        )
+        metric = {
+            "namespace": "AWS/S3",
+            "metric_name": "BucketSizeBytes",
+            "dimensions": {"BucketName": "cg-snap-bucket"},
+            "value": 1,
+        }
+        encoded_data = base64.b64encode(
+            (json.dumps(metric) + "\n").encode("utf-8")
+        ).decode("utf-8")
+        event = {"records": [{"recordId": "snapshot", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.prefetch_tags"
+        ) as prefetch, patch(
+            "lambda_functions.transform_lambda.fetch_tags_from_arn"
+        ) as fetch_tags_from_arn:
+            result = lambda_handler(event, MagicMock())
+
+        prefetch.assert_called_once()
+        fetch_tags_from_arn.assert_not_called()
+        output = json.loads(base64.b64decode(result["records"][0]["data"]))
+        assert output["Tags"] == {"Organization GUID": "org-s3"}
+        assert tag_cache.stats()["misses"] == 0
@@ -0,0 +1,126 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import boto3
+from moto import mock_aws
+
+from lambda_functions.tag_cache import TagCache
+from lambda_functions.tagging import prefetch_tags, resolve_concurrently
+from lambda_functions.transform_lambda import filter_tags
+
+dummy_region = "us-gov-west-1"
+
+
+def create_db(rds, name, tags):
+    rds.create_db_instance(
+        DBInstanceIdentifier=name,
+        DBInstanceClass="db.t3.micro",
+        Engine="postgres",
+        AllocatedStorage=20,
+        MasterUsername="admin",
+        MasterUserPassword="password123",
+        Tags=tags,
+    )
+    return rds.describe_db_instances(DBInstanceIdentifier=name)["DBInstances"][0][
+        "DBInstanceArn"
+    ]
+
+
+class TestPrefetchTags:
+
+    @mock_aws
+    def test_prefetch_fills_cache(self):
+        """Tagged resources are resolved through the tagging API"""
+        rds = boto3.client("rds", region_name=dummy_region)
+        tenant_arn = create_db(
+            rds,
+            "cg-aws-broker-prodtenant",
+            [{"Key": "Organization GUID", "Value": "org-1"}],
+        )
+        platform_arn = create_db(
+            rds, "cg-aws-broker-prodplatform", [{"Key": "Owner", "Value": "cg"}]
+        )
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket="cg-tenant-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        s3.put_bucket_tagging(
+            Bucket="cg-tenant-bucket",
+            Tagging={"TagSet": [{"Key": "Organization GUID", "Value": "org-2"}]},
+        )
+        untagged_arn = "arn:aws-us-gov:rds:us-gov-west-1:123456789012:db:missing"
+        bucket_arn = "arn:aws-us-gov:s3:::cg-tenant-bucket"
+
+        cache = TagCache(ttl=60)
+        tagging = boto3.client("resourcegroupstaggingapi", region_name=dummy_region)
+        resolved = prefetch_tags(
+            [tenant_arn, tenant_arn, platform_arn, bucket_arn, untagged_arn],
+            tagging,
+            cache,
+            normalize=filter_tags,
+        )
+
+        assert resolved == 3
+        assert cache.peek(tenant_arn) == {"Organization GUID": "org-1"}
+        assert cache.peek(platform_arn) == {}
+        assert cache.peek(bucket_arn) == {"Organization GUID": "org-2"}
+        # left for the per-service fallback
+        assert untagged_arn not in cache
+
+    def test_prefetch_chunks_requests(self):
+        """ARNs are sent in chunks of at most 100 and cached ARNs are skipped"""
+        cache = TagCache(ttl=60)
+        cache.put("arn:cached", {})
+        paginator = MagicMock()
+        paginator.paginate.return_value = [{"ResourceTagMappingList": []}]
+        client = MagicMock()
+        client.get_paginator.return_value = paginator
+
+        arns = [f"arn:{i}" for i in range(250)] + ["arn:cached"]
+        prefetch_tags(arns, client, cache)
+
+        sizes = [
+            len(call.kwargs["ResourceARNList"])
+            for call in paginator.paginate.call_args_list
+        ]
+        assert sizes == [100, 100, 50]
+
+    def test_prefetch_nothing_missing(self):
+        """No API call is made when every ARN is cached"""
+        cache = TagCache(ttl=60)
+        cache.put("arn:1", {})
+        client = MagicMock()
+
+        assert prefetch_tags(["arn:1"], client, cache) == 0
+        client.get_paginator.assert_not_called()
+
+
+class TestResolveConcurrently:
+
+    def test_lookups_run_in_parallel(self):
+        """Lookups overlap instead of running one after another"""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def lookup():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+        resolve_concurrently([lookup] * 8, max_workers=4)
+
+        assert max(peak) > 1
+        assert max(peak) <= 4
+
+    def test_single_worker_runs_inline(self):
+        calls = []
+        resolve_concurrently(
+            [lambda: calls.append(threading.get_ident())] * 3, max_workers=1
+        )
+        assert calls == [threading.get_ident()] * 3
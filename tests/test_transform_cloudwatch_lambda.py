@@ -7,11 +7,19 @@ import boto3
 import time
 import pytest
 from datetime import datetime
+from moto import mock_aws
 
+from lambda_functions.compact_logs import expand_object
+from lambda_functions.log_output import BatchOutput
 from lambda_functions.transform_cloudwatch_lambda import (
     lambda_handler,
     make_prefixes,
+    available_cpus,
+    decode_records,
     get_resource_tags_from_log,
+    process_logs,
+    resolve_log_group_tags,
+    tag_cache,
 )
 
 dummy_region = "us-gov-west-1"
@@ -19,6 +27,7 @@ dummy_region = "us-gov-west-1"
 
 class TestLambdaHandler:
 
+    @mock_aws
     def test_lambda_handler_single_log_line(self, monkeypatch):
         """Test processing a single log line"""
         # Sample log data as newline-delimited JSON
@@ -54,6 +63,11 @@ class TestLambdaHandler:
         monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
 
         s3 = boto3.client('s3',dummy_region)
+        # Records are only Ok once their logs are in the bucket
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
         stubber = Stubber(s3)
         bucket_name = "test-bucket"
         key = f"{datetime.now().strftime('%Y/%m/%d/%H')}/batch-{int(time.time())}.json.gz"
@@ -78,6 +92,7 @@ class TestLambdaHandler:
         assert result["records"][0]["recordId"] == "test-record-1"
         assert result["records"][0]["result"] == "Ok"
 
+    @mock_aws
     def test_lambda_handler_multiple_log_lines(self, monkeypatch):
         """Test processing multiple log lines in one record, should seperate different events"""
         log_data = {
@@ -116,6 +131,11 @@ class TestLambdaHandler:
         monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
 
         s3 = boto3.client('s3',dummy_region)
+        # Records are only Ok once their logs are in the bucket
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
         stubber = Stubber(s3)
         bucket_name = "test-bucket"
         key = f"{datetime.now().strftime('%Y/%m/%d/%H')}/batch-{int(time.time())}.json.gz"
@@ -285,3 +305,339 @@ class TestLambdaHandler:
             )
 
         assert result == {}
+
+
+class TestS3Output:
+
+    def log_document(self, instance, messages):
+        return {
+            "messageType": "DATA_MESSAGE",
+            "logGroup": f"/aws/rds/instance/{instance}/postgresql",
+            "logStream": f"{instance}.0",
+            "logEvents": [
+                {"id": str(i), "timestamp": 1759774467000 + i, "message": message}
+                for i, message in enumerate(messages)
+            ],
+        }
+
+    @mock_aws
+    def test_enriched_events_are_written_as_ndjson(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "development")
+        monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        documents = [
+            self.log_document("cg-aws-broker-devone", ["first", 'quoted "ü"']),
+            self.log_document("cg-aws-broker-devtwo", ["third"]),
+        ]
+        data = "\n".join(json.dumps(document) for document in documents)
+        encoded = base64.b64encode(gzip.compress(data.encode("utf-8")))
+        event = {"records": [{"recordId": "1", "data": encoded.decode("utf-8")}]}
+        tags = {"Organization GUID": "org"}
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            return_value=tags,
+        ):
+            result = lambda_handler(event, MagicMock())
+
+        assert result["records"][0]["result"] == "Ok"
+        (item,) = s3.list_objects_v2(Bucket="test-bucket")["Contents"]
+        body = s3.get_object(Bucket="test-bucket", Key=item["Key"])["Body"].read()
+        body = gzip.decompress(body)
+        assert [json.loads(line) for line in body.splitlines()] == [
+            {
+                "logGroup": document["logGroup"],
+                "logStream": document["logStream"],
+                "message": log_event["message"],
+                "timestamp": log_event["timestamp"],
+                "Tags": tags,
+            }
+            for document in documents
+            for log_event in document["logEvents"]
+        ]
+
+    @mock_aws
+    def test_large_batches_roll_over_to_new_objects(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "development")
+        monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
+        monkeypatch.setattr(
+            "lambda_functions.transform_cloudwatch_lambda.S3_OUTPUT_OPTIONS",
+            {"max_uncompressed_bytes": 1, "if_none_match": True},
+        )
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        records = []
+        for i in range(3):
+            document = self.log_document("cg-aws-broker-devone", [f"event {i}"])
+            data = gzip.compress(json.dumps(document).encode("utf-8"))
+            records.append(
+                {"recordId": str(i), "data": base64.b64encode(data).decode("utf-8")}
+            )
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            return_value={"Organization GUID": "org"},
+        ):
+            result = lambda_handler({"records": records}, MagicMock())
+
+        assert [record["result"] for record in result["records"]] == ["Ok"] * 3
+        listing = s3.list_objects_v2(Bucket="test-bucket")["Contents"]
+        keys = [item["Key"] for item in listing]
+        # One batch: the same start time, sandbox and invocation
+        assert len(keys) == 3
+        assert len({key.rsplit("-", 1)[0] for key in keys}) == 1
+        assert [key.rsplit("-", 1)[1] for key in keys] == [
+            "0000.json.gz",
+            "0001.json.gz",
+            "0002.json.gz",
+        ]
+        messages = []
+        for key in keys:
+            body = s3.get_object(Bucket="test-bucket", Key=key)["Body"].read()
+            for line in gzip.decompress(body).splitlines():
+                messages.append(json.loads(line)["message"])
+        assert messages == ["event 0", "event 1", "event 2"]
+
+    @mock_aws
+    def test_tenant_partitioned_output(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "development")
+        monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
+        monkeypatch.setattr(
+            "lambda_functions.transform_cloudwatch_lambda.S3_OUTPUT_PARTITION",
+            "tenant",
+        )
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        tenants = {"cg-aws-broker-devone": "org-a", "cg-aws-broker-devtwo": "org-b"}
+        records = []
+        for i, instance in enumerate(
+            ["cg-aws-broker-devone", "cg-aws-broker-devtwo", "cg-aws-broker-devone"]
+        ):
+            document = self.log_document(instance, [f"event {i}"])
+            data = gzip.compress(json.dumps(document).encode("utf-8"))
+            records.append(
+                {"recordId": str(i), "data": base64.b64encode(data).decode("utf-8")}
+            )
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            side_effect=lambda name, *args: {"Organization GUID": tenants[name]},
+        ):
+            result = lambda_handler({"records": records}, MagicMock())
+
+        assert [record["result"] for record in result["records"]] == ["Ok"] * 3
+        messages = {}
+        for tenant in ("org-a", "org-b"):
+            listing = s3.list_objects_v2(
+                Bucket="test-bucket", Prefix=f"tenants/{tenant}/"
+            )
+            (item,) = listing["Contents"]
+            body = s3.get_object(Bucket="test-bucket", Key=item["Key"])["Body"].read()
+            messages[tenant] = [
+                json.loads(line)["message"]
+                for line in gzip.decompress(body).splitlines()
+            ]
+        assert messages == {"org-a": ["event 0", "event 2"], "org-b": ["event 1"]}
+
+    @mock_aws
+    def test_compact_output_expands_to_the_full_form(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "development")
+        monkeypatch.setenv("S3_BUCKET_NAME", "test-bucket")
+        monkeypatch.setattr(
+            "lambda_functions.transform_cloudwatch_lambda.S3_OUTPUT_FORMAT",
+            "compact",
+        )
+        s3 = boto3.client("s3", region_name=dummy_region)
+        s3.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": dummy_region},
+        )
+        document = self.log_document("cg-aws-broker-devone", ["first", "second"])
+        data = gzip.compress(json.dumps(document).encode("utf-8"))
+        event = {
+            "records": [{"recordId": "1", "data": base64.b64encode(data).decode()}]
+        }
+        tags = {"Organization GUID": "org"}
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            return_value=tags,
+        ):
+            result = lambda_handler(event, MagicMock())
+
+        assert result["records"][0]["result"] == "Ok"
+        (item,) = s3.list_objects_v2(Bucket="test-bucket")["Contents"]
+        body = s3.get_object(Bucket="test-bucket", Key=item["Key"])["Body"].read()
+        assert len(gzip.decompress(body).splitlines()) == 3
+        assert list(expand_object(body)) == [
+            {
+                "logGroup": document["logGroup"],
+                "logStream": document["logStream"],
+                "message": log_event["message"],
+                "timestamp": log_event["timestamp"],
+                "Tags": tags,
+            }
+            for log_event in document["logEvents"]
+        ]
+
+    @mock_aws
+    def test_failed_upload_fails_the_records(self, monkeypatch):
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "development")
+        monkeypatch.setenv("S3_BUCKET_NAME", "missing-bucket")
+        document = self.log_document("cg-aws-broker-devone", ["first"])
+        data = base64.b64encode(gzip.compress(json.dumps(document).encode("utf-8")))
+        records = [{"recordId": "1", "data": data.decode("utf-8")}]
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            return_value={"Organization GUID": "org"},
+        ):
+            result = lambda_handler({"records": records}, MagicMock())
+
+        assert result["records"] == [
+            {"recordId": "1", "result": "ProcessingFailed", "data": records[0]["data"]}
+        ]
+
+    def test_failed_document_leaves_output_untouched(self):
+        output = BatchOutput(MagicMock())
+        out = output.buffer({})
+        out += b"earlier\n"
+        document = self.log_document("cg-aws-broker-devone", ["first"])
+        document["logEvents"].append({"timestamp": 1})
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"), patch(
+            "lambda_functions.transform_cloudwatch_lambda.get_resource_tags_from_log",
+            return_value={"Organization GUID": "org"},
+        ):
+            written = process_logs(
+                document,
+                MagicMock(),
+                dummy_region,
+                "123456",
+                "cg-aws-broker-dev",
+                output,
+            )
+
+        assert written == 0
+        assert out == b"earlier\n"
+
+
+class TestConcurrentTagResolution:
+
+    def test_resolve_log_group_tags_fetches_each_arn_once(self):
+        """Distinct broker log groups are looked up once each"""
+        documents = [
+            {"logGroup": f"/aws/rds/instance/cg-aws-broker-devdb{i % 3}/postgresql"}
+            for i in range(9)
+        ] + [{"logGroup": "/aws/rds/instance/other-db/postgresql"}]
+        client = MagicMock()
+        client.list_tags_for_resource.return_value = {
+            "TagList": [{"Key": "Organization GUID", "Value": "org"}]
+        }
+
+        with patch("lambda_functions.transform_cloudwatch_lambda.logger"):
+            resolve_log_group_tags(
+                documents, client, dummy_region, "123456", "cg-aws-broker-dev"
+            )
+
+        assert client.list_tags_for_resource.call_count == 3
+        for i in range(3):
+            arn = f"arn:aws-us-gov:rds:{dummy_region}:123456:db:cg-aws-broker-devdb{i}"
+            assert tag_cache.peek(arn) == {"Organization GUID": "org"}
+
+
+class TestDecodeRecords:
+
+    def records(self):
+        records = []
+        for i in range(12):
+            document = {"logGroup": f"/aws/rds/instance/db{i}/postgresql"}
+            data = gzip.compress(json.dumps(document).encode("utf-8"))
+            records.append(
+                {"recordId": str(i), "data": base64.b64encode(data).decode("utf-8")}
+            )
+        records[5]["data"] = base64.b64encode(b"not gzip").decode("utf-8")
+        return records
+
+    @pytest.mark.parametrize("workers", [1, 2, 6])
+    def test_results_keep_record_order(self, workers):
+        records = self.records()
+
+        decoded = decode_records(records, workers)
+
+        assert [record["recordId"] for record, _, _ in decoded] == [
+            str(i) for i in range(12)
+        ]
+        for i, (_, documents, error) in enumerate(decoded):
+            if i == 5:
+                assert documents is None and error is not None
+            else:
+                assert error is None
+                assert documents == [
+                    {"logGroup": f"/aws/rds/instance/db{i}/postgresql"}
+                ]
+
+    def test_concatenated_gzip_members_are_decoded(self):
+        documents = [
+            {"logGroup": f"/aws/rds/instance/db{i}/postgresql"} for i in range(3)
+        ]
+        data = b"".join(
+            gzip.compress(json.dumps(document).encode("utf-8") + b"\n")
+            for document in documents
+        )
+        record = {"recordId": "0", "data": base64.b64encode(data).decode("utf-8")}
+
+        assert decode_records([record], 1) == [(record, documents, None)]
+
+    def test_records_over_the_decompressed_limit_fail(self, monkeypatch):
+        monkeypatch.setattr(
+            "lambda_functions.transform_cloudwatch_lambda.MAX_DECOMPRESSED_RECORD_BYTES",
+            1024,
+        )
+        records = self.records()
+        big = {"logGroup": "/aws/rds/instance/db0/postgresql", "pad": "x" * 2048}
+        records[0]["data"] = base64.b64encode(
+            gzip.compress(json.dumps(big).encode("utf-8"))
+        ).decode("utf-8")
+
+        decoded = decode_records(records, 1)
+
+        assert decoded[0][1] is None
+        assert "exceeds the limit" in str(decoded[0][2])
+        assert decoded[1][2] is None
+
+
+@pytest.mark.parametrize(
+    "memory, cpu_count, expected",
+    [(None, 4, 4), ("128", 2, 1), ("3538", 2, 2), ("10240", 6, 5), ("10240", 2, 2)],
+)
+def test_available_cpus_follow_lambda_memory(monkeypatch, memory, cpu_count, expected):
+    if memory is None:
+        monkeypatch.delenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", raising=False)
+    else:
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", memory)
+    monkeypatch.setattr(
+        "lambda_functions.transform_cloudwatch_lambda.os.cpu_count", lambda: cpu_count
+    )
+
+    assert available_cpus() == expected
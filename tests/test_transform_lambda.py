@@ -4,6 +4,8 @@ from unittest.mock import patch, MagicMock
 from botocore.stub import Stubber
 import boto3
 import pytest
+import threading
+from moto import mock_aws
 
 from lambda_functions.transform_lambda import (
     lambda_handler,
@@ -11,6 +13,13 @@ from lambda_functions.transform_lambda import (
     default_keys_to_remove,
     get_resource_tags_from_metric,
     make_prefixes,
+    get_runtime,
+    tag_cache,
+    resolve_batch_tags,
+    fetch_tags_from_arn,
+    prewarm_tag_cache,
+    decode_metrics,
+    encode_metrics,
 )
 
 dummy_region = "us-gov-west-1"
@@ -117,6 +126,10 @@ class TestLambdaHandler:
 
         monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
         monkeypatch.setenv("ACCOUNT_ID", "123456")
+        # The bucket is not a broker bucket; only the mocked lookup tags it
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.METRIC_PREFILTER_ENABLED", False
+        )
         with patch("lambda_functions.transform_lambda.logger"), patch(
             "lambda_functions.transform_lambda.get_resource_tags_from_metric",
             return_value=mock_tags,
@@ -1301,3 +1314,551 @@ class TestLambdaHandler:
             )
 
         assert result == {}
+
+
+class TestRuntimeContext:
+
+    def test_runtime_reused_across_invocations(self, monkeypatch):
+        """Warm invocations reuse the clients built by the first one"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        event = {"records": []}
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "boto3.client", return_value=MagicMock()
+        ) as mock_client:
+            lambda_handler(event, MagicMock())
+            lambda_handler(event, MagicMock())
+
+        assert mock_client.call_count == 4
+        runtime = get_runtime()
+        assert runtime.rds_prefix == "cg-aws-broker-prod"
+        assert runtime.account_id == "123456"
+
+    def test_runtime_clients_use_adaptive_retries(self, monkeypatch):
+        """Clients are built with keep-alive, pooling and adaptive retries"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        monkeypatch.setenv("BOTO_MAX_POOL_CONNECTIONS", "8")
+
+        config = get_runtime().rds_client.meta.config
+        assert config.tcp_keepalive is True
+        assert config.max_pool_connections == 8
+        assert config.retries["mode"] == "adaptive"
+
+    def test_missing_account_id_is_not_cached(self, monkeypatch):
+        """A failed configuration returns no records and is retried next time"""
+        monkeypatch.setenv("AWS_REGION", "us-gov-west-1")
+        monkeypatch.delenv("ACCOUNT_ID", raising=False)
+
+        with patch("lambda_functions.transform_lambda.logger") as mock_logger:
+            result = lambda_handler({"records": []}, MagicMock())
+
+        assert result == {"records": []}
+        mock_logger.error.assert_called()
+
+        monkeypatch.setenv("ACCOUNT_ID", "123456")
+        assert get_runtime().account_id == "123456"
+
+
+class TestTagCacheIntegration:
+
+    def test_tags_cached_across_clients(self, monkeypatch):
+        """A new client does not cause tags to be fetched again"""
+        metric_data = {
+            "namespace": "AWS/RDS",
+            "metric_name": "CPUUtilization",
+            "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-prodcached"},
+        }
+        fake_tags = {
+            "TagList": [
+                {"Key": "Organization GUID", "Value": "cloudgovtests"},
+            ]
+        }
+        first_client = boto3.client("rds", region_name=dummy_region)
+        stubber = Stubber(first_client)
+        stubber.add_response("list_tags_for_resource", fake_tags)
+        stubber.activate()
+        # no responses queued: any call on this client would fail
+        second_client = boto3.client("rds", region_name=dummy_region)
+        Stubber(second_client).activate()
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            for client in (first_client, second_client):
+                result = get_resource_tags_from_metric(
+                    metric_data,
+                    dummy_region,
+                    "s3_client",
+                    "cg-",
+                    "es_client",
+                    "cg-broker",
+                    client,
+                    "cg-aws-broker-prod",
+                    123456,
+                )
+                assert result == {"Organization GUID": "cloudgovtests"}
+
+        stubber.assert_no_pending_responses()
+
+
+class TestTagPrefetch:
+
+    @mock_aws
+    def test_lambda_handler_prefetches_batch_tags(self, monkeypatch):
+        """Tags for the batch come from the tagging API, not per-resource calls"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.TAG_PREFETCH_ENABLED", True
+        )
+        rds = boto3.client("rds", region_name=dummy_region)
+        metrics = []
+        for i in range(3):
+            rds.create_db_instance(
+                DBInstanceIdentifier=f"cg-aws-broker-prod{i}",
+                DBInstanceClass="db.t3.micro",
+                Engine="postgres",
+                AllocatedStorage=20,
+                MasterUsername="admin",
+                MasterUserPassword="password123",
+                Tags=[{"Key": "Organization GUID", "Value": f"org-{i}"}],
+            )
+            metrics.append(
+                {
+                    "namespace": "AWS/RDS",
+                    "metric_name": "CPUUtilization",
+                    "dimensions": {"DBInstanceIdentifier": f"cg-aws-broker-prod{i}"},
+                    "value": i,
+                }
+            )
+        ndjson_data = "\n".join([json.dumps(metric) for metric in metrics]) + "\n"
+        encoded_data = base64.b64encode(ndjson_data.encode("utf-8")).decode("utf-8")
+        event = {"records": [{"recordId": "prefetch", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.fetch_tags_from_arn"
+        ) as fallback:
+            result = lambda_handler(event, MagicMock())
+
+        fallback.assert_not_called()
+        output_data = base64.b64decode(result["records"][0]["data"]).decode("utf-8")
+        output_metrics = [json.loads(line) for line in output_data.strip().split("\n")]
+        assert [m["Tags"]["Organization GUID"] for m in output_metrics] == [
+            "org-0",
+            "org-1",
+            "org-2",
+        ]
+        assert tag_cache.stats()["hits"] == 3
+
+
+class TestConcurrentTagResolution:
+
+    def test_resolve_batch_tags_fetches_each_resource_once(self):
+        """Every distinct resource is fetched once, with sizes for tenant DBs"""
+        runtime = MagicMock(
+            region=dummy_region,
+            account_id="123456",
+            rds_prefix="cg-aws-broker-prod",
+            s3_prefix="cg-",
+            domain_prefix="cg-broker-prd-",
+        )
+        runtime.rds_client.list_tags_for_resource.return_value = {
+            "TagList": [{"Key": "Organization GUID", "Value": "org"}]
+        }
+        runtime.rds_client.describe_db_instances.return_value = {
+            "DBInstances": [{"AllocatedStorage": 20}]
+        }
+        runtime.es_client.list_tags.return_value = {"TagList": []}
+        runtime.s3_client.get_bucket_tagging.return_value = {"TagSet": []}
+        runtime.client.side_effect = lambda service: getattr(
+            runtime, f"{service}_client"
+        )
+        metrics = []
+        for _ in range(5):
+            metrics += [
+                {
+                    "namespace": "AWS/RDS",
+                    "metric_name": "FreeStorageSpace",
+                    "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-proddb"},
+                },
+                {
+                    "namespace": "AWS/ES",
+                    "dimensions": {"DomainName": "cg-broker-prd-domain"},
+                },
+                {"namespace": "AWS/S3", "dimensions": {"BucketName": "cg-bucket"}},
+            ]
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            resolve_batch_tags(metrics, runtime)
+
+        assert runtime.rds_client.list_tags_for_resource.call_count == 1
+        assert runtime.rds_client.describe_db_instances.call_count == 1
+        assert runtime.es_client.list_tags.call_count == 1
+        assert runtime.s3_client.get_bucket_tagging.call_count == 1
+        assert tag_cache.peek(("AllocatedStorage", "cg-aws-broker-proddb")) == 20
+
+
+class TestNegativeTagCache:
+
+    def test_deleted_instance_is_negatively_cached(self):
+        """A deleted instance is not queried again on the next metric"""
+        metric_data = {
+            "namespace": "AWS/RDS",
+            "metric_name": "CPUUtilization",
+            "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-prodgone"},
+        }
+        rds_client = boto3.client("rds", region_name=dummy_region)
+        stubber = Stubber(rds_client)
+        stubber.add_client_error(
+            "list_tags_for_resource", service_error_code="DBInstanceNotFound"
+        )
+        stubber.activate()
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            for _ in range(3):
+                result = get_resource_tags_from_metric(
+                    metric_data,
+                    dummy_region,
+                    "s3_client",
+                    "cg-",
+                    "es_client",
+                    "cg-broker",
+                    rds_client,
+                    "cg-aws-broker-prod",
+                    123456,
+                )
+                assert result == {}
+
+        stubber.assert_no_pending_responses()
+        assert tag_cache.stats()["negative_stored"]["not_found"] == 1
+        assert tag_cache.stats()["negative_hits"]["not_found"] == 2
+
+    def test_missing_bucket_tag_set_is_negatively_cached(self):
+        """NoSuchTagSet is cached as an untagged bucket"""
+        metric_data = {
+            "namespace": "AWS/S3",
+            "dimensions": {"BucketName": "cg-untagged"},
+        }
+        s3_client = boto3.client("s3", region_name=dummy_region)
+        stubber = Stubber(s3_client)
+        stubber.add_client_error(
+            "get_bucket_tagging", service_error_code="NoSuchTagSet"
+        )
+        stubber.activate()
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            for _ in range(2):
+                result = get_resource_tags_from_metric(
+                    metric_data,
+                    dummy_region,
+                    s3_client,
+                    "cg-",
+                    "es_client",
+                    "cg-broker",
+                    "rds_client",
+                    "cg-aws-broker-prod",
+                    123456,
+                )
+                assert result == {}
+
+        assert tag_cache.stats()["negative_stored"]["no_tags"] == 1
+
+
+class TestRdsInventoryMode:
+
+    @mock_aws
+    def test_lambda_handler_reads_rds_inventory(self, monkeypatch):
+        """Tags and db_size come from the inventory, not per-instance calls"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.RDS_INVENTORY_ENABLED", True
+        )
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.TAG_PREFETCH_ENABLED", False
+        )
+        rds = boto3.client("rds", region_name=dummy_region)
+        rds.create_db_instance(
+            DBInstanceIdentifier="cg-aws-broker-prodinventory",
+            DBInstanceClass="db.t3.micro",
+            Engine="postgres",
+            AllocatedStorage=75,
+            MasterUsername="admin",
+            MasterUserPassword="password123",
+            Tags=[{"Key": "Organization GUID", "Value": "org-1"}],
+        )
+        metric = {
+            "namespace": "AWS/RDS",
+            "metric_name": "FreeStorageSpace",
+            "dimensions": {"DBInstanceIdentifier": "cg-aws-broker-prodinventory"},
+            "value": 1,
+        }
+        ndjson_data = json.dumps(metric) + "\n"
+        encoded_data = base64.b64encode(ndjson_data.encode("utf-8")).decode("utf-8")
+        event = {"records": [{"recordId": "inventory", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.fetch_tags_from_arn"
+        ) as fetch_tags, patch(
+            "lambda_functions.transform_lambda.fetch_rds_allocated_storage"
+        ) as fetch_size:
+            result = lambda_handler(event, MagicMock())
+
+        fetch_tags.assert_not_called()
+        fetch_size.assert_not_called()
+        output = json.loads(base64.b64decode(result["records"][0]["data"]))
+        assert output["Tags"] == {"Organization GUID": "org-1", "db_size": 75}
+
+
+class TestDomainInventoryMode:
+
+    @mock_aws
+    def test_lambda_handler_adds_domain_sizing(self, monkeypatch):
+        """Domain tags are fetched once at refresh and sizing is attached"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda.DOMAIN_INVENTORY_ENABLED", True
+        )
+        es = boto3.client("es", region_name=dummy_region)
+        domain = es.create_elasticsearch_domain(
+            DomainName="cg-broker-prd-tenant",
+            ElasticsearchClusterConfig={"InstanceCount": 2},
+            EBSOptions={"EBSEnabled": True, "VolumeSize": 20, "VolumeType": "gp2"},
+        )
+        es.add_tags(
+            ARN=domain["DomainStatus"]["ARN"],
+            TagList=[{"Key": "Organization GUID", "Value": "org-1"}],
+        )
+        metrics = [
+            {
+                "namespace": "AWS/ES",
+                "metric_name": metric_name,
+                "dimensions": {"DomainName": "cg-broker-prd-tenant"},
+                "value": 1,
+            }
+            for metric_name in ["FreeStorageSpace", "CPUUtilization"] * 5
+        ]
+        ndjson_data = "\n".join([json.dumps(metric) for metric in metrics]) + "\n"
+        encoded_data = base64.b64encode(ndjson_data.encode("utf-8")).decode("utf-8")
+        event = {"records": [{"recordId": "domains", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"), patch(
+            "lambda_functions.transform_lambda.fetch_tags_from_arn",
+            wraps=fetch_tags_from_arn,
+        ) as fetch_tags:
+            result = lambda_handler(event, MagicMock())
+
+        assert fetch_tags.call_count == 1
+        output_data = base64.b64decode(result["records"][0]["data"]).decode("utf-8")
+        output_metrics = [json.loads(line) for line in output_data.strip().split("\n")]
+        assert output_metrics[0]["Tags"] == {
+            "Organization GUID": "org-1",
+            "domain_instance_count": 2,
+            "domain_volume_size": 20,
+        }
+        assert output_metrics[1]["Tags"] == {"Organization GUID": "org-1"}
+
+    @mock_aws
+    def test_warmed_inventory_adds_no_sizing_when_disabled(self, monkeypatch):
+        """Sizing from the init warm-up is never refreshed, so it is not used"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        es = boto3.client("es", region_name=dummy_region)
+        domain = es.create_elasticsearch_domain(
+            DomainName="cg-broker-prd-tenant",
+            ElasticsearchClusterConfig={"InstanceCount": 2},
+            EBSOptions={"EBSEnabled": True, "VolumeSize": 20, "VolumeType": "gp2"},
+        )
+        es.add_tags(
+            ARN=domain["DomainStatus"]["ARN"],
+            TagList=[{"Key": "Organization GUID", "Value": "org-1"}],
+        )
+        metric = {
+            "namespace": "AWS/ES",
+            "metric_name": "FreeStorageSpace",
+            "dimensions": {"DomainName": "cg-broker-prd-tenant"},
+            "value": 1,
+        }
+        encoded_data = base64.b64encode(json.dumps(metric).encode("utf-8")).decode(
+            "utf-8"
+        )
+        event = {"records": [{"recordId": "domains", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            prewarm_tag_cache(get_runtime(), budget_ms=10000)
+            result = lambda_handler(event, MagicMock())
+
+        output = json.loads(base64.b64decode(result["records"][0]["data"]))
+        assert output["Tags"] == {"Organization GUID": "org-1"}
+
+
+class TestTagCachePrewarm:
+
+    @mock_aws
+    def test_prewarm_fills_cache_for_broker_resources(self, monkeypatch):
+        """RDS instances, domains and buckets for the environment are cached"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        rds = boto3.client("rds", region_name=dummy_region)
+        rds.create_db_instance(
+            DBInstanceIdentifier="cg-aws-broker-prodwarm",
+            DBInstanceClass="db.t3.micro",
+            Engine="postgres",
+            AllocatedStorage=20,
+            MasterUsername="admin",
+            MasterUserPassword="password123",
+            Tags=[{"Key": "Organization GUID", "Value": "org-rds"}],
+        )
+        es = boto3.client("es", region_name=dummy_region)
+        domain_arn = es.create_elasticsearch_domain(DomainName="cg-broker-prd-warm")[
+            "DomainStatus"
+        ]["ARN"]
+        es.add_tags(
+            ARN=domain_arn, TagList=[{"Key": "Organization GUID", "Value": "org-es"}]
+        )
+        s3 = boto3.client("s3", region_name=dummy_region)
+        for bucket in ["cg-warm-bucket", "staging-cg-other"]:
+            s3.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={"LocationConstraint": dummy_region},
+            )
+            s3.put_bucket_tagging(
+                Bucket=bucket,
+                Tagging={"TagSet": [{"Key": "Organization GUID", "Value": "org-s3"}]},
+            )
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            stats = prewarm_tag_cache(get_runtime(), budget_ms=10000)
+
+        assert stats["timed_out"] is False
+        assert 0 < stats["elapsed_ms"] <= 10000
+        rds_arn = (
+            "arn:aws-us-gov:rds:us-gov-west-1:123456789012:db:cg-aws-broker-prodwarm"
+        )
+        assert tag_cache.peek(rds_arn) == {"Organization GUID": "org-rds"}
+        assert tag_cache.peek(domain_arn) == {"Organization GUID": "org-es"}
+        assert tag_cache.peek("arn:aws-us-gov:s3:::cg-warm-bucket") == {
+            "Organization GUID": "org-s3"
+        }
+        assert "arn:aws-us-gov:s3:::staging-cg-other" not in tag_cache
+
+    def test_prewarm_stops_waiting_at_budget(self):
+        """A slow enumeration does not hold init past the budget"""
+        release = threading.Event()
+        runtime = MagicMock(rds_prefix="cg-aws-broker-prod", s3_prefix="cg-")
+        runtime.rds_client.get_paginator.return_value.paginate.side_effect = (
+            lambda: release.wait(5) and []
+        )
+        runtime.es_client.list_domain_names.return_value = {"DomainNames": []}
+        runtime.s3_client.list_buckets.return_value = {"Buckets": []}
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            stats = prewarm_tag_cache(runtime, budget_ms=50)
+        release.set()
+
+        assert stats["timed_out"] is True
+        assert stats["budget_ms"] == 50
+
+
+class TestNamespaceResolvers:
+
+    @mock_aws
+    def test_lambda_handler_enriches_registered_namespaces(self, monkeypatch):
+        """SQS and DynamoDB metrics are tagged through their resolvers"""
+        monkeypatch.setenv("AWS_REGION", dummy_region)
+        monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+        monkeypatch.setenv("ENVIRONMENT", "production")
+        sqs = boto3.client("sqs", region_name=dummy_region)
+        sqs.create_queue(
+            QueueName="cg-aws-broker-prodqueue",
+            tags={"Organization GUID": "org-sqs"},
+        )
+        dynamodb = boto3.client("dynamodb", region_name=dummy_region)
+        dynamodb.create_table(
+            TableName="cg-aws-broker-prodtable",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+            Tags=[{"Key": "Organization GUID", "Value": "org-ddb"}],
+        )
+        metrics = [
+            {
+                "namespace": "AWS/SQS",
+                "metric_name": "NumberOfMessagesSent",
+                "dimensions": {"QueueName": "cg-aws-broker-prodqueue"},
+                "value": 1,
+            },
+            {
+                "namespace": "AWS/DynamoDB",
+                "metric_name": "ConsumedReadCapacityUnits",
+                "dimensions": {"TableName": "cg-aws-broker-prodtable"},
+                "value": 2,
+            },
+            {
+                "namespace": "AWS/SQS",
+                "metric_name": "NumberOfMessagesSent",
+                "dimensions": {"QueueName": "tenant-queue"},
+                "value": 3,
+            },
+        ]
+        ndjson_data = "\n".join([json.dumps(metric) for metric in metrics]) + "\n"
+        encoded_data = base64.b64encode(ndjson_data.encode("utf-8")).decode("utf-8")
+        event = {"records": [{"recordId": "resolvers", "data": encoded_data}]}
+
+        with patch("lambda_functions.transform_lambda.logger"):
+            result = lambda_handler(event, MagicMock())
+
+        output_data = base64.b64decode(result["records"][0]["data"]).decode("utf-8")
+        output_metrics = [json.loads(line) for line in output_data.strip().split("\n")]
+        assert [m["Tags"] for m in output_metrics] == [
+            {"Organization GUID": "org-sqs"},
+            {"Organization GUID": "org-ddb"},
+        ]
+
+    def test_unknown_namespace_is_reported_once(self, monkeypatch):
+        monkeypatch.setattr(
+            "lambda_functions.transform_lambda._unknown_namespaces", set()
+        )
+        metric = {"namespace": "AWS/EC2", "metric_name": "CPUUtilization"}
+
+        with patch("lambda_functions.transform_lambda.logger") as logger:
+            for _ in range(3):
+                assert (
+                    process_metric(metric, dummy_region, "", "", "", "", "", "", 1)
+                    is None
+                )
+
+        assert logger.error.call_count == 1
+
+
+class TestRecordPipeline:
+
+    def test_decode_metrics_drops_stream_keys(self):
+        lines = [
+            {"metric_stream_name": "s", "namespace": "AWS/S3", "value": 1},
+            {"account_id": "1", "region": "r", "namespace": "AWS/ES", "value": 2},
+        ]
+        data = "\r\n".join(json.dumps(line) for line in lines) + "\r\n \n"
+        encoded = base64.b64encode(data.encode("utf-8")).decode("utf-8")
+
+        assert decode_metrics(encoded) == [
+            {"namespace": "AWS/S3", "value": 1},
+            {"namespace": "AWS/ES", "value": 2},
+        ]
+
+    def test_encode_metrics_writes_base64_ndjson(self):
+        metrics = [{"namespace": "AWS/S3", "Tags": {"Owner": "ü"}}, {"value": 2}]
+
+        encoded = encode_metrics(metrics)
+
+        lines = base64.b64decode(encoded).decode("utf-8").split("\n")
+        assert lines[-1] == ""
+        assert [json.loads(line) for line in lines[:-1]] == metrics
+        assert decode_metrics(encoded) == metrics